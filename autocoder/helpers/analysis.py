@@ -0,0 +1,312 @@
+import ast
+import builtins
+import os
+import symtable
+import sys
+
+from autocoder.helpers.fingerprint import resolve_module
+from autocoder.helpers.validation import parse_code
+
+# Names every module has without defining them
+implicit_module_names = {
+    "__annotations__",
+    "__builtins__",
+    "__cached__",
+    "__doc__",
+    "__file__",
+    "__loader__",
+    "__name__",
+    "__package__",
+    "__path__",
+    "__spec__",
+}
+
+builtin_names = set(dir(builtins)) | implicit_module_names
+
+stdlib_modules = set(getattr(sys, "stdlib_module_names", sys.builtin_module_names))
+
+
+def get_scopes(parsed):
+    """
+    Returns what the symbol tables say about parsed code, computing it on first use:
+    the names bound at module level, the global names that are used but never bound,
+    and whether the module can get names from elsewhere (a star import or a module __getattr__).
+    None if the code doesn't compile.
+    """
+    if "scopes" not in parsed:
+        parsed["scopes"] = build_scopes(parsed)
+    return parsed["scopes"]
+
+
+def build_scopes(parsed):
+    if parsed["tree"] is None:
+        return None
+    try:
+        top = symtable.symtable(parsed["source"], "<string>", "exec")
+    except (SyntaxError, ValueError):
+        return None
+
+    defined = set()
+    used = set()
+    tables = [top]
+    while tables:
+        table = tables.pop()
+        for symbol in table.get_symbols():
+            name = symbol.get_name()
+            if table is top and symbol.is_local():
+                defined.add(name)
+            elif symbol.is_declared_global() and symbol.is_assigned():
+                # global name inside a function, then assigned
+                defined.add(name)
+            if symbol.is_global() and symbol.is_referenced():
+                used.add(name)
+        tables.extend(table.get_children())
+
+    open_namespace = "__getattr__" in defined or any(
+        "*" in entry["names"] for entry in parsed["facts"]["imports"]
+    )
+    return {
+        "defined": defined,
+        "undefined": used - defined - builtin_names,
+        "open_namespace": open_namespace,
+        "table": top,
+    }
+
+
+# Symbol table names of the expressions that have their own scope
+scope_table_names = {
+    ast.ListComp: "listcomp",
+    ast.SetComp: "setcomp",
+    ast.DictComp: "dictcomp",
+    ast.GeneratorExp: "genexpr",
+    ast.Lambda: "lambda",
+}
+
+
+def is_global_in(tables, name):
+    """Checks if a name refers to a global in the innermost of a chain of scopes that knows it."""
+    for table in reversed(tables):
+        try:
+            return table.lookup(name).is_global()
+        except KeyError:
+            continue
+    return True
+
+
+def first_global_use(tree, top, names):
+    """Returns the first line each of names is read on as a global."""
+    lines = {}
+    stack = [(tree, [top])]
+    while stack:
+        node, tables = stack.pop()
+        if (
+            isinstance(node, ast.Name)
+            and isinstance(node.ctx, ast.Load)
+            and node.id in names
+            and is_global_in(tables, node.id)
+        ):
+            lines[node.id] = min(lines.get(node.id, node.lineno), node.lineno)
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            name = node.name
+        else:
+            name = scope_table_names.get(type(node))
+        if name is not None:
+            for child in tables[-1].get_children():
+                if child.get_name() == name and child.get_lineno() == node.lineno:
+                    tables = tables + [child]
+                    break
+
+        for child in ast.iter_child_nodes(node):
+            stack.append((child, tables))
+    return lines
+
+
+def undefined_name_errors(parsed):
+    """Returns an error for every global name the code reads but never defines or imports."""
+    scopes = get_scopes(parsed)
+    if scopes is None or scopes["open_namespace"] or len(scopes["undefined"]) == 0:
+        return []
+    lines = first_global_use(parsed["tree"], scopes["table"], scopes["undefined"])
+    errors = []
+    for name in sorted(scopes["undefined"], key=lambda name: (lines.get(name, 0), name)):
+        line = lines.get(name)
+        prefix = f"Line {line}: " if line is not None else ""
+        if name in stdlib_modules:
+            errors.append(f"{prefix}{name} is used but never imported. Add import {name} at the top of the file.")
+        else:
+            errors.append(f"{prefix}name '{name}' is not defined.")
+    return errors
+
+
+def undefined_names_rule(parsed):
+    errors = undefined_name_errors(parsed)
+    if len(errors) > 0:
+        return "Static analysis found names that are used but never defined:\n" + "\n".join(errors)
+
+
+# Rules that find definite errors, checked before the validation rules
+analysis_rules = [
+    undefined_names_rule,
+]
+
+
+def local_module_names(path):
+    """Returns the names a project module defines, or None if that can't be known statically."""
+    try:
+        with open(path, "r") as f:
+            code = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    scopes = get_scopes(parse_code(code))
+    if scopes is None or scopes["open_namespace"]:
+        return None
+    return scopes["defined"]
+
+
+def local_import_errors(path, code, project_dir):
+    """
+    Checks a file's imports of other project files: relative imports and modules inside local
+    packages that don't exist, names imported from a local module that it doesn't define,
+    and module.name uses where the local module has no such name.
+    Imports that don't point into the project are left to the interpreter.
+    """
+    parsed = parse_code(code)
+    if parsed["tree"] is None:
+        return []
+
+    file_dir = os.path.dirname(os.path.abspath(path))
+    search_dirs = [file_dir, os.path.abspath(project_dir)]
+    errors = []
+    aliases = {}
+    for entry in parsed["facts"]["imports"]:
+        module = entry["module"] or ""
+        dirs = search_dirs
+        if entry["level"] > 0:
+            base = file_dir
+            for _ in range(entry["level"] - 1):
+                base = os.path.dirname(base)
+            dirs = [base]
+        elif resolve_module(module.split(".")[0], dirs) is None:
+            # Not a project module
+            continue
+
+        relative = "." * entry["level"]
+        if module:
+            resolved = resolve_module(module, dirs)
+            if resolved is None:
+                errors.append(
+                    f"Line {entry['lineno']}: cannot import {relative}{module}, there is no such file in the project."
+                )
+                continue
+        else:
+            # from . import name, the names come from the package's __init__.py
+            init = os.path.join(dirs[0], "__init__.py")
+            resolved = init if os.path.isfile(init) else None
+
+        if len(entry["names"]) == 0:
+            # import module [as alias], module.name is checked below
+            if entry["asname"] is not None:
+                aliases[entry["asname"]] = (module, resolved)
+            elif "." not in module:
+                aliases[module] = (module, resolved)
+            continue
+
+        defined = local_module_names(resolved) if resolved is not None else set()
+        for name in entry["names"]:
+            if name == "*" or resolve_module(f"{module}.{name}" if module else name, dirs) is not None:
+                continue
+            if defined is not None and name not in defined:
+                source = os.path.basename(resolved) if resolved is not None else "the package"
+                errors.append(
+                    f"Line {entry['lineno']}: cannot import {name} from {relative}{module}, "
+                    f"{source} has no function, class or variable called {name}."
+                )
+
+    if len(aliases) > 0:
+        # Names rebound in this file no longer refer to the module
+        rebound = set()
+        for node in ast.walk(parsed["tree"]):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load) and node.id in aliases:
+                rebound.add(node.id)
+            elif isinstance(node, ast.arg) and node.arg in aliases:
+                rebound.add(node.arg)
+        reported = set()
+        for node in ast.walk(parsed["tree"]):
+            if (
+                isinstance(node, ast.Attribute)
+                and isinstance(node.ctx, ast.Load)
+                and isinstance(node.value, ast.Name)
+                and node.value.id in aliases
+                and node.value.id not in rebound
+            ):
+                module, resolved = aliases[node.value.id]
+                defined = local_module_names(resolved)
+                if (
+                    defined is not None
+                    and node.attr not in defined
+                    and resolve_module(f"{module}.{node.attr}", search_dirs) is None
+                    and (module, node.attr) not in reported
+                ):
+                    reported.add((module, node.attr))
+                    errors.append(
+                        f"Line {node.lineno}: {node.value.id}.{node.attr} does not exist, "
+                        f"{os.path.basename(resolved)} has no function, class or variable called {node.attr}."
+                    )
+    return errors
+
+
+def is_main_guard(node):
+    """Checks if a statement is if __name__ == "__main__":"""
+    return (
+        isinstance(node, ast.If)
+        and isinstance(node.test, ast.Compare)
+        and isinstance(node.test.left, ast.Name)
+        and node.test.left.id == "__name__"
+        and len(node.test.comparators) == 1
+        and isinstance(node.test.comparators[0], ast.Constant)
+        and node.test.comparators[0].value == "__main__"
+    )
+
+
+def is_run_statement(node):
+    """Checks if a module level statement does something when the module is imported, beyond defining names."""
+    if isinstance(node, ast.Expr):
+        return isinstance(node.value, (ast.Call, ast.Await))
+    if isinstance(node, ast.If):
+        return not is_main_guard(node)
+    return isinstance(node, (ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try))
+
+
+def main_guard_errors(code, imported_by_tests=False):
+    """
+    Checks that main.py starts the program under if __name__ == "__main__":. Code at module level
+    runs whenever main.py is imported, which hangs or breaks the tests that import it, and a main
+    function that is never called means running main.py does nothing.
+    """
+    parsed = parse_code(code)
+    if parsed["tree"] is None:
+        return []
+    body = parsed["tree"].body
+    if any(is_main_guard(node) for node in body):
+        return []
+
+    errors = []
+    runs = [node for node in body if is_run_statement(node)]
+    if imported_by_tests and len(runs) > 0:
+        errors.append(
+            f"Line {runs[0].lineno}: main.py runs code when it is imported, and the tests import it. "
+            'Put the code that runs the program under if __name__ == "__main__": at the bottom of the file.'
+        )
+    defines_main = any(
+        isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "main" for node in body
+    )
+    calls_main = any(
+        isinstance(node, ast.Name) and node.id == "main" and isinstance(node.ctx, ast.Load)
+        for node in ast.walk(parsed["tree"])
+    )
+    if defines_main and not calls_main:
+        errors.append(
+            'main.py defines main() but never calls it. Call it under if __name__ == "__main__": at the bottom of the file.'
+        )
+    return errors
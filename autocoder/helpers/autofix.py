@@ -0,0 +1,289 @@
+import ast
+import os
+import re
+import textwrap
+
+from agentlogger import log
+
+from autocoder.helpers.analysis import is_main_guard, is_run_statement, stdlib_modules
+from autocoder.helpers.code import compile_code, save_code
+from autocoder.helpers.stall import fingerprint
+
+
+def fixer(name, pattern, fix):
+    """
+    Describes an automatic fix for autofix_project.
+
+    pattern is a regular expression matched against the errors of a file. For every match,
+    fix(code, match, file_dict, context) returns the fixed code, or None if it doesn't apply.
+    """
+    return {"name": name, "pattern": re.compile(pattern), "fix": fix}
+
+
+def get_indent(line):
+    return line[: len(line) - len(line.lstrip())]
+
+
+def insert_import(code, statement):
+    """Adds an import statement after the docstring and imports at the top of the code."""
+    tree = ast.parse(code)
+    lines = code.split("\n")
+    position = 0
+    for index, node in enumerate(tree.body):
+        is_docstring = (
+            index == 0
+            and isinstance(node, ast.Expr)
+            and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, str)
+        )
+        if not is_docstring and not isinstance(node, (ast.Import, ast.ImportFrom)):
+            break
+        position = node.end_lineno
+    if position == 0:
+        # Keep a shebang or encoding line first
+        while position < len(lines) and lines[position].startswith("#") and (
+            lines[position].startswith("#!") or "coding" in lines[position]
+        ):
+            position += 1
+    lines[position:position] = [statement]
+    return "\n".join(lines)
+
+
+def imports_module(tree, module):
+    return any(
+        isinstance(node, ast.Import) and any(alias.name == module and alias.asname is None for alias in node.names)
+        for node in ast.walk(tree)
+    )
+
+
+def fix_stdlib_import(code, match, file_dict, context):
+    """name is a standard library module that was used without importing it."""
+    name = match.group(1) or match.group(2)
+    if name not in stdlib_modules or imports_module(ast.parse(code), name):
+        return None
+    return insert_import(code, f"import {name}")
+
+
+def find_local_module(context, name):
+    """Returns the project file for a module name, looked up by its last part, if exactly one file matches."""
+    last = name.lstrip(".").split(".")[-1]
+    matches = []
+    for file_dict in context["project_code"]:
+        path = os.path.abspath(file_dict["absolute_path"])
+        stem, _ = os.path.splitext(os.path.basename(path))
+        if stem == last:
+            matches.append(path[: -len(".py")])
+        elif stem == "__init__" and os.path.basename(os.path.dirname(path)) == last:
+            matches.append(os.path.dirname(path))
+    return matches[0] if len(matches) == 1 else None
+
+
+def fix_local_import(code, match, file_dict, context):
+    """A local module was imported by a name that doesn't lead to it from the importing file."""
+    name = match.group(1) or match.group(2)
+    found = find_local_module(context, name)
+    if found is None:
+        return None
+    relative = os.path.relpath(found, os.path.dirname(os.path.abspath(file_dict["absolute_path"])))
+    if relative.startswith(".."):
+        return None
+    module = relative.replace(os.sep, ".")
+    if module == name:
+        return None
+
+    tree = ast.parse(code)
+    lines = code.split("\n")
+    level = len(name) - len(name.lstrip("."))
+    replaced = False
+    # Bottom up, so line numbers above stay valid
+    for node in sorted(ast.walk(tree), key=lambda node: getattr(node, "lineno", 0), reverse=True):
+        if isinstance(node, ast.ImportFrom) and node.module == name.lstrip(".") and node.level == level:
+            new = ast.ImportFrom(module=module, names=node.names, level=0)
+        elif isinstance(node, ast.Import) and "." not in name and any(alias.name == name for alias in node.names):
+            # import helper becomes import package.helper as helper
+            names = [
+                ast.alias(name=module, asname=alias.asname or name) if alias.name == name else alias
+                for alias in node.names
+            ]
+            new = ast.Import(names=names)
+        else:
+            continue
+        if node.lineno != node.end_lineno:
+            continue
+        line = lines[node.lineno - 1]
+        lines[node.lineno - 1] = line[: node.col_offset] + ast.unparse(new) + line[node.end_col_offset :]
+        replaced = True
+    return "\n".join(lines) if replaced else None
+
+
+def fix_main_guard(code, match, file_dict, context):
+    """Moves the code that runs the program under if __name__ == "__main__": or adds one that calls main()."""
+    tree = ast.parse(code)
+    if any(is_main_guard(node) for node in tree.body):
+        return None
+    lines = code.rstrip().split("\n")
+    runs = [index for index, node in enumerate(tree.body) if is_run_statement(node)]
+    definitions = [
+        index
+        for index, node in enumerate(tree.body)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+    if len(runs) > 0:
+        # Moving code from between definitions would change the order things run in
+        if len(definitions) > 0 and runs[0] < definitions[-1]:
+            return None
+        start = tree.body[runs[0]].lineno - 1
+        body = lines[start:]
+        lines = lines[:start]
+    elif any(getattr(tree.body[index], "name", None) == "main" for index in definitions):
+        body = ["main()"]
+    else:
+        return None
+
+    while len(lines) > 0 and lines[-1].strip() == "":
+        lines.pop()
+    lines += ["", "", 'if __name__ == "__main__":']
+    lines += [textwrap.indent(line, "    ") if line.strip() != "" else "" for line in body]
+    return "\n".join(lines) + "\n"
+
+
+def fix_indentation(code, match, file_dict, context):
+    """
+    Re-indents the lines of the last replace_code edit when they were indented wrong.
+    Only while the file is as the edit left it, and the indentation error is in the edit or on the
+    line after it, so code the model didn't just write is never moved into or out of a block.
+    """
+    last_edit = context.get("last_edit")
+    if last_edit is None or os.path.abspath(last_edit["path"]) != os.path.abspath(file_dict["absolute_path"]):
+        return None
+    if last_edit.get("fingerprint") != fingerprint(code):
+        # Something else changed the file since
+        return None
+    lines = code.split("\n")
+    start = last_edit["start_line"] - 1
+    end = start + last_edit["line_count"]
+    if start >= len(lines):
+        return None
+    error_line = compile_code(code).get("line")
+    if error_line is None or not start < error_line <= end + 1:
+        return None
+    block = textwrap.dedent("\n".join(lines[start:end]).expandtabs(4)).split("\n")
+
+    previous = next((line for line in reversed(lines[:start]) if line.strip() != ""), "")
+    candidates = [last_edit["indent"], get_indent(previous)]
+    if previous.rstrip().endswith(":"):
+        candidates.insert(0, get_indent(previous) + "    ")
+    for indent in candidates:
+        fixed = lines[:start] + [indent + line if line.strip() != "" else line for line in block] + lines[end:]
+        fixed = "\n".join(fixed)
+        if compile_code(fixed)["success"]:
+            return fixed
+    return None
+
+
+# Fixers are tried in order on every error of a file
+fixers = [
+    fixer(
+        "stdlib_import",
+        r"(\w+) is used but never imported|NameError: name '(\w+)' is not defined",
+        fix_stdlib_import,
+    ),
+    fixer(
+        "local_import",
+        r"cannot import ([.\w]+), there is no such file in the project|No module named '([\w.]+)'",
+        fix_local_import,
+    ),
+    fixer(
+        "main_guard",
+        r"main\.py runs code when it is imported|main\.py defines main\(\) but never calls it",
+        fix_main_guard,
+    ),
+    fixer(
+        "indentation",
+        r"IndentationError|TabError|unexpected indent|expected an indented block|unindent does not match",
+        fix_indentation,
+    ),
+]
+
+
+def error_file(error, context, default):
+    """Returns the project file a traceback or pytest report points at last, or default."""
+    paths = {
+        os.path.abspath(file_dict["absolute_path"]): file_dict for file_dict in context["project_code"]
+    }
+    found = default
+    for match in re.finditer(r'File "([^"]+\.py)", line \d+|([\w./\\-]+\.py):\d+', error):
+        path = match.group(1) or match.group(2)
+        if not os.path.isabs(path):
+            path = os.path.join(context["project_dir"], path)
+        found = paths.get(os.path.abspath(path), found)
+    return found
+
+
+def get_project_errors(context):
+    """
+    Returns (file_dict, error) for every error the checks found, with the file the error is in,
+    and for the autofix_hints analyze_files left, which aren't errors on their own.
+    """
+    errors = []
+    main_file = None
+    for file_dict in context["project_code"]:
+        if os.path.basename(file_dict["relative_path"]) == "main.py":
+            main_file = file_dict
+        if file_dict.get("validation_success") is False and file_dict.get("validation_error"):
+            errors.append((file_dict, file_dict["validation_error"]))
+        if file_dict.get("test_success") is False and file_dict.get("test_error"):
+            errors.append((error_file(file_dict["test_error"], context, file_dict), file_dict["test_error"]))
+        for hint in file_dict.get("autofix_hints") or []:
+            errors.append((file_dict, hint))
+    if context.get("main_success") is False and context.get("main_error") and main_file is not None:
+        errors.append((error_file(context["main_error"], context, main_file), context["main_error"]))
+    return errors
+
+
+def get_autofix_stats(context):
+    return context.setdefault("autofix_stats", {"fixes": 0, "model_calls_saved": 0, "by_fixer": {}})
+
+
+def autofix_project(context):
+    """
+    Applies the fixers to the errors the checks found, without asking the model.
+    Each fix is kept only if the file still compiles. Fixed files are saved and their content
+    in project_code updated. Returns the fixes as dicts with fixer and path, and counts them
+    in context["autofix_stats"]. Whether they saved a call to the model is only known once
+    the checks run again, see autofix_checks in steps/reason.py.
+    """
+    should_log = context.get("log_level", "normal") != "quiet"
+    stats = get_autofix_stats(context)
+    applied = []
+    for file_dict, error in get_project_errors(context):
+        code = file_dict["content"]
+        names = []
+        for current in fixers:
+            for match in current["pattern"].finditer(error):
+                try:
+                    fixed = current["fix"](code, match, file_dict, context)
+                except (SyntaxError, ValueError):
+                    fixed = None
+                if fixed is None or fixed == code or not compile_code(fixed)["success"]:
+                    continue
+                code = fixed
+                names.append(current["name"])
+        if len(names) == 0:
+            continue
+
+        save_code(code, file_dict["absolute_path"])
+        with open(file_dict["absolute_path"], "r") as f:
+            file_dict["content"] = f.read()
+        for name in names:
+            stats["by_fixer"][name] = stats["by_fixer"].get(name, 0) + 1
+            applied.append({"fixer": name, "path": file_dict["relative_path"]})
+        log(
+            f"Fixed {file_dict['relative_path']} without asking the model: {', '.join(names)}",
+            title="autofix",
+            type="success",
+            log=should_log,
+        )
+
+    stats["fixes"] += len(applied)
+    return applied
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from easycompletion.model import parse_arguments
+
+from autocoder.helpers.stream import estimate_tokens, stream_function_call
+
+# Where each backend sends requests. "easycompletion" is the default and goes through
+# easycompletion's openai_function_call. The others speak the OpenAI chat completions API
+# over pooled HTTP connections. Local servers such as llama.cpp and vLLM only take the
+# newer tools form of function calling, and don't need a key.
+backends = {
+    "easycompletion": None,
+    "openai": {"api_base": "https://api.openai.com/v1", "tools": False, "key_env": "OPENAI_API_KEY"},
+    "local": {"api_base": "http://localhost:8080/v1", "tools": True, "key_env": None},
+}
+
+# Seconds to wait for a connection, and for the server to send the next part of a response
+default_connect_timeout = 10
+default_read_timeout = 120
+
+# Connections kept open per server
+default_pool_size = 10
+
+default_backend_retries = 3
+
+# Settings a project can take from .preferences, see start.py
+backend_keys = ["llm_backend", "llm_api_base", "llm_api_key", "llm_timeout"]
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_backend(context):
+    """
+    Returns the settings of the backend named by llm_backend, with llm_api_base, llm_api_key and
+    llm_tools from the context in place of the defaults, or None for the easycompletion backend.
+    """
+    name = context.get("llm_backend", "easycompletion")
+    if name not in backends:
+        raise ValueError(f"Unknown llm_backend {name}, expected one of {', '.join(backends)}")
+    if backends[name] is None:
+        return None
+    backend = dict(backends[name])
+    backend["name"] = name
+    backend["api_base"] = context.get("llm_api_base", backend["api_base"]).rstrip("/")
+    backend["tools"] = context.get("llm_tools", backend["tools"])
+    key_env = backend["key_env"]
+    backend["api_key"] = context.get("llm_api_key")
+    if backend["api_key"] is None and key_env is not None:
+        # The project's own key, as start.py sets it
+        backend["api_key"] = context.get("api_key") or os.environ.get(key_env)
+    backend["timeout"] = (
+        context.get("llm_connect_timeout", default_connect_timeout),
+        context.get("llm_timeout", default_read_timeout),
+    )
+    backend["pool_size"] = context.get("llm_pool_size", default_pool_size)
+    return backend
+
+
+def needs_openai_key(context):
+    """
+    Returns whether the backend the context names sends requests to OpenAI with the OpenAI key,
+    so start.py knows to ask for one. Local servers and other API bases don't need it.
+    """
+    backend = backends.get(context.get("llm_backend", "easycompletion"))
+    if backend is None:
+        return True
+    if backend["key_env"] != "OPENAI_API_KEY" or context.get("llm_api_key") is not None:
+        return False
+    return context.get("llm_api_base", backend["api_base"]).rstrip("/") == backend["api_base"]
+
+
+def get_session(backend):
+    """Returns the keep-alive session for a backend's server, shared by every loop that uses it."""
+    with sessions_lock:
+        session = sessions.get(backend["api_base"])
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=backend["pool_size"])
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            sessions[backend["api_base"]] = session
+        return session
+
+
+def request_body(backend, model, messages, functions, function_call, temperature, stream):
+    body = {"model": model, "messages": messages, "temperature": temperature, "stream": stream}
+    if backend["tools"]:
+        body["tools"] = [{"type": "function", "function": function} for function in functions]
+        body["tool_choice"] = (
+            "auto" if function_call == "auto" else {"type": "function", "function": function_call}
+        )
+    else:
+        body["functions"] = functions
+        body["function_call"] = function_call
+    return body
+
+
+def post(backend, body):
+    headers = {}
+    if backend["api_key"]:
+        headers["Authorization"] = f"Bearer {backend['api_key']}"
+    response = get_session(backend).post(
+        f"{backend['api_base']}/chat/completions",
+        json=body,
+        headers=headers,
+        timeout=backend["timeout"],
+        stream=body["stream"],
+    )
+    if response.status_code != 200:
+        message = response.text[:500]
+        response.close()
+        raise requests.HTTPError(f"{response.status_code} from {backend['api_base']}: {message}", response=response)
+    return response
+
+
+def is_retryable(error):
+    """
+    Returns whether a failed request is worth sending again: connection errors, timeouts, rate
+    limits and server errors are, other errors such as a bad key or an unknown model aren't.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return response.status_code == 429 or response.status_code >= 500
+    return True
+
+
+def read_events(response):
+    """Yields the chunks of a streamed completion from its server-sent events."""
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+    finally:
+        response.close()
+
+
+def function_call_name(functions):
+    return {"name": functions[0]["name"]} if len(functions) == 1 else "auto"
+
+
+def backend_function_call(
+    backend, text, functions, model, temperature=0.0, on_field=None, on_progress=None, stream=False, cancel=None
+):
+    """
+    Asks a backend's server to call one of functions. Returns the same dict as easycompletion's
+    openai_function_call. Streams the response when stream is set, see stream_function_call.
+    Only streamed responses can be cancelled. Failed requests are sent again if is_retryable.
+    """
+    if stream:
+        return stream_function_call(
+            text,
+            functions,
+            model,
+            temperature=temperature,
+            on_field=on_field,
+            on_progress=on_progress,
+            retries=default_backend_retries,
+            create=lambda model, messages, functions, function_call, temperature: read_events(
+                post(backend, request_body(backend, model, messages, functions, function_call, temperature, True))
+            ),
+            long_model=None,
+            cancel=cancel,
+            should_retry=is_retryable,
+        )
+
+    body = request_body(
+        backend, model, [{"role": "user", "content": text}], functions, function_call_name(functions), temperature, False
+    )
+    data = None
+    error = None
+    for attempt in range(default_backend_retries):
+        try:
+            data = post(backend, body).json()
+            break
+        except (requests.RequestException, ValueError) as e:
+            error = f"Model Error: {e}"
+            if not is_retryable(e) or attempt == default_backend_retries - 1:
+                break
+            time.sleep(1)
+    if data is None:
+        return {"error": error}
+
+    choices = data.get("choices") or []
+    if len(choices) == 0:
+        return {"error": "No choices in response"}
+    message = choices[0].get("message") or {}
+    call = message.get("function_call")
+    if message.get("tool_calls"):
+        call = message["tool_calls"][0].get("function")
+    if call is None:
+        return {"error": "No function call in response"}
+
+    usage = data.get("usage") or {
+        "prompt_tokens": estimate_tokens(text, model),
+        "completion_tokens": estimate_tokens(call.get("arguments", ""), model),
+    }
+    return {
+        "text": message.get("content"),
+        "function_name": call["name"],
+        "arguments": parse_arguments(call.get("arguments", "{}")),
+        "usage": usage,
+        "finish_reason": choices[0].get("finish_reason"),
+        "error": None,
+    }
@@ -0,0 +1,85 @@
+import os
+import shutil
+import time
+
+from autocoder.helpers.files import restore_python_files
+from autocoder.helpers.llm import get_usage
+
+# Budgets a project can set, in project_data or .preferences. None or missing means no limit.
+budget_keys = [
+    "max_epochs",
+    "max_input_tokens",
+    "max_output_tokens",
+    "max_tokens",
+    "max_seconds",
+    "max_cost",
+]
+
+
+def get_budget_usage(context):
+    """Returns how much of each budget has been used so far."""
+    usage = get_usage(context)
+    return {
+        "max_epochs": context.get("epoch", 0),
+        "max_input_tokens": usage["input_tokens"],
+        "max_output_tokens": usage["output_tokens"],
+        "max_tokens": usage["input_tokens"] + usage["output_tokens"],
+        "max_seconds": time.time() - context.setdefault("started_at", time.time()),
+        "max_cost": usage["cost"],
+    }
+
+
+def exceeded_budget(context):
+    """Returns the first budget that has been used up, or None if another epoch can start."""
+    used = get_budget_usage(context)
+    for key in budget_keys:
+        limit = context.get(key)
+        if limit is not None and used[key] >= limit:
+            return key
+    return None
+
+
+def start_epoch(context):
+    """Checks the budgets and counts a new epoch. Returns the budget that was used up, if any."""
+    exceeded = exceeded_budget(context)
+    if exceeded is None:
+        context["epoch"] = context.get("epoch", 0) + 1
+    return exceeded
+
+
+def check_progress(context):
+    """
+    Returns how far the checks got: 0 if the files didn't validate, then one more each for the
+    tests and main.py having run. Checks cancelled by fail_fast didn't run, so their errors aren't counted.
+    """
+    if context.get("project_validated") is False:
+        return 0
+    return 1 + (context.get("project_tested") is not None) + (context.get("main_success") is not None)
+
+
+def record_snapshot(context):
+    """
+    Keeps a copy of this epoch's backup if it is at least as good as the best one so far: the checks
+    got further, or as far with no more errors. The backup is copied because backups made in the
+    same second share a name.
+    """
+    best = context.get("best_snapshot")
+    progress = check_progress(context)
+    errors = len(context.get("errors", []))
+    if context.get("backup") is None:
+        return context
+    if best is not None and (progress, -errors) < (best["progress"], -best["errors"]):
+        return context
+    path = os.path.join(os.path.dirname(context["backup"]), f"{context['project_name']}_best.zip")
+    shutil.copyfile(context["backup"], path)
+    context["best_snapshot"] = {"path": path, "progress": progress, "errors": errors, "epoch": context.get("epoch", 0)}
+    return context
+
+
+def restore_best_snapshot(context):
+    """Puts back the project files from the best snapshot. Returns the snapshot, or None if there isn't one."""
+    best = context.get("best_snapshot")
+    if best is None or not os.path.exists(best["path"]):
+        return None
+    restore_python_files(best["path"], context["project_dir"])
+    return best
@@ -1,26 +1,127 @@
 import os
+import json
 import subprocess
+import tempfile
 import ast
 import astor
 import sys
 import black
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from importlib_metadata import distributions
 from agentlogger import log
 
+from autocoder.helpers.analysis import analysis_rules
+from autocoder.helpers.parallel import default_parallel_threshold, parallel_map
+from autocoder.helpers.sandbox import (
+    current_cancel_event,
+    default_limits,
+    run_sandboxed,
+    set_cancel_event,
+    timeout_error,
+)
+from autocoder.helpers.server import runner_path, server_request
+from autocoder.helpers.validation import (
+    cached_validation,
+    count_lines,
+    get_cached_validation,
+    hash_code,
+    parse_code,
+    set_cached_validation,
+    validate_parsed,
+    validation_rules,
+)
+
+
+# Compile results and formatted code by content hash, so the work act.py starts while a
+# response streams in is reused when the response is checked and saved
+code_cache_size = 256
+
+compile_cache = OrderedDict()
+prepare_cache = OrderedDict()
+code_cache_lock = threading.Lock()
+
+
+def cached_by_content(cache, code, compute):
+    """Returns compute(code), reusing the result for code with the same content."""
+    key = hash_code(code)
+    with code_cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    result = compute(code)
+    with code_cache_lock:
+        cache[key] = result
+        while len(cache) > code_cache_size:
+            cache.popitem(last=False)
+    return result
+
+
+def compile_code(code, filename="<string>"):
+    """Compiles a string of Python code in-process, without writing any bytecode to disk.
+
+    Returns a dict with success and error, plus the line, column and message of the
+    SyntaxError when the code doesn't compile. The result doesn't depend on filename,
+    so it is cached by content.
+    """
+    return dict(cached_by_content(compile_cache, code, lambda code: compile_source(code, filename)))
+
 
-def is_runnable(filename):
+def compile_source(code, filename):
     try:
-        result = subprocess.run(
-            ["python", "-m", "py_compile", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-        )
+        compile(code, filename, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        line = getattr(e, "lineno", None)
+        column = getattr(e, "offset", None)
+        message = getattr(e, "msg", None) or str(e)
+        error = f"{type(e).__name__}: {message}"
+        if line is not None:
+            error += f" (line {line}"
+            if column is not None:
+                error += f", column {column}"
+            error += ")"
+        return {
+            "success": False,
+            "error": error,
+            "line": line,
+            "column": column,
+            "message": message,
+        }
+    return {"success": True, "error": None, "line": None, "column": None, "message": None}
+
+
+def compile_file(filename):
+    """Reads a file and compiles it in-process. See compile_code."""
+    try:
+        with open(filename, "rb") as f:
+            source = f.read()
+    except OSError as e:
+        return {
+            "success": False,
+            "error": f"{type(e).__name__}: {e}",
+            "line": None,
+            "column": None,
+            "message": str(e),
+        }
+    return compile_code(source, filename)
+
+
+def is_runnable(filename, use_subprocess=False, limits=None):
+    """Checks if a file compiles. Set use_subprocess to check with python -m py_compile instead."""
+    if not use_subprocess:
+        return compile_file(filename)["success"]
 
-        if result.stderr and result.stderr != "":
+    try:
+        result = run_sandboxed(["python", "-m", "py_compile", filename], limits)
+
+        if result["timed_out"]:
+            return False
+
+        if result["stderr"] and result["stderr"] != "":
             return False
 
-        if result.returncode != 0:
+        if result["returncode"] != 0:
             return False
     except Exception as e:
         log(f"An error occurred: {e}", title="is_runnable", type="error")
@@ -31,52 +132,12 @@ def is_runnable(filename):
 
 def contains_function_definition(code):
     """Checks if a string of Python code contains any function definitions."""
-
-    def visit(node):
-        """Recursively visit nodes in the AST."""
-        if isinstance(node, ast.FunctionDef):
-            # If we're at a function definition node, return True
-            return True
-        else:
-            # For all other nodes, recursively visit their children and return True if any of them return True
-            for child in ast.iter_child_nodes(node):
-                if visit(child):
-                    return True
-        # If no function definition was found, return False
-        return False
-
-    try:
-        tree = ast.parse(code)
-        return visit(tree)
-    except SyntaxError:
-        return False
+    return parse_code(code)["facts"]["has_function_definition"]
 
 
 def has_functions_called(code):
     """Checks if a string is valid Python code and if it performs a function call at root level."""
-
-    def visit(node, inside_function_def=False):
-        """Recursively visit nodes in the AST."""
-        if isinstance(node, ast.FunctionDef):
-            # If we're at a function definition node, recursively visit its children without updating the result
-            for child in ast.iter_child_nodes(node):
-                visit(child, inside_function_def=True)
-        elif isinstance(node, ast.Call) and not inside_function_def:
-            # If we're at a call node and it's not inside a function definition, return True
-            return True
-        else:
-            # For all other nodes, recursively visit their children and return True if any of them return True
-            for child in ast.iter_child_nodes(node):
-                if visit(child, inside_function_def):
-                    return True
-        # If no function call at the root level was found, return False
-        return False
-
-    try:
-        tree = ast.parse(code)
-        return visit(tree)
-    except SyntaxError:
-        return False
+    return parse_code(code)["facts"]["has_root_call"]
 
 
 def file_exists(filename):
@@ -86,90 +147,82 @@ def file_exists(filename):
         return False
 
 
-def count_lines(code, exclude_comments=True, exclude_empty_lines=True):
-    lines = code.split("\n")
-    if exclude_comments:
-        lines = [line for line in lines if not line.startswith("#")]
-    if exclude_empty_lines:
-        lines = [line for line in lines if line.strip() != ""]
-    return len(lines)
-
-
 def validate_file(filename):
-    if not is_runnable(filename):
-        return {
-            "success": False,
-            "error": "The file is not runnable, or didn't compile.",
-        }
-    return validate_code(open(filename, "r").read())
+    with open(filename, "r") as f:
+        code = f.read()
+    return validate_source(code)
 
 
-def validate_code(code):
-    if count_lines(code) == 0:
-        return {
-            "success": False,
-            "error": "The file doesn't have any code in it.",
-        }
-    if has_functions_called(code) is False and contains_function_definition is False:
-        return {
-            "success": False,
-            "error": "The file doesn't call any functions or have any functions. Please make sure the code meets the specifications and goals.",
-        }
-    if count_lines(code) == 1 and len(code) > 50:
-        return {
-            "success": False,
-            "error": "The file has more than 50 characters but only one line, probably one massive comment or something.",
-        }
-
-    # if count_lines(code) < 4:
-    #     return {
-    #         "success": False,
-    #         "error": "The file is not long enough to do much.",
-    #     }
+def validate_source(code):
+    """Compile-checks and validates the contents of a file. Results are cached by content hash."""
+    return cached_validation(code, check_source)
 
-    # if "import" not in code:
-    #     return {
-    #         "success": False,
-    #         "error": "The file doesn't have any imports. Imports are needed to do anything useful. Please add some imports to the top of the file.",
-    #     }
 
-    if "def" not in code:
+def validate_sources(codes, workers=1, threshold=default_parallel_threshold):
+    """
+    Validates a list of file contents and returns the results in the same order.
+    Only contents missing from the validation cache are validated, in a worker pool when
+    workers > 1 and there are at least threshold of them.
+    """
+    results = [get_cached_validation(code) for code in codes]
+    missing = [code for code, result in zip(codes, results) if result is None]
+    validated = iter(parallel_map(check_source, missing, workers, threshold))
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = next(validated)
+            set_cached_validation(codes[i], results[i])
+    return results
+
+
+def check_source(code):
+    compiled = compile_code(code)
+    if not compiled["success"]:
         return {
             "success": False,
-            "error": "The file doesn't have any functions. Please encapsulate all code inside functions.",
+            "error": "The file is not runnable, or didn't compile.\n" + compiled["error"],
         }
+    return validate_code(code)
 
-    if "TODO" in code:
-        return {
-            "success": False,
-            "error": "The file has a TODO in it. Please replace the TODO with real code or remove it.",
-        }
 
-    if "..." in code:
-        return {
-            "success": False,
-            "error": "The file has a '...' in it. This indicates that it is not a complete file. Please respond with the complete script and do not omit any functions, code, tests or sections. Your response should include all code, including imports, and tests, not just changes to code.",
-        }
+def validate_code(code):
+    """Checks code for definite errors found by static analysis, then against the validation rules."""
+    return validate_parsed(parse_code(code), analysis_rules + validation_rules)
 
-    return {"success": True, "error": None}
 
+def prepare_code(code):
+    """Formats code and organizes its imports. Returns the code unchanged if it can't be formatted."""
+    return cached_by_content(prepare_cache, code, format_and_organize)
 
-def save_code(code, filename):
+
+def format_and_organize(code):
     try:
         code = format_code(code)
         code = organize_imports(code)
     except Exception as e:
-        log(f"Code could not be formatted: {e}", title="save_code", type="warning")    
+        log(f"Code could not be formatted: {e}", title="save_code", type="warning")
+    return code
+
+
+def save_code(code, filename):
+    code = prepare_code(code)
     with open(filename, "w") as f:
         f.write(code)
 
 
+def save_files(files):
+    """Formats and saves a list of (code, filename) pairs."""
+    for code, filename in files:
+        save_code(code, filename)
+
+
 def organize_imports(code):
-    tree = ast.parse(code)
-    
+    tree = parse_code(code)["tree"]
+    if tree is None:
+        raise SyntaxError(f"Could not parse code to organize imports: {parse_code(code)['error']}")
+
     imports = []
     other_lines = []
-    
+
     for node in tree.body:
         if isinstance(node, (ast.Import, ast.ImportFrom)):
             imports.append(node)
@@ -185,8 +238,8 @@ def organize_imports(code):
             seen_imports.add(import_line)
             unique_sorted_imports.append(node)
 
-    # Reconstruct tree
-    tree.body = unique_sorted_imports + other_lines
+    # Reconstruct tree without modifying the shared parse
+    tree = ast.Module(body=unique_sorted_imports + other_lines, type_ignores=[])
 
     return astor.to_source(tree)
 
@@ -203,65 +256,319 @@ def format_code(code: str, line_length: int = 110) -> str:
     return black.format_str(code, mode=black.FileMode(line_length=line_length))
 
 
-def run_code(filename):
-    process = subprocess.Popen(
-        ["python", filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+def run_code(filename, limits=None, server=None):
+    """
+    Runs a Python file in the sandbox (see sandbox.py). Pass a warm server (see server.py) to fork
+    the run from a process that already imported the project's dependencies.
+    timed_out is True if it was stopped by the timeout, and the error then starts with a TimeoutError line.
+    Raises CancelledError if the thread's cancel event stopped it.
+    """
+    limits = {**default_limits, **(limits or {})}
+    result = sandbox_response(
+        server,
+        {"kind": "script", "path": os.path.abspath(filename), "cwd": os.getcwd()},
+        limits,
+        "run_code",
+        cold_args=["python", filename],
     )
-    output, error = process.communicate()
-    output = output.decode("utf-8")
-    error = error.decode("utf-8")
+    output = result["stdout"]
+    error = result["stderr"]
+    if result.get("timed_out"):
+        limit = result.get("time_limit") or limits["timeout"]
+        error = timeout_error(os.path.basename(filename), limit) + (f"\n{error}" if error else "")
     if error == "":
         error = None
-    success = process.returncode == 0 and error == None
-    return {"success": success, "error": error, "output": output}
-
+    success = result["returncode"] == 0 and error == None
+    return {"success": success, "error": error, "output": output, "timed_out": result.get("timed_out", False)}
 
-def run_code_tests(script_path):
-    """Run pytest on a given Python file."""
 
-    # Run the command and get the output
-    result = subprocess.run(
-        ["python", "-m", "pytest", script_path], capture_output=True, text=True
+def sandbox_response(server, request, limits, title, cold_args=None):
+    """
+    Runs a runner request on the warm server if there is one, else in a sandboxed process:
+    cold_args if given, or the runner in run mode.
+    Returns a dict with returncode, stdout, stderr and timed_out.
+    Raises CancelledError if the thread's cancel event stopped it.
+    """
+    request = {**request, "limits": limits}
+    cancel_event = current_cancel_event()
+    response = None
+    if server is not None:
+        # The server enforces the timeout itself, this only guards against it hanging
+        timeout = limits["timeout"] + 30 if limits["timeout"] else None
+        response = server_request(server, request, timeout=timeout, cancel_event=cancel_event)
+        if response is None:
+            log("Warm runner is unavailable, running directly", title=title, type="warning")
+    if response is None:
+        args = cold_args or ["python", runner_path, "run", json.dumps(request)]
+        response = run_sandboxed(args, limits, cancel_event=cancel_event)
+    if response.get("cancelled"):
+        raise CancelledError(title)
+    return response
+
+
+def run_code_tests(script_path, server=None, limits=None):
+    """
+    Run pytest on a given Python file. Pass a warm server (see server.py) to skip pytest startup.
+    Tests that run longer than the test_timeout limit fail with a TimeoutError.
+    """
+    limits = {**default_limits, **(limits or {})}
+    response = sandbox_response(
+        server,
+        {"kind": "pytest", "args": [script_path], "cwd": os.getcwd()},
+        limits,
+        "run_code_tests",
     )
-    if result.stderr == "" or result.stderr is None:
-        result.stderr = False
+    error = response["stderr"] or False
+    if response.get("timed_out"):
+        limit = response.get("time_limit") or limits["timeout"]
+        error = timeout_error("The test run", limit) + (f"\n{error}" if error else "")
     # Return the exit code. The exit code is 0 if the tests pass.
     return {
-        "success": result.returncode == 0,
-        "output": result.stdout,
-        "error": result.stderr,
+        "success": response["returncode"] == 0 and not response.get("timed_out"),
+        "output": response["stdout"],
+        "error": error,
+        "timed_out": response.get("timed_out", False),
+    }
+
+def run_pytest(paths, server=None, args=(), coverage_dirs=None, limits=None, coverage_arcs=False):
+    """
+    Runs pytest once over a list of test files and returns success, output, error and timed_out
+    like run_code_tests, plus the structured report collected by the hooks in runner.py:
+    every test with its file, outcome, duration and failure location, and any collection errors.
+    report is None if pytest didn't get far enough to write one.
+
+    With coverage_dirs, the report also has the lines each test ran in files under those directories.
+    With coverage_arcs as well, it has the (from, to) jumps between lines each test made, for branch coverage.
+    """
+    limits = {**default_limits, **(limits or {})}
+    fd, report_path = tempfile.mkstemp(prefix="autocoder_report_", suffix=".json")
+    os.close(fd)
+    request = {
+        "kind": "pytest",
+        # Without this, one file that fails to import stops every other file from running
+        "args": ["--continue-on-collection-errors", *args, *paths],
+        "cwd": os.getcwd(),
+        "report_path": report_path,
+        "coverage_dirs": [os.path.abspath(d) for d in coverage_dirs or []],
+        "coverage_arcs": coverage_arcs,
     }
 
-def extract_imports(code, directory):
     try:
-        tree = ast.parse(code)
-    except SyntaxError:
+        response = sandbox_response(server, request, limits, "run_pytest")
+    except CancelledError:
+        os.remove(report_path)
+        raise
+
+    report = None
+    try:
+        with open(report_path, "r") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        pass
+    finally:
+        os.remove(report_path)
+
+    error = response["stderr"] or False
+    if response.get("timed_out"):
+        # The session was killed, so any report it wrote is incomplete
+        report = None
+        limit = response.get("time_limit") or limits["timeout"]
+        error = timeout_error("The test run", limit) + (f"\n{error}" if error else "")
+    return {
+        "success": response["returncode"] == 0 and not response.get("timed_out"),
+        "output": response["stdout"],
+        "error": error,
+        "timed_out": response.get("timed_out", False),
+        "report": report,
+    }
+
+
+def shard_tests(nodeids, shards, durations=None):
+    """
+    Splits test node ids into at most `shards` lists with roughly equal total duration.
+    Durations come from earlier runs, tests without one are assumed to take the median.
+    Each shard keeps the tests in their original order.
+    """
+    durations = durations or {}
+    known = sorted(durations[nodeid] for nodeid in nodeids if nodeid in durations)
+    default_duration = known[len(known) // 2] if len(known) > 0 else 1.0
+
+    # Longest tests first, each onto the shard with the least work so far
+    order = sorted(
+        range(len(nodeids)),
+        key=lambda i: durations.get(nodeids[i], default_duration),
+        reverse=True,
+    )
+    loads = [0.0] * max(1, min(shards, len(nodeids)))
+    assigned = [[] for _ in loads]
+    for i in order:
+        shard = loads.index(min(loads))
+        loads[shard] += durations.get(nodeids[i], default_duration)
+        assigned[shard].append(i)
+    return [[nodeids[i] for i in sorted(indexes)] for indexes in assigned if len(indexes) > 0]
+
+
+def run_pytest_sharded(
+    paths,
+    shards,
+    durations=None,
+    server=None,
+    min_tests_per_shard=2,
+    coverage_dirs=None,
+    limits=None,
+    coverage_arcs=False,
+):
+    """
+    Runs the tests in paths across several pytest processes at once and merges their reports.
+    Tests are collected first, then split with shard_tests. Returns the same dict as run_pytest.
+    """
+    collected = run_pytest(paths, server=server, args=["--collect-only", "-q"], limits=limits)
+    report = collected["report"]
+    if report is None:
+        return run_pytest(
+            paths, server=server, coverage_dirs=coverage_dirs, limits=limits, coverage_arcs=coverage_arcs
+        )
+
+    nodeids = [item["nodeid"] for item in report["collected"]]
+    rootdir = report["rootdir"]
+    shards = min(shards, len(nodeids) // max(1, min_tests_per_shard))
+    if shards <= 1:
+        return run_pytest(
+            paths, server=server, coverage_dirs=coverage_dirs, limits=limits, coverage_arcs=coverage_arcs
+        )
+
+    groups = shard_tests(nodeids, shards, durations)
+    cancel_event = current_cancel_event()
+
+    def run_shard(group):
+        # Shards run on their own threads, which need the caller's cancel event
+        set_cancel_event(cancel_event)
+        try:
+            return run_pytest(
+                [os.path.join(rootdir, nodeid) for nodeid in group],
+                server=server,
+                coverage_dirs=coverage_dirs,
+                limits=limits,
+                coverage_arcs=coverage_arcs,
+            )
+        finally:
+            set_cancel_event(None)
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        results = list(executor.map(run_shard, groups))
+
+    merged = merge_pytest_results(results)
+    if merged["report"] is None:
+        return run_pytest(
+            paths, server=server, coverage_dirs=coverage_dirs, limits=limits, coverage_arcs=coverage_arcs
+        )
+
+    # Files that failed to import were only seen while collecting
+    report = {**merged["report"], "collected": report["collected"]}
+    report["collect_errors"] = collected["report"]["collect_errors"] + [
+        collect_error
+        for collect_error in report["collect_errors"]
+        if collect_error not in collected["report"]["collect_errors"]
+    ]
+    if len(report["collect_errors"]) > 0:
+        report["exitcode"] = report["exitcode"] or 1
+    return {**merged, "success": report["exitcode"] == 0, "report": report}
+
+
+def merge_pytest_results(results):
+    """Merges the results of several run_pytest calls into one. report is None if any of them has no report."""
+    report = {
+        "exitcode": 0,
+        "rootdir": None,
+        "tests": [],
+        "collect_errors": [],
+        "collected": [],
+        "coverage": {},
+        "arcs": {},
+    }
+    for result in results:
+        if result["report"] is None:
+            report = None
+            break
+        report["rootdir"] = report["rootdir"] or result["report"]["rootdir"]
+        report["tests"] += result["report"]["tests"]
+        report["collect_errors"] += [
+            collect_error
+            for collect_error in result["report"]["collect_errors"]
+            if collect_error not in report["collect_errors"]
+        ]
+        report["collected"] += result["report"]["collected"]
+        report["coverage"].update(result["report"]["coverage"])
+        report["arcs"].update(result["report"].get("arcs", {}))
+        report["exitcode"] = report["exitcode"] or result["report"]["exitcode"]
+
+    return {
+        "success": all(result["success"] for result in results),
+        "output": "\n".join(result["output"] for result in results),
+        "error": "\n".join(result["error"] for result in results if result["error"]) or False,
+        "timed_out": any(result.get("timed_out") for result in results),
+        "report": report,
+    }
+
+
+def group_test_report(report, paths):
+    """
+    Groups a pytest report by test file. Returns a dict of path to success, error and tests.
+    A file passes when it has at least one test and none of its tests failed, which is
+    the same verdict as running pytest on that file alone.
+    """
+    files = {}
+    for path in paths:
+        files[os.path.abspath(path)] = {"success": True, "error": None, "tests": [], "collect_errors": []}
+
+    for test in report["tests"]:
+        if test["file"] in files:
+            files[test["file"]]["tests"].append(test)
+    for collect_error in report["collect_errors"]:
+        if collect_error["file"] in files:
+            files[collect_error["file"]]["collect_errors"].append(collect_error)
+
+    grouped = {}
+    for path in paths:
+        file_report = files[os.path.abspath(path)]
+        errors = [collect_error["message"] for collect_error in file_report["collect_errors"]]
+        for test in file_report["tests"]:
+            if test["outcome"] in ("failed", "error"):
+                errors.append(f"{test['nodeid']} {test['outcome'].upper()}\n{test['message']}")
+        if len(file_report["tests"]) == 0 and len(errors) == 0:
+            errors.append("No tests were collected from this file.")
+
+        grouped[path] = {
+            "success": len(errors) == 0,
+            "error": "\n\n".join(errors) if len(errors) > 0 else None,
+            "tests": file_report["tests"],
+        }
+    return grouped
+
+
+def extract_imports(code, directory):
+    parsed = parse_code(code)
+    if parsed["tree"] is None:
         log("Syntax error", title="extract_imports", type="warning", )
         return set()
-    
+
     all_imports = []
 
+    for entry in parsed["facts"]["imports"]:
+        if entry["level"] > 0:  # Skip relative imports
+            continue
+        if entry["module"] is not None:
+            package = entry["module"].split(".")[0]  # only keep top-level package
+            if is_third_party(package, directory):
+                all_imports.append(package)
+    return set(all_imports)
+
+
+def is_third_party(package, directory):
+    """Returns whether a top level package is neither built in nor a module in directory."""
     # List of built-in modules to be ignored
     builtin_modules = list(sys.builtin_module_names) + common_std_libs
-
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import):
-            for alias in node.names:
-                package = alias.name.split(".")[0]  # only keep top-level package
-                if package not in builtin_modules and not os.path.exists(
-                    os.path.join(directory, f"{package}.py")
-                ):
-                    all_imports.append(package)
-        elif isinstance(node, ast.ImportFrom):
-            if node.level > 0:  # Skip relative imports
-                continue
-            if node.module is not None:
-                package = node.module.split(".")[0]  # only keep top-level package
-                if package not in builtin_modules and not os.path.exists(
-                    os.path.join(directory, f"{package}.py")
-                ):
-                    all_imports.append(package)
-    return set(all_imports)
+    return package not in builtin_modules and not os.path.exists(os.path.join(directory, f"{package}.py"))
 
 common_std_libs = [
     "os",
@@ -1,9 +1,10 @@
+import os
 import subprocess
 from pathlib import Path
 import pkg_resources
 import sys
-import ast
 
+from autocoder.helpers.analysis import local_import_errors, main_guard_errors
 from autocoder.helpers.files import (
     count_files,
     file_tree_to_dict,
@@ -11,7 +12,29 @@ from autocoder.helpers.files import (
     get_python_files,
     zip_python_files,
 )
-from autocoder.helpers.code import extract_imports, file_exists, run_code, run_code_tests, validate_file
+from autocoder.helpers.code import (
+    extract_imports,
+    file_exists,
+    group_test_report,
+    merge_pytest_results,
+    run_code,
+    run_pytest,
+    run_pytest_sharded,
+    validate_sources,
+)
+from autocoder.helpers.fingerprint import (
+    execution_key,
+    get_cached_execution,
+    set_cached_execution,
+    should_cache_execution,
+    test_config_files,
+)
+from autocoder.helpers.gate import coverage_of_test_file, measure_coverage
+from autocoder.helpers.impact import normalize_path, plan_test_run, remap_coverage
+from autocoder.helpers.parallel import default_parallel_threshold, get_worker_count
+from autocoder.helpers.sandbox import get_sandbox_limits
+from autocoder.helpers.server import can_fork, get_server
+from autocoder.helpers.validation import parse_code
 from agentlogger import log
 
 
@@ -95,52 +118,331 @@ def collect_files(context):
 def validate_files(context):
     project_code = context["project_code"]
     project_validated = True
-    for file_dict in project_code:
-        file_path = file_dict["absolute_path"]
-        validation = validate_file(file_path)
+    # collect_files already read the content, unchanged files hit the validation cache
+    validations = validate_sources(
+        [file_dict["content"] for file_dict in project_code],
+        workers=get_worker_count(context),
+        threshold=context.get("parallel_threshold", default_parallel_threshold),
+    )
+    for file_dict, validation in zip(project_code, validations):
         file_dict["validation_success"] = validation["success"]
         file_dict["validation_error"] = validation["error"]
         if validation["success"] is False:
             project_validated = False
-    context["project_code"] = project_code
     context["project_validated"] = project_validated
     return context
 
 
+def analyze_files(context):
+    """
+    Checks the imports between project files without running anything: local modules that don't
+    exist and names that aren't defined in the module they're imported from. Files with errors
+    fail validation, so the execution stages can be skipped.
+
+    Also checks that main.py runs the program under if __name__ == "__main__":. Plenty of projects
+    pass without that, so these only go to file_dict["autofix_hints"], which the fixers in
+    helpers/autofix.py read when the checks fail for some other reason.
+    """
+    _, project_code_tests = split_test_files(context["project_code"])
+    imported_by_tests = any(
+        entry["module"] == "main" and entry["level"] == 0
+        for file_dict in project_code_tests
+        for entry in parse_code(file_dict["content"])["facts"]["imports"]
+    )
+    for file_dict in context["project_code"]:
+        if os.path.basename(file_dict["relative_path"]) == "main.py":
+            file_dict["autofix_hints"] = main_guard_errors(file_dict["content"], imported_by_tests)
+        errors = local_import_errors(file_dict["absolute_path"], file_dict["content"], context["project_dir"])
+        if len(errors) == 0:
+            continue
+        error = "Static analysis found problems that will make the project fail:\n" + "\n".join(errors)
+        if file_dict.get("validation_success") is False:
+            error = file_dict["validation_error"] + "\n" + error
+        file_dict["validation_success"] = False
+        file_dict["validation_error"] = error
+        context["project_validated"] = False
+    return context
+
+
+def get_project_imports(context):
+    """Returns the third-party packages imported anywhere in the project."""
+    imports = set()
+    for file_dict in context["project_code"]:
+        imports |= extract_imports(file_dict["content"], context["project_dir"])
+    return imports
+
+
+def get_test_server(context):
+    """
+    Returns a warm pytest runner for the project if "warm_tests" is enabled in the context.
+    The runner preloads pytest and the project's third-party imports.
+    """
+    if not context.get("warm_tests", False) or not can_fork():
+        return None
+    return get_server(context["project_dir"], preload=get_project_imports(context))
+
+
+def get_main_server(context):
+    """
+    Returns a warm runner to run main.py from if "warm_main" is enabled in the context.
+    It's the same runner as get_test_server, preloaded with the project's third-party imports.
+    """
+    if not context.get("warm_main", False) or not can_fork():
+        return None
+    return get_server(context["project_dir"], preload=get_project_imports(context))
+
+
+def get_test_shard_count(context):
+    """
+    Returns how many pytest processes to split the tests across.
+    Set "test_shards" in the context to a number, or to "auto" to use every core.
+    """
+    shards = context.get("test_shards", 1)
+    if shards == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(1, int(shards))
+    except (TypeError, ValueError):
+        return 1
+
+
+def run_test_files(context, paths):
+    """
+    Runs every test file in paths in one pytest session, or across shards, and returns
+    the result for each file. ran is False if pytest crashed before it could report.
+
+    With "test_impact" enabled, the lines each test runs are recorded, and later runs start with
+    only the tests affected by what changed since. If those pass, the rest run too, so the
+    project is never marked as tested without a full run.
+    """
+    server = get_test_server(context)
+    shards = get_test_shard_count(context)
+    test_impact = context.get("test_impact", False)
+    # The completion gate needs line and branch coverage, see helpers/gate.py
+    gate_coverage = context.get("completion_gate") is not None
+    coverage_dirs = [context["project_dir"]] if test_impact or gate_coverage else None
+
+    limits = get_sandbox_limits(context)
+
+    def run(args):
+        if shards > 1:
+            return run_pytest_sharded(
+                args,
+                shards,
+                durations=context.get("test_durations"),
+                server=server,
+                coverage_dirs=coverage_dirs,
+                limits=limits,
+                coverage_arcs=gate_coverage,
+            )
+        return run_pytest(
+            args, server=server, coverage_dirs=coverage_dirs, limits=limits, coverage_arcs=gate_coverage
+        )
+
+    contents = {
+        normalize_path(file_dict["absolute_path"]): file_dict["content"]
+        for file_dict in context["project_code"]
+    }
+    last_results = context.get("last_test_results", {})
+    stale = []
+    result = None
+    if test_impact and context.get("coverage_snapshot") is not None:
+        plan = plan_test_run(
+            [normalize_path(path) for path in paths],
+            [{**test, "file": normalize_path(test["file"])} for test in last_results.values()],
+            context.get("test_coverage", {}),
+            context["coverage_snapshot"],
+            contents,
+            context["project_dir"],
+        )
+        selected = plan["full_files"] + [test_argument(last_results[nodeid]) for nodeid in plan["nodeids"]]
+        if len(selected) > 0 and len(plan["unchanged"]) > 0:
+            result = run(selected)
+            stale = plan["unchanged"]
+            if result["report"] is not None and result["success"]:
+                rest = run([test_argument(last_results[nodeid]) for nodeid in stale])
+                result = merge_pytest_results([result, rest])
+                stale = []
+            log(
+                f"Ran {len(selected)} affected test files and tests first, {len(stale)} tests kept their last result",
+                title="tests",
+                type="info",
+                log=context.get("log_level", "normal") == "debug",
+            )
+    if result is None:
+        result = run(paths)
+
+    report = result["report"]
+    context["test_report"] = report
+    context["test_output"] = result["output"]
+
+    if report is None:
+        # pytest crashed before it could report anything, every file gets the raw output
+        error = result["output"] + (result["error"] or "")
+        return {path: {"success": False, "error": error, "tests": [], "ran": False} for path in paths}
+
+    # Tests that weren't affected by the change keep their last result
+    report["tests"] = report["tests"] + [last_results[nodeid] for nodeid in stale]
+
+    # Remember how long each test took so later runs can balance shards
+    durations = context.get("test_durations", {})
+    for test in report["tests"]:
+        durations[test["nodeid"]] = test["duration"]
+    context["test_durations"] = durations
+
+    if test_impact:
+        update_test_coverage(context, paths, report, contents)
+
+    grouped = group_test_report(report, paths)
+    for path in paths:
+        grouped[path]["ran"] = True
+        if gate_coverage:
+            grouped[path]["coverage"] = coverage_of_test_file(report, path)
+    return grouped
+
+
+def test_argument(test):
+    """Returns the pytest argument that selects a single test from the last run."""
+    return test["file"] + "::" + test["nodeid"].split("::", 1)[1]
+
+
+def update_test_coverage(context, paths, report, contents):
+    """Records the results and covered lines of the tests that ran, against the current file contents."""
+    ran_files = {normalize_path(path) for path in paths}
+    last_results = {
+        nodeid: test
+        for nodeid, test in context.get("last_test_results", {}).items()
+        if normalize_path(test["file"]) not in ran_files
+    }
+    remapped = remap_coverage(
+        context.get("test_coverage", {}), context.get("coverage_snapshot") or {}, contents
+    )
+    test_coverage = {nodeid: remapped[nodeid] for nodeid in last_results if nodeid in remapped}
+    for test in report["tests"]:
+        nodeid = test["nodeid"]
+        last_results[nodeid] = test
+        if nodeid in report["coverage"]:
+            test_coverage[nodeid] = report["coverage"][nodeid]
+        elif nodeid in remapped:
+            test_coverage[nodeid] = remapped[nodeid]
+
+    context["last_test_results"] = last_results
+    context["test_coverage"] = test_coverage
+    context["coverage_snapshot"] = contents
+
+
 def run_tests(context):
     print('***** RUNNING TESTS')
     # get python files which don't contain test in their name
 
     # if not, error
-    # call pytest on each file
+    # call pytest on all of the test files at once
     # no tests? error
     # tests failed? error
     # tests passed? success
 
     project_code = context["project_code"]
 
-    project_code_notests = []
-    project_code_tests = []
     project_tested = True
     # get python_files which also have test in the name
-    for file_dict in project_code:
-        file_path = file_dict["absolute_path"]
-        if "test" in file_path:
-            project_code_tests.append(file_dict)
-        else:
-            project_code_notests.append(file_dict)
+    project_code_notests, project_code_tests = split_test_files(project_code)
 
-    print('****** TESTS')
+    # Test files whose code, imports and environment haven't changed reuse their last result
+    use_cache = should_cache_execution(context)
+    config_files = test_config_files(context["project_dir"]) if use_cache else []
+    keys = {}
+    grouped = {}
     for file_dict in project_code_tests:
-        file_path = file_dict["absolute_path"]
-        test = run_code_tests(file_path)
-        print(test)
-        if test["success"] is False:
+        path = file_dict["absolute_path"]
+        if use_cache:
+            keys[path] = execution_key("pytest", path, context["project_dir"], config_files)
+            cached = get_cached_execution(keys[path])
+            if cached is not None:
+                grouped[path] = cached
+
+    paths = [file_dict["absolute_path"] for file_dict in project_code_tests if file_dict["absolute_path"] not in grouped]
+    if len(paths) > 0:
+        ran = run_test_files(context, paths)
+        for path in paths:
+            grouped[path] = ran[path]
+            if ran[path]["ran"]:
+                set_cached_execution(keys.get(path), ran[path])
+
+    for file_dict in project_code_tests:
+        file_result = grouped[file_dict["absolute_path"]]
+        if file_result["success"] is False:
             project_tested = False
-        file_dict["test_success"] = test["success"]
-        file_dict["test_error"] = test["output"]
+        file_dict["test_success"] = file_result["success"]
+        file_dict["test_error"] = file_result["error"]
+        file_dict["test_results"] = file_result["tests"]
+
     context["project_tested"] = project_tested
     context["project_code"] = project_code_notests + project_code_tests
+
+    # Results cached before the gate was turned on have no coverage
+    coverages = [grouped[file_dict["absolute_path"]].get("coverage") for file_dict in project_code_tests]
+    context["project_coverage"] = None
+    if context.get("completion_gate") is not None and len(coverages) > 0 and None not in coverages:
+        context["project_coverage"] = measure_coverage(project_code_notests, coverages)
+    return context
+
+
+def split_test_files(project_code):
+    """Splits the project files into the files that aren't tests and the test files, keeping their order."""
+    project_code_notests = []
+    project_code_tests = []
+    for file_dict in project_code:
+        if "test" in file_dict["absolute_path"]:
+            project_code_tests.append(file_dict)
+        else:
+            project_code_notests.append(file_dict)
+    return project_code_notests, project_code_tests
+
+
+def assume_execution_passed(context):
+    """
+    Returns a copy of the context as run_tests, run_main, collect_errors and read_and_format_code
+    would leave it if the tests and main.py pass, so the code can be shown to the model before it has run.
+    The context itself isn't changed.
+    """
+    assumed = dict(context)
+    project_code_notests, project_code_tests = split_test_files(
+        [dict(file_dict) for file_dict in context["project_code"]]
+    )
+    for file_dict in project_code_tests:
+        file_dict["test_success"] = True
+        file_dict["test_error"] = None
+    assumed["project_tested"] = True
+    assumed["project_code"] = project_code_notests + project_code_tests
+
+    for file_dict in assumed["project_code"]:
+        if "main.py" in file_dict["relative_path"]:
+            file_dict["test_success"] = None
+            assumed["main_success"] = True
+            assumed["main_error"] = None
+
+    assumed = collect_errors(assumed)
+    return read_and_format_code(assumed)
+
+
+def clear_test_results(context):
+    """Marks the tests as not run, for when run_tests was cancelled."""
+    for file_dict in context["project_code"]:
+        if "test" in file_dict["absolute_path"]:
+            file_dict["test_success"] = None
+            file_dict["test_error"] = None
+            file_dict["test_results"] = []
+    context["project_tested"] = None
+    context["project_coverage"] = None
+    return context
+
+
+def clear_main_result(context):
+    """Marks main.py as not run, for when run_main was cancelled."""
+    context["main_success"] = None
+    context["main_error"] = None
+    context["main_timed_out"] = False
+    context["main_output"] = None
     return context
 
 
@@ -156,9 +458,19 @@ def run_main(context):
     if main_file is None:
         return context
 
-    result = run_code(main_file["absolute_path"])
+    # Reuse the last outcome if main.py, its local imports and the environment haven't changed
+    key = None
+    if should_cache_execution(context):
+        key = execution_key("run", main_file["absolute_path"], context["project_dir"])
+    result = get_cached_execution(key)
+    if result is None:
+        result = run_code(main_file["absolute_path"], get_sandbox_limits(context), server=get_main_server(context))
+        # A timeout can depend on how busy the machine is, so it isn't remembered
+        if not result["timed_out"]:
+            set_cached_execution(key, result)
 
     context["main_success"] = result["success"]
+    context["main_timed_out"] = result["timed_out"]
     if result["success"] is False:
         context["main_error"] = result["error"]
     else:
@@ -214,9 +526,7 @@ def handle_packages(context):
     project_dir = context["project_dir"]
 
     for file_dict in project_code:
-        try:
-            ast.parse(file_dict["content"])
-        except SyntaxError:
+        if parse_code(file_dict["content"])["tree"] is None:
             log("Couldn't parse file to extract imports", title="extract_imports", type="warning", log=debug)
         imports = list(extract_imports(file_dict["content"], file_dict["absolute_path"]))
         if len(imports) > 0:
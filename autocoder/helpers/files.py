@@ -120,3 +120,11 @@ def zip_python_files(project_dir, project_name):
                     zipf.write(abs_file_path, arcname=rel_file_path)
 
     return zip_file_path
+
+
+def restore_python_files(zip_file_path, project_dir):
+    """Replaces the python files in project_dir with the ones in a zip made by zip_python_files."""
+    for path in get_python_files(project_dir):
+        os.remove(path)
+    with zipfile.ZipFile(zip_file_path, "r") as zipf:
+        zipf.extractall(project_dir)
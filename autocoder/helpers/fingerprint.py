@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import site
+import sys
+import threading
+from collections import OrderedDict
+
+from importlib_metadata import distributions
+
+from autocoder.helpers.validation import hash_code, parse_code
+
+# Files that change how pytest runs every test in the project
+pytest_config_files = ["conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini"]
+
+# Outcomes of runs by execution key
+execution_cache_size = 512
+
+execution_cache = OrderedDict()
+execution_cache_lock = threading.Lock()
+
+environment = {"stamp": None, "fingerprint": None}
+environment_lock = threading.Lock()
+
+
+def read_file(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def resolve_module(module, search_dirs):
+    """Returns the path of a local module (module.py or module/__init__.py) in any of search_dirs, or None."""
+    relative = os.path.join(*module.split("."))
+    for directory in search_dirs:
+        for candidate in [relative + ".py", os.path.join(relative, "__init__.py")]:
+            path = os.path.join(directory, candidate)
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+    return None
+
+
+def local_imports(path, project_dir):
+    """Returns the project files a Python file imports directly."""
+    code = read_file(path)
+    if code is None:
+        return set()
+
+    file_dir = os.path.dirname(os.path.abspath(path))
+    search_dirs = [file_dir, os.path.abspath(project_dir)]
+    imported = set()
+    for entry in parse_code(code)["facts"]["imports"]:
+        dirs = search_dirs
+        module = entry["module"]
+        if entry["level"] > 0:
+            # Relative import, resolve against the package directory
+            base = file_dir
+            for _ in range(entry["level"] - 1):
+                base = os.path.dirname(base)
+            dirs = [base]
+            if module is None:
+                module = ""
+        candidates = [module] if module else []
+        # from package import module
+        candidates += [f"{module}.{name}" if module else name for name in entry["names"] if name != "*"]
+        for candidate in candidates:
+            resolved = resolve_module(candidate, dirs)
+            if resolved is not None:
+                imported.add(resolved)
+    imported.discard(os.path.abspath(path))
+    return imported
+
+
+def source_closure(path, project_dir):
+    """Returns a sorted list of a file and every project file it imports, directly or not."""
+    seen = {os.path.abspath(path)}
+    queue = [os.path.abspath(path)]
+    while queue:
+        for imported in local_imports(queue.pop(), project_dir):
+            if imported not in seen:
+                seen.add(imported)
+                queue.append(imported)
+    return sorted(seen)
+
+
+def environment_stamp():
+    """Cheap check for installs: the modification times of the site-packages directories."""
+    directories = site.getsitepackages() + [site.getusersitepackages()]
+    stamp = []
+    for directory in directories:
+        try:
+            stamp.append((directory, os.stat(directory).st_mtime_ns))
+        except OSError:
+            stamp.append((directory, None))
+    return stamp
+
+
+def environment_fingerprint():
+    """
+    Returns a hash of the interpreter that runs project code and every installed package.
+    It's only recomputed when a site-packages directory changes.
+    """
+    stamp = environment_stamp()
+    with environment_lock:
+        if environment["stamp"] == stamp:
+            return environment["fingerprint"]
+
+    interpreter = shutil.which("python") or sys.executable
+    packages = sorted(
+        f"{dist.metadata['Name']}=={dist.version}" for dist in distributions()
+    )
+    fingerprint = hashlib.sha256(
+        json.dumps([interpreter, sys.version, packages]).encode("utf-8")
+    ).hexdigest()
+
+    with environment_lock:
+        environment["stamp"] = stamp
+        environment["fingerprint"] = fingerprint
+    return fingerprint
+
+
+def execution_key(kind, path, project_dir, extra_files=()):
+    """
+    Returns a key for running a file: the hash of its contents and every local file it imports,
+    the interpreter and the installed packages. None if any of the files can't be read.
+    """
+    files = source_closure(path, project_dir) + sorted(os.path.abspath(f) for f in extra_files)
+    parts = [kind, os.path.abspath(path), environment_fingerprint()]
+    for file in files:
+        code = read_file(file)
+        if code is None:
+            return None
+        parts.append(f"{os.path.relpath(file, project_dir)}:{hash_code(code)}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def test_config_files(project_dir):
+    """Returns the conftest.py and pytest configuration files in a project."""
+    found = []
+    for root, dirs, files in os.walk(project_dir):
+        for file in files:
+            if file in pytest_config_files:
+                found.append(os.path.join(root, file))
+    return found
+
+
+def get_cached_execution(key):
+    if key is None:
+        return None
+    with execution_cache_lock:
+        result = execution_cache.get(key)
+        if result is None:
+            return None
+        execution_cache.move_to_end(key)
+        return dict(result)
+
+
+def set_cached_execution(key, result):
+    if key is None:
+        return
+    with execution_cache_lock:
+        execution_cache[key] = dict(result)
+        while len(execution_cache) > execution_cache_size:
+            execution_cache.popitem(last=False)
+
+
+def clear_execution_cache():
+    with execution_cache_lock:
+        execution_cache.clear()
+
+
+def should_cache_execution(context):
+    """Execution results are reused unless "cache_execution" is False, for programs that are nondeterministic on purpose."""
+    return context.get("cache_execution", True) is not False
@@ -0,0 +1,157 @@
+import ast
+import os
+
+from autocoder.helpers.impact import normalize_path
+
+# Coverage the tests need to reach before the completion gate decides without the usual model
+default_line_coverage = 0.9
+default_branch_coverage = 0.8
+
+# Model asked by the cheap_model gate
+default_gate_model = "gpt-3.5-turbo-0613"
+
+# Statements that never get a line event of their own
+untraced_statements = (ast.Global, ast.Nonlocal, ast.Try)
+
+
+def function_bodies(tree, skip_main=False):
+    """Returns the functions in a tree, without main() if skip_main is set."""
+    return [
+        node
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not (skip_main and node.name == "main")
+    ]
+
+
+def function_statements(function):
+    """Returns the statements in a function body, including nested blocks but not nested functions."""
+    body = function.body
+    if len(body) > 0 and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+        # docstring
+        body = body[1:]
+    statements = []
+    stack = list(body)
+    while stack:
+        statement = stack.pop()
+        statements.append(statement)
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        for child in ast.iter_child_nodes(statement):
+            if isinstance(child, ast.stmt):
+                stack.append(child)
+            elif isinstance(child, (ast.excepthandler, ast.match_case)):
+                stack.extend(child.body)
+    return statements
+
+
+def coverage_points(code, skip_main=False):
+    """
+    Returns the lines inside functions that run when they are called, and the branches:
+    a dict of the line of each if, for and while to the first line of its body.
+    Module level code runs when the module is imported, so it isn't counted.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return set(), {}
+    lines = set()
+    branches = {}
+    for function in function_bodies(tree, skip_main):
+        for statement in function_statements(function):
+            if not isinstance(statement, untraced_statements):
+                lines.add(statement.lineno)
+            if isinstance(statement, (ast.If, ast.For, ast.AsyncFor, ast.While)):
+                if isinstance(statement, ast.While) and isinstance(statement.test, ast.Constant):
+                    # while True has no way out through its condition
+                    continue
+                branches[statement.lineno] = statement.body[0].lineno
+    return lines, branches
+
+
+def coverage_of_test_file(report, path):
+    """Returns the lines and jumps the tests in one test file ran, from a report made with coverage_arcs."""
+    path = normalize_path(path)
+    lines = {}
+    arcs = {}
+    for test in report["tests"]:
+        if normalize_path(test["file"]) != path:
+            continue
+        for filename, covered in report["coverage"].get(test["nodeid"], {}).items():
+            lines.setdefault(filename, set()).update(covered)
+        for filename, covered in report.get("arcs", {}).get(test["nodeid"], {}).items():
+            arcs.setdefault(filename, set()).update(tuple(arc) for arc in covered)
+    return {
+        "lines": {filename: sorted(covered) for filename, covered in lines.items()},
+        "arcs": {filename: sorted(covered) for filename, covered in arcs.items()},
+    }
+
+
+def measure_coverage(project_code, coverages):
+    """
+    Measures the line and branch coverage of the files in project_code from the coverage of
+    each test file. A branch is an if, for or while going into its body or not, so each of
+    them counts twice. main() in main.py is left out, since running main.py checks it.
+    """
+    lines = {}
+    arcs = {}
+    for coverage in coverages:
+        for filename, covered in coverage["lines"].items():
+            lines.setdefault(filename, set()).update(covered)
+        for filename, covered in coverage["arcs"].items():
+            arcs.setdefault(filename, set()).update(tuple(arc) for arc in covered)
+
+    result = {"lines": 0, "lines_covered": 0, "branches": 0, "branches_covered": 0, "files": {}}
+    for file_dict in project_code:
+        filename = normalize_path(file_dict["absolute_path"])
+        skip_main = os.path.basename(file_dict["relative_path"]) == "main.py"
+        executable, branches = coverage_points(file_dict["content"], skip_main)
+        covered_lines = executable & lines.get(filename, set())
+        jumps = {}
+        for start, end in arcs.get(filename, set()):
+            jumps.setdefault(start, set()).add(end)
+        covered_branches = 0
+        for line, body in branches.items():
+            taken = jumps.get(line, set())
+            covered_branches += (body in taken) + (len(taken - {body}) > 0)
+        result["files"][file_dict["relative_path"]] = {
+            "missing_lines": sorted(executable - covered_lines),
+            "branches": 2 * len(branches),
+            "branches_covered": covered_branches,
+        }
+        result["lines"] += len(executable)
+        result["lines_covered"] += len(covered_lines)
+        result["branches"] += 2 * len(branches)
+        result["branches_covered"] += covered_branches
+
+    result["line_rate"] = result["lines_covered"] / result["lines"] if result["lines"] > 0 else 1.0
+    result["branch_rate"] = result["branches_covered"] / result["branches"] if result["branches"] > 0 else 1.0
+    return result
+
+
+def completion_gate(context):
+    """
+    Decides the completion check locally when nothing failed and the tests cover enough of the code.
+    Returns "complete" if completion_gate is "complete", so the project is done without asking,
+    "cheap_model" if it is "cheap_model", so gate_model is asked instead of the usual model,
+    or None when the gate is off, the coverage is too low or there is no code to cover.
+    """
+    mode = context.get("completion_gate")
+    coverage = context.get("project_coverage")
+    if mode is None:
+        return None
+    if mode not in ["complete", "cheap_model"]:
+        raise ValueError(f"Unknown completion_gate {mode}, expected complete or cheap_model")
+    if coverage is None:
+        return None
+    if coverage["lines"] == 0:
+        # The rates default to 1.0, but tests that cover nothing say nothing about the code
+        return None
+    if len(context.get("errors", [])) > 0 or context.get("project_tested") is not True:
+        return None
+    if context.get("main_success") is False:
+        return None
+    if coverage["line_rate"] < context.get("gate_line_coverage", default_line_coverage):
+        return None
+    if coverage["branch_rate"] < context.get("gate_branch_coverage", default_branch_coverage):
+        return None
+    return mode
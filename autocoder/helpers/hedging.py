@@ -0,0 +1,138 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# A request that takes longer than this percentile of the recent ones gets a duplicate
+default_hedge_percentile = 95
+
+# Latencies needed before any request is hedged, and how many recent ones are kept per model
+default_hedge_min_samples = 10
+latency_window = 100
+
+latencies = {}
+latencies_lock = threading.Lock()
+hedge_stats_lock = threading.Lock()
+
+
+def record_latency(model, seconds):
+    with latencies_lock:
+        latencies.setdefault(model, deque(maxlen=latency_window)).append(seconds)
+
+
+def hedge_delay(model, percentile=default_hedge_percentile, min_samples=default_hedge_min_samples):
+    """Returns the given percentile of the model's recent latencies in seconds, or None if there are too few."""
+    with latencies_lock:
+        samples = sorted(latencies.get(model, ()))
+    if len(samples) < max(min_samples, 1):
+        return None
+    index = math.ceil(percentile / 100 * len(samples)) - 1
+    return samples[min(max(index, 0), len(samples) - 1)]
+
+
+def get_hedge_stats(context):
+    return context.setdefault(
+        "hedge_stats", {"requests": 0, "hedged": 0, "hedge_wins": 0, "cancelled": 0, "abandoned": 0, "extra_cost": 0.0}
+    )
+
+
+def count(context, key):
+    with hedge_stats_lock:
+        get_hedge_stats(context)[key] += 1
+
+
+def add_hedge_cost(context, cost):
+    with hedge_stats_lock:
+        get_hedge_stats(context)["extra_cost"] += cost
+
+
+def is_valid(response):
+    return response is not None and response.get("error") is None
+
+
+def hedged_call(context, model, send, on_loser=None, cancellable=True, cancel=None):
+    """
+    Calls send(cancel, hedge) for a response. With hedge_requests set in the context, a request that
+    hasn't returned after hedge_percentile of the model's recent latencies is sent again, and the
+    first valid response wins. cancel is set for the other one. Only a send that is cancellable,
+    like a streamed response, stops then and counts as cancelled. Otherwise it runs to the end
+    and is billed, so it counts as abandoned. A response that finishes anyway is passed to
+    on_loser so its cost is still counted. Setting the cancel event, if given, cancels every request.
+    Returns the response and whether the duplicate won.
+    """
+    if not context.get("hedge_requests", False):
+        start = time.monotonic()
+        response = send(cancel, False)
+        if is_valid(response):
+            record_latency(model, time.monotonic() - start)
+        return response, False
+
+    count(context, "requests")
+    cancels = [threading.Event(), threading.Event()]
+
+    def timed(index):
+        start = time.monotonic()
+        response = send(cancels[index], index == 1)
+        if is_valid(response):
+            record_latency(model, time.monotonic() - start)
+        return response
+
+    def wait_for(futures, timeout=None, return_when=ALL_COMPLETED):
+        if cancel is None:
+            return wait(futures, timeout=timeout, return_when=return_when)
+        # Passes the caller's cancel on to the requests
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            if cancel.is_set():
+                for event in cancels:
+                    event.set()
+            remaining = deadline - time.monotonic() if deadline is not None else 0.05
+            done, pending = wait(futures, timeout=max(0, min(remaining, 0.05)), return_when=return_when)
+            if len(pending) == 0 or (return_when == FIRST_COMPLETED and len(done) > 0):
+                return done, pending
+            if deadline is not None and time.monotonic() >= deadline:
+                return done, pending
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        futures = [executor.submit(timed, 0)]
+        delay = hedge_delay(
+            model,
+            context.get("hedge_percentile", default_hedge_percentile),
+            context.get("hedge_min_samples", default_hedge_min_samples),
+        )
+        if delay is not None and len(wait_for(futures, timeout=delay)[0]) == 0 and not cancels[0].is_set():
+            futures.append(executor.submit(timed, 1))
+            count(context, "hedged")
+
+        winner = None
+        pending = set(futures)
+        while winner is None and len(pending) > 0:
+            done, pending = wait_for(pending, return_when=FIRST_COMPLETED)
+            for future in futures:
+                if future in done and future.exception() is None and is_valid(future.result()):
+                    winner = future
+                    break
+        if winner is None:
+            # Neither worked, return the first request's error
+            winner = futures[0]
+
+        for index, future in enumerate(futures):
+            if future is winner:
+                continue
+            cancels[index].set()
+            if not future.done():
+                count(context, "cancelled" if cancellable else "abandoned")
+            if on_loser is not None:
+                future.add_done_callback(
+                    lambda future: on_loser(future.result())
+                    if future.exception() is None and is_valid(future.result())
+                    else None
+                )
+        if winner is not futures[0]:
+            count(context, "hedge_wins")
+        return winner.result(), winner is not futures[0]
+    finally:
+        # Don't wait for the loser
+        executor.shutdown(wait=False)
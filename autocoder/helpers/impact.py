@@ -0,0 +1,144 @@
+import ast
+import difflib
+import os
+
+from autocoder.helpers.fingerprint import source_closure
+from autocoder.helpers.validation import parse_code
+
+
+def normalize_path(path):
+    """
+    The one form of a path used to match tests, coverage and file contents. Coverage is recorded
+    against real paths, see traced_filename in runner.py, so symlinks are resolved here too.
+    """
+    return os.path.realpath(path)
+
+
+def function_body_lines(code):
+    """
+    Returns the line numbers inside function bodies, or None if the code doesn't parse.
+    Every other line runs when the module is imported, not when a test calls into it.
+    """
+    tree = parse_code(code)["tree"]
+    if tree is None:
+        return None
+    lines = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and len(node.body) > 0:
+            lines.update(range(node.body[0].lineno, node.end_lineno + 1))
+    return lines
+
+
+def diff_lines(old, new):
+    """
+    Compares two versions of a file. Returns the changed line numbers of the old version,
+    whether any change is outside a function body, and a mapping of unchanged old line numbers
+    to their new line numbers.
+    """
+    old_lines = old.split("\n")
+    new_lines = new.split("\n")
+    old_bodies = function_body_lines(old)
+    new_bodies = function_body_lines(new)
+
+    changed = set()
+    module_level = old_bodies is None or new_bodies is None
+    mapping = {}
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                mapping[i1 + offset + 1] = j1 + offset + 1
+            continue
+
+        old_changed = set(range(i1 + 1, i2 + 1))
+        new_changed = set(range(j1 + 1, j2 + 1))
+        if tag == "insert":
+            # Nothing was removed, count the lines on either side of the insertion
+            old_changed = {i1, i1 + 1}
+        changed |= old_changed
+        if not module_level:
+            module_level = bool(
+                (old_changed & set(range(1, len(old_lines) + 1))) - old_bodies
+                or new_changed - new_bodies
+            )
+    return changed, module_level, mapping
+
+
+def remap_coverage(test_coverage, old_contents, new_contents):
+    """Moves recorded line numbers onto the new versions of files that changed. Lines that changed are dropped."""
+    mappings = {}
+    for path, old in old_contents.items():
+        new = new_contents.get(path)
+        if new is not None and new != old:
+            mappings[path] = diff_lines(old, new)[2]
+
+    remapped = {}
+    for nodeid, files in test_coverage.items():
+        remapped[nodeid] = {}
+        for path, lines in files.items():
+            if path in mappings:
+                lines = [mappings[path][line] for line in lines if line in mappings[path]]
+            remapped[nodeid][path] = lines
+    return remapped
+
+
+def plan_test_run(test_paths, tests, test_coverage, old_contents, new_contents, project_dir):
+    """
+    Picks the tests that have to run after some project files changed.
+
+    tests is a list of the tests from the last run (nodeid and file), and test_coverage has the
+    lines each of them ran, recorded against old_contents. A test is picked if it ran a line
+    that changed. A whole test file is picked if it is new or changed, if it has no recorded tests,
+    or if a file it imports changed outside a function body, since that code runs on import.
+
+    Returns the test files to run in full, the node ids to run, and the node ids that can keep
+    their last result. Paths in every argument are normalized with normalize_path.
+    """
+    changes = {}
+    for path in set(old_contents) | set(new_contents):
+        old = old_contents.get(path)
+        new = new_contents.get(path)
+        if old == new or old is None:
+            continue
+        if new is None:
+            changes[path] = (set(), True)
+        else:
+            changed, module_level, _ = diff_lines(old, new)
+            changes[path] = (changed, module_level)
+
+    if any(new_contents.get(path) is None for path in changes):
+        # A deleted file can break imports anywhere, so everything runs
+        return {"full_files": list(test_paths), "nodeids": [], "unchanged": []}
+
+    module_level_changes = {path for path, (_, module_level) in changes.items() if module_level}
+    tests_by_file = {}
+    for test in tests:
+        tests_by_file.setdefault(test["file"], []).append(test["nodeid"])
+
+    full_files = []
+    nodeids = []
+    unchanged = []
+    for path in test_paths:
+        if (
+            path not in old_contents
+            or old_contents[path] != new_contents.get(path)
+            or path not in tests_by_file
+            or any(
+                normalize_path(imported) in module_level_changes
+                for imported in source_closure(path, project_dir)
+            )
+        ):
+            full_files.append(path)
+            continue
+
+        for nodeid in tests_by_file[path]:
+            files = test_coverage.get(nodeid)
+            if files is None or any(
+                covered in changes and len(changes[covered][0] & set(lines)) > 0
+                for covered, lines in files.items()
+            ):
+                nodeids.append(nodeid)
+            else:
+                unchanged.append(nodeid)
+
+    return {"full_files": full_files, "nodeids": nodeids, "unchanged": unchanged}
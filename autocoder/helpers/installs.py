@@ -0,0 +1,158 @@
+import importlib
+import importlib.util
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from agentlogger import log
+
+from autocoder.helpers.code import extract_imports, is_third_party
+
+default_install_command = [sys.executable, "-m", "pip", "install"]
+
+# pip installs started before the code that needs them runs, by package.
+# owners are the project directories that still want the package.
+installs = {}
+installs_lock = threading.Lock()
+
+import_pattern = re.compile(r"^(?:import|from)\s+([A-Za-z_]\w*)")
+
+
+def get_install_stats(context):
+    return context.setdefault(
+        "install_stats", {"started": 0, "installed": 0, "cancelled": 0, "failed": 0, "wait_seconds": 0.0}
+    )
+
+
+def is_installed(package):
+    try:
+        return importlib.util.find_spec(package) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def partial_imports(code, project_dir):
+    """
+    Returns the third party packages imported at the top level of code that may still be arriving.
+    Only complete lines are read, and they don't have to parse together.
+    """
+    complete = code[: code.rfind("\n") + 1]
+    packages = set()
+    for line in complete.split("\n"):
+        match = import_pattern.match(line)
+        if match is not None and is_third_party(match.group(1), project_dir):
+            packages.add(match.group(1))
+    return packages
+
+
+def start_installs(context, packages):
+    """
+    Starts installing the packages that aren't installed or being installed, in the background.
+    Doesn't wait for them, see wait_for_installs.
+    """
+    should_log = context.get("log_level", "normal") != "quiet"
+    project_dir = context["project_dir"]
+    command = context.get("install_command", default_install_command)
+    started = []
+    with installs_lock:
+        for package in sorted(packages):
+            entry = installs.get(package)
+            if entry is not None:
+                entry["owners"].add(project_dir)
+                continue
+            if is_installed(package):
+                continue
+            process = subprocess.Popen(
+                list(command) + [package],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            installs[package] = {"process": process, "owners": {project_dir}, "lock": threading.Lock(), "error": None}
+            started.append(package)
+    if len(started) > 0:
+        get_install_stats(context)["started"] += len(started)
+        log(f"Installing packages in the background: {started}", title="packages", type="system", log=should_log)
+    return context
+
+
+def finish_install(entry):
+    """Waits for an install to exit and returns what pip wrote to stderr. Safe to call from several threads."""
+    with entry["lock"]:
+        if entry["error"] is None:
+            entry["error"] = entry["process"].communicate()[1] or ""
+    return entry["error"]
+
+
+def cancel_installs(context, wanted):
+    """Stops the installs this project started for packages it no longer imports, and reaps the finished ones."""
+    project_dir = context["project_dir"]
+    cancelled = []
+    with installs_lock:
+        for package, entry in list(installs.items()):
+            if package in wanted:
+                continue
+            entry["owners"].discard(project_dir)
+            if len(entry["owners"]) > 0:
+                continue
+            if entry["process"].poll() is None:
+                entry["process"].terminate()
+                cancelled.append(package)
+            # Collect the exit status so the process doesn't linger
+            finish_install(entry)
+            del installs[package]
+    if len(cancelled) > 0:
+        get_install_stats(context)["cancelled"] += len(cancelled)
+        log(
+            f"Cancelled installing packages the code no longer imports: {cancelled}",
+            title="packages",
+            type="info",
+            log=context.get("log_level", "normal") == "debug",
+        )
+    return context
+
+
+def wait_for_installs(context):
+    """
+    Starts installing the packages the project imports that are missing, cancels the installs for
+    packages it doesn't import anymore, then waits only for the installs that are still running.
+    A reason stage, so the installs overlap with the backup and static checks.
+    """
+    if not context.get("speculative_installs", False):
+        return context
+    should_log = context.get("log_level", "normal") != "quiet"
+    project_dir = context["project_dir"]
+
+    wanted = set()
+    for file_dict in context["project_code"]:
+        wanted |= extract_imports(file_dict["content"], project_dir)
+    context = cancel_installs(context, wanted)
+    context = start_installs(context, wanted)
+
+    stats = get_install_stats(context)
+    start = time.monotonic()
+    for package in sorted(wanted):
+        with installs_lock:
+            entry = installs.get(package)
+        if entry is None:
+            continue
+        error = finish_install(entry)
+        with installs_lock:
+            if installs.get(package) is entry:
+                del installs[package]
+        if entry["process"].returncode == 0:
+            stats["installed"] += 1
+        else:
+            stats["failed"] += 1
+            log(
+                f"Couldn't install {package}:\n{(error or '').strip()[-1000:]}",
+                title="packages",
+                type="warning",
+                log=should_log,
+            )
+    stats["wait_seconds"] += time.monotonic() - start
+    # So the new packages can be found by this process
+    importlib.invalidate_caches()
+    return context
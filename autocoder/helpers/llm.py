@@ -0,0 +1,195 @@
+import threading
+
+from easycompletion import openai_function_call
+
+from autocoder.helpers.backends import backend_function_call, get_backend
+from autocoder.helpers.hedging import add_hedge_cost, hedged_call
+from autocoder.helpers.response_cache import (
+    cached_request,
+    default_cache_max_age,
+    default_cache_max_size,
+    default_cache_path,
+    request_key,
+)
+from autocoder.helpers.stream import progress_printer, stream_function_call
+
+default_model = "gpt-3.5-turbo-0613"
+
+# Dollars per 1000 input and output tokens, matched by model name prefix, longest first
+model_prices = {
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+}
+
+usage_lock = threading.Lock()
+
+
+def get_price(model, prices=None):
+    """Returns the (input, output) price per 1000 tokens for a model, (0, 0) if it isn't known."""
+    prices = prices or model_prices
+    for prefix in sorted(prices, key=len, reverse=True):
+        if model.startswith(prefix):
+            return prices[prefix]
+    return (0.0, 0.0)
+
+
+def get_usage(context):
+    return context.setdefault(
+        "usage", {"requests": 0, "cached_requests": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+    )
+
+
+def response_cost(context, model, response):
+    """Returns the input tokens, output tokens and estimated dollars of a response."""
+    usage = response.get("usage") or {}
+    input_tokens = usage.get("prompt_tokens", 0)
+    output_tokens = usage.get("completion_tokens", 0)
+    input_price, output_price = get_price(model, context.get("model_prices"))
+    return input_tokens, output_tokens, (input_tokens * input_price + output_tokens * output_price) / 1000
+
+
+def record_usage(context, model, response):
+    """Adds the tokens a response used, and what they cost, to context["usage"]."""
+    input_tokens, output_tokens, cost = response_cost(context, model, response)
+    # Requests can run on other threads, see start_speculative_check in steps/reason.py
+    with usage_lock:
+        totals = get_usage(context)
+        totals["requests"] += 1
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+        totals["cost"] += cost
+    return context
+
+
+def record_hedge_usage(context, model, response):
+    """Counts a hedged request that lost but finished anyway, in the usage and as extra hedging cost."""
+    record_usage(context, model, response)
+    add_hedge_cost(context, response_cost(context, model, response)[2])
+    return context
+
+
+def function_call(
+    context, text, functions, model=None, temperature=0.0, cache=True, on_field=None, on_progress=None, cancel=None
+):
+    """
+    Asks the model, or the one in the context, to call one of functions, and counts the tokens it used.
+    The request goes to the llm_backend in the context, see helpers/backends.py.
+
+    With stream_responses set in the context the response is streamed, progress is shown while
+    it arrives, on_field(function_name, key, value, fields) is called as soon as each argument
+    is complete and on_progress(function_name, parser) after every chunk, see helpers/stream.py.
+    Arguments it didn't see while streaming, and all of them for responses that weren't streamed,
+    are passed to on_field once the response is there.
+
+    With hedge_requests set, a slow request is sent twice and the first response wins, see
+    helpers/hedging.py. The tokens of both are counted.
+
+    Setting the cancel event stops a streamed response, and the result has the error Cancelled.
+    Responses that aren't streamed can't be stopped and are still returned.
+
+    Identical requests are answered from the response cache, see helpers/response_cache.py.
+    Set cache False for requests that are meant to get a different answer each time, or
+    llm_cache False in the context to turn the cache off.
+    """
+    model = model or context.get("model", default_model)
+    should_log = context.get("log_level", "normal") != "quiet"
+    reported = set()
+    progress = [progress_printer()] if should_log else []
+    if on_progress is not None:
+        progress.append(on_progress)
+
+    backend = get_backend(context)
+    stream = context.get("stream_responses", False)
+
+    def send_once(cancel, hedge):
+        # Only the first request reports its fields and progress, see helpers/hedging.py
+        def field(function_name, key, value, fields):
+            if hedge or (cancel is not None and cancel.is_set()):
+                return
+            reported.add(key)
+            if on_field is not None:
+                on_field(function_name, key, value, fields)
+
+        def show_progress(function_name, parser):
+            if hedge or (cancel is not None and cancel.is_set()):
+                return
+            for show in progress:
+                show(function_name, parser)
+
+        if backend is not None:
+            return backend_function_call(
+                backend,
+                text,
+                functions,
+                model,
+                temperature=temperature,
+                on_field=field,
+                on_progress=show_progress,
+                stream=stream,
+                cancel=cancel,
+            )
+        if stream:
+            return stream_function_call(
+                text,
+                functions,
+                model,
+                temperature=temperature,
+                on_field=field,
+                on_progress=show_progress,
+                cancel=cancel,
+            )
+        return openai_function_call(
+            text=text,
+            functions=functions,
+            debug=context.get("log_level", "normal") == "debug",
+            model=model,
+            temperature=temperature,
+        )
+
+    def send():
+        # Only streamed responses stop when they're cancelled, see helpers/stream.py
+        response, hedge_won = hedged_call(
+            context,
+            model,
+            send_once,
+            on_loser=lambda response: record_hedge_usage(context, model, response),
+            cancellable=stream,
+            cancel=cancel,
+        )
+        if hedge_won:
+            # The fields the first request reported may not match the response that won
+            reported.clear()
+        return response
+
+    endpoint = backend["api_base"] if backend is not None else None
+    response = request(context, request_key(model, text, functions, temperature, endpoint), model, cache, send)
+    if on_field is not None and response.get("error") is None:
+        arguments = response.get("arguments") or {}
+        for key, value in arguments.items():
+            if key not in reported:
+                on_field(response["function_name"], key, value, arguments)
+    return response
+
+
+def request(context, key, model, cache, send):
+    if not cache or not context.get("llm_cache", True):
+        response = send()
+        record_usage(context, model, response)
+        return response
+
+    response, sent = cached_request(
+        key,
+        model,
+        send,
+        path=context.get("llm_cache_path", default_cache_path),
+        max_age=context.get("llm_cache_max_age", default_cache_max_age),
+        max_size=context.get("llm_cache_max_size", default_cache_max_size),
+    )
+    if sent:
+        record_usage(context, model, response)
+    else:
+        with usage_lock:
+            get_usage(context)["cached_requests"] += 1
+    return response
@@ -0,0 +1,76 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from agentlogger import log
+
+# Below this many items, work is done serially since starting work in the pool costs more than it saves
+default_parallel_threshold = 4
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_worker_count(context):
+    """
+    Returns the number of worker processes to use for a context.
+    Set "workers" in the context to a number, or to "auto" to use every core.
+    """
+    workers = context.get("workers", 1)
+    if workers == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(1, int(workers))
+    except (TypeError, ValueError):
+        return 1
+
+
+def get_pool(workers):
+    """
+    Returns a process pool with the given number of workers, creating it on first use.
+    Pools are kept for the life of the process so workers only start once.
+    """
+    with pools_lock:
+        pool = pools.get(workers)
+        if pool is None:
+            # Forking a process that has threads running is unsafe, so start workers from a clean server
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(method)
+            )
+            pools[workers] = pool
+        return pool
+
+
+def shutdown_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        pools.clear()
+
+
+atexit.register(shutdown_pools)
+
+
+def parallel_map(fn, items, workers=1, threshold=default_parallel_threshold):
+    """
+    Calls fn on each item and returns the results in the same order as items.
+    Runs in a process pool when there is more than one worker and at least threshold items,
+    otherwise runs serially. fn must be a module-level function so it can be sent to the workers.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) < max(threshold, 2):
+        return [fn(item) for item in items]
+
+    try:
+        return list(get_pool(workers).map(fn, items))
+    except Exception as e:
+        # A broken pool shouldn't stop the loop, drop it and do the work here
+        log(f"Worker pool failed, running serially: {e}", title="parallel", type="warning")
+        with pools_lock:
+            pool = pools.pop(workers, None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return [fn(item) for item in items]
@@ -0,0 +1,119 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+
+from agentlogger import log
+
+from autocoder.helpers.sandbox import set_cancel_event
+
+# Seconds a stage is assumed to take before it has been timed
+default_stage_cost = 1.0
+
+
+def stage(name, run, after=(), cancellable=False, decides=None, on_cancel=None):
+    """
+    Describes a pipeline stage for run_stages.
+
+    run takes the context and updates it. after names the stages that must finish first.
+    A cancellable stage is stopped, or skipped if it hasn't started, once another stage decides
+    the outcome: decides(context) returns True after that stage ran. on_cancel(context) then
+    clears anything the cancelled stage would have set.
+    """
+    return {
+        "name": name,
+        "run": run,
+        "after": list(after),
+        "cancellable": cancellable,
+        "decides": decides,
+        "on_cancel": on_cancel,
+    }
+
+
+def run_stage(context, stage, cancel_event):
+    set_cancel_event(cancel_event)
+    start = time.monotonic()
+    try:
+        stage["run"](context)
+    finally:
+        set_cancel_event(None)
+    return time.monotonic() - start
+
+
+def cancel_stage(context, stage):
+    if stage["on_cancel"] is not None:
+        stage["on_cancel"](context)
+    context["cancelled_stages"].append(stage["name"])
+
+
+def run_stages(context, stages, parallel=True, fail_fast=True):
+    """
+    Runs each stage after the stages it depends on. Independent stages run at the same time,
+    cheapest first by how long they took in earlier runs, so an epoch takes about as long as
+    its slowest chain of stages instead of all of them added up.
+
+    With fail_fast, the first stage that decides the outcome cancels the cancellable stages that
+    are still running or waiting. With parallel False, the stages run one at a time in the order
+    given and nothing is cancelled.
+
+    Records stage_durations and cancelled_stages in the context.
+    """
+    durations = context.setdefault("stage_durations", {})
+    context["cancelled_stages"] = []
+
+    if not parallel:
+        for current in stages:
+            durations[current["name"]] = run_stage(context, current, None)
+        return context
+
+    pending = {current["name"]: current for current in stages}
+    done = set()
+    running = {}
+    cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while pending or running:
+            ready = sorted(
+                (current for current in pending.values() if all(name in done for name in current["after"])),
+                key=lambda current: durations.get(current["name"], default_stage_cost),
+            )
+            skipped = False
+            for current in ready:
+                del pending[current["name"]]
+                if cancel_event.is_set() and current["cancellable"]:
+                    cancel_stage(context, current)
+                    done.add(current["name"])
+                    skipped = True
+                    continue
+                event = cancel_event if current["cancellable"] else None
+                running[executor.submit(run_stage, context, current, event)] = current
+
+            if not running:
+                if skipped:
+                    # Stages waiting on the skipped ones may be ready now
+                    continue
+                if pending:
+                    raise ValueError(f"Stages depend on each other or on missing stages: {sorted(pending)}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                current = running.pop(future)
+                done.add(current["name"])
+                try:
+                    durations[current["name"]] = future.result()
+                except CancelledError:
+                    cancel_stage(context, current)
+                    continue
+                if (
+                    fail_fast
+                    and not cancel_event.is_set()
+                    and current["decides"] is not None
+                    and current["decides"](context)
+                ):
+                    cancel_event.set()
+                    log(
+                        f"{current['name']} failed, cancelling the stages that are still running",
+                        title="pipeline",
+                        type="info",
+                        log=context.get("log_level", "normal") == "debug",
+                    )
+    return context
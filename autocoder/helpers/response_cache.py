@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from agentlogger import log
+
+default_cache_path = "./.project_cache/llm_responses.sqlite"
+
+# Responses older than this many seconds are not used, and the oldest are removed past this many bytes
+default_cache_max_age = 30 * 24 * 60 * 60
+default_cache_max_size = 100 * 1024 * 1024
+
+# Requests being sent right now, by key, so identical ones wait for the same response
+inflight = {}
+inflight_lock = threading.Lock()
+
+
+def request_key(model, text, functions, temperature, endpoint=None):
+    """
+    Returns the key of a model request: the model, prompt, function schemas and sampling parameters,
+    and the server it goes to when it isn't the default one.
+    """
+    request = {"model": model, "text": text, "functions": functions, "temperature": temperature}
+    if endpoint is not None:
+        request["endpoint"] = endpoint
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)"
+    )
+    return connection
+
+
+def get_cached_response(path, key, max_age=default_cache_max_age):
+    """Returns the stored response for a key, or None if there isn't one or it is too old."""
+    connection = connect(path)
+    try:
+        with connection:
+            row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > max_age:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+    finally:
+        connection.close()
+
+
+def set_cached_response(
+    path, key, model, response, max_age=default_cache_max_age, max_size=default_cache_max_size
+):
+    """Stores a response, then removes responses past max_age and the least recently used past max_size bytes."""
+    data = json.dumps(response, default=str)
+    now = time.time()
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, data, len(data), now, now),
+            )
+            connection.execute("DELETE FROM responses WHERE created < ?", (now - max_age,))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > max_size:
+                rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                for old_key, size in rows:
+                    if total <= max_size:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= size
+    finally:
+        connection.close()
+
+
+def cached_request(
+    key, model, send, path=default_cache_path, max_age=default_cache_max_age, max_size=default_cache_max_size
+):
+    """
+    Returns the stored response for key, or calls send() for it and stores it unless it has an error.
+    While a request is being sent, identical ones wait for its response instead of sending their own,
+    and get it even if it has an error. Returns the response and whether it was sent.
+    If the cache can't be read, for example because its file is locked or corrupt, the request
+    is sent without it.
+    """
+    try:
+        response = get_cached_response(path, key, max_age)
+    except sqlite3.Error as e:
+        log(f"Couldn't read the response cache, sending the request: {e}", title="cache", type="warning")
+        return send(), True
+    if response is not None:
+        return response, False
+
+    with inflight_lock:
+        waiting = inflight.get(key)
+        sending = waiting is None
+        if sending:
+            waiting = inflight[key] = {"event": threading.Event(), "response": None}
+    if not sending:
+        waiting["event"].wait()
+        if waiting["response"] is not None:
+            return waiting["response"], False
+        # The request raised, send it again
+        return cached_request(key, model, send, path, max_age, max_size)
+
+    response = None
+    try:
+        response = send()
+        if response.get("error") is None:
+            try:
+                set_cached_response(path, key, model, response, max_age, max_size)
+            except sqlite3.Error as e:
+                log(f"Couldn't store the response in the cache: {e}", title="cache", type="warning")
+    finally:
+        with inflight_lock:
+            del inflight[key]
+        waiting["response"] = response
+        waiting["event"].set()
+    return response, True
@@ -0,0 +1,514 @@
+"""
+Warm runner for executing project code in a separate interpreter.
+
+This file is run directly by path (python runner.py serve ...), so it only imports the standard
+library at the top level. It should not import anything from autocoder.
+
+In run mode it runs a single JSON request in-process and exits. Requests are either a pytest
+session ("kind": "pytest") or a script run as __main__ ("kind": "script"), like python <path>.
+
+In serve mode it imports pytest and any preload modules once, then reads JSON requests from stdin,
+one per line, and forks a fresh child for each request. Children start from the warm state but
+never share anything with each other, and the server itself never runs project code.
+Responses are written to stdout as JSON lines, in the order the children finish.
+
+Requests can carry limits (see sandbox.py): each child gets its own process group and rlimits,
+and the server kills the group when the child runs past its timeout. A pytest request with a
+test_timeout fails any single test that runs longer than that with a TimeoutError.
+A {"cancel": id} line kills the child running that request. On SIGTERM the server kills every
+child's group before it exits, so nothing outlives it.
+"""
+
+import importlib
+import json
+import os
+import select
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Filled in by the pytest hooks below while a session runs in this process
+session_report = {"rootdir": None, "tests": {}, "collect_errors": [], "collected": [], "coverage": {}, "arcs": {}}
+
+# Seconds before the running test is interrupted, None for no limit
+test_timer = {"timeout": None}
+
+# Line coverage per test, for files under coverage["dirs"], and with record_arcs the jumps between lines
+coverage = {"dirs": (), "lines": None, "filenames": {}, "record_arcs": False, "arcs": None}
+
+
+def traced_filename(filename):
+    """Returns the real path of a code object's file if it is under a traced directory, else None."""
+    cached = coverage["filenames"].get(filename, False)
+    if cached is False:
+        path = os.path.realpath(filename)
+        cached = path if path.startswith(coverage["dirs"]) else None
+        coverage["filenames"][filename] = cached
+    return cached
+
+
+def trace_lines(frame, event, arg):
+    if event == "line":
+        coverage["lines"].setdefault(traced_filename(frame.f_code.co_filename), set()).add(frame.f_lineno)
+    return trace_lines
+
+
+def arc_tracer(filename):
+    """
+    Returns a trace function for one frame that records its lines and each (from, to) jump between
+    them. Leaving the function is a jump to line 0.
+    """
+    lines = coverage["lines"].setdefault(filename, set())
+    arcs = coverage["arcs"].setdefault(filename, set())
+    last = [None]
+
+    def trace_arcs(frame, event, arg):
+        if event == "line":
+            lines.add(frame.f_lineno)
+            if last[0] is not None:
+                arcs.add((last[0], frame.f_lineno))
+            last[0] = frame.f_lineno
+        elif event == "return" and last[0] is not None:
+            arcs.add((last[0], 0))
+        return trace_arcs
+
+    return trace_arcs
+
+
+def trace_calls(frame, event, arg):
+    if event == "call":
+        filename = traced_filename(frame.f_code.co_filename)
+        if filename is not None:
+            return arc_tracer(filename) if coverage["record_arcs"] else trace_lines
+    return None
+
+
+def raise_test_timeout(signum, frame):
+    raise TimeoutError(f"Test did not finish within {test_timer['timeout']} seconds and was stopped")
+
+
+def pytest_runtest_logstart(nodeid, location):
+    if test_timer["timeout"]:
+        signal.setitimer(signal.ITIMER_REAL, test_timer["timeout"])
+    if coverage["dirs"]:
+        coverage["lines"] = {}
+        coverage["arcs"] = {}
+        threading.settrace(trace_calls)
+        sys.settrace(trace_calls)
+
+
+def pytest_runtest_logfinish(nodeid, location):
+    if test_timer["timeout"]:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    if coverage["dirs"]:
+        sys.settrace(None)
+        threading.settrace(None)
+        session_report["coverage"][nodeid] = {
+            filename: sorted(lines) for filename, lines in coverage["lines"].items()
+        }
+        if coverage["record_arcs"]:
+            session_report["arcs"][nodeid] = {
+                filename: sorted(arcs) for filename, arcs in coverage["arcs"].items()
+            }
+        coverage["lines"] = None
+        coverage["arcs"] = None
+
+
+def pytest_configure(config):
+    session_report["rootdir"] = str(config.rootpath)
+
+
+def absolute_location(relative_path):
+    return os.path.normpath(os.path.join(session_report["rootdir"] or os.getcwd(), relative_path))
+
+
+def pytest_collectreport(report):
+    if report.failed:
+        session_report["collect_errors"].append(
+            {
+                "file": absolute_location(report.nodeid.split("::")[0]),
+                "nodeid": report.nodeid,
+                "message": report.longreprtext,
+            }
+        )
+
+
+def pytest_collection_finish(session):
+    for item in session.items:
+        path, line, name = item.location
+        session_report["collected"].append({"nodeid": item.nodeid, "file": absolute_location(path)})
+
+
+def pytest_runtest_logreport(report):
+    path, line, name = report.location
+    test = session_report["tests"].setdefault(
+        report.nodeid,
+        {
+            "nodeid": report.nodeid,
+            "file": absolute_location(path),
+            "name": name,
+            "line": None if line is None else line + 1,
+            "outcome": "passed",
+            "duration": 0.0,
+            "message": None,
+            "crash": None,
+        },
+    )
+    test["duration"] += report.duration
+
+    if report.skipped and test["outcome"] == "passed":
+        test["outcome"] = "skipped"
+    elif report.failed:
+        # A failure outside the test function itself is an error, like pytest reports it
+        test["outcome"] = "failed" if report.when == "call" else "error"
+        test["message"] = report.longreprtext
+        crash = getattr(report.longrepr, "reprcrash", None)
+        if crash is not None:
+            test["crash"] = {"file": crash.path, "line": crash.lineno, "message": crash.message}
+
+
+def write_report(path, exitcode):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "exitcode": exitcode,
+                "rootdir": session_report["rootdir"],
+                "tests": list(session_report["tests"].values()),
+                "collect_errors": session_report["collect_errors"],
+                "collected": session_report["collected"],
+                "coverage": session_report["coverage"],
+                "arcs": session_report["arcs"],
+            },
+            f,
+        )
+
+
+def run_pytest(request):
+    import pytest
+
+    report_path = request.get("report_path")
+    coverage_dirs = request.get("coverage_dirs") or []
+    coverage["dirs"] = tuple(os.path.join(os.path.realpath(d), "") for d in coverage_dirs)
+    coverage["record_arcs"] = bool(request.get("coverage_arcs"))
+    test_timer["timeout"] = request.get("limits", {}).get("test_timeout")
+    if test_timer["timeout"] and hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, raise_test_timeout)
+    else:
+        test_timer["timeout"] = None
+    plugins = [sys.modules[__name__]] if report_path or test_timer["timeout"] else []
+    code = pytest.main(list(request["args"]), plugins=plugins)
+    if report_path:
+        write_report(report_path, int(code))
+    return code
+
+
+def run_script(request):
+    """Runs a file as __main__ the way python <path> does, with its directory first on the path."""
+    import runpy
+    import traceback
+
+    path = os.path.abspath(request["path"])
+    sys.argv = [request["path"]] + list(request.get("args", []))
+    sys.path[0] = os.path.dirname(path)
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # Start the traceback at the script, the runner's own frames would only confuse it
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        return 1
+    return 0
+
+
+handlers = {
+    "pytest": run_pytest,
+    "script": run_script,
+}
+
+
+def run_request(request):
+    """Runs a request in the current process and returns the exit code."""
+    cwd = request.get("cwd")
+    if cwd:
+        os.chdir(cwd)
+        # Match python -m, which puts the working directory first on the path
+        sys.path[0] = cwd
+    sys.argv = [request["kind"]] + list(request.get("args", []))
+    try:
+        code = handlers[request["kind"]](request)
+    except SystemExit as e:
+        code = e.code
+    if code is None:
+        code = 0
+    elif not isinstance(code, int):
+        print(code, file=sys.stderr)
+        code = 1
+    return int(code)
+
+
+def set_resource_limits(limits):
+    """Sets rlimits on the forked child, like sandbox.limits_wrapper, which can't be imported here."""
+    if resource is None:
+        return
+    cpu_limit = limits.get("cpu_limit") or limits.get("timeout")
+    if cpu_limit:
+        cpu_limit = int(cpu_limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    if limits.get("memory_limit"):
+        memory = int(limits["memory_limit"]) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    if limits.get("file_limit"):
+        # Also caps the files the output is redirected to
+        size = int(limits["file_limit"]) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_FSIZE, (size, size))
+
+
+def run_child(request, stdout_path, stderr_path):
+    """Runs in the forked child: redirect output, run the request and exit without returning."""
+    code = 1
+    try:
+        # Its own process group, so the server can kill it and anything it starts
+        os.setpgid(0, 0)
+        set_resource_limits(request.get("limits", {}))
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        out = os.open(stdout_path, os.O_WRONLY | os.O_TRUNC)
+        err = os.open(stderr_path, os.O_WRONLY | os.O_TRUNC)
+        os.dup2(out, 1)
+        os.dup2(err, 2)
+        # Fresh file objects, the inherited ones may hold buffered output from the server
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+        code = run_request(request)
+    except BaseException:
+        import traceback
+
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def read_output(path, max_output=None):
+    """Reads and removes an output file. With max_output, keeps only the first and last max_output / 2 bytes."""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not max_output or size <= max_output:
+                return f.read().decode("utf-8", errors="replace")
+            half = max(1, max_output // 2)
+            head = f.read(half)
+            f.seek(size - half)
+            tail = f.read()
+        omitted = size - len(head) - len(tail)
+        return (
+            head.decode("utf-8", errors="replace")
+            + f"\n... [{omitted} bytes of output omitted] ...\n"
+            + tail.decode("utf-8", errors="replace")
+        )
+    finally:
+        os.remove(path)
+
+
+def kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # The child may not have moved to its own group yet
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def warm_up_pytest():
+    """Runs one empty pytest session so the plugins pytest imports lazily are loaded before forking."""
+    try:
+        import pytest
+
+        with tempfile.TemporaryDirectory() as directory:
+            pytest.main(["-q", "-p", "no:cacheprovider", directory])
+    except BaseException:
+        pass
+
+
+def preload_modules(names):
+    loaded = []
+    failed = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except BaseException:
+            failed.append(name)
+    return loaded, failed
+
+
+def serve(preload):
+    # Responses go to the original stdout, anything else printed by the server goes to stderr
+    response_fd = os.dup(1)
+    os.dup2(2, 1)
+
+    # The runner's own directory must not shadow project modules
+    sys.path[0] = os.getcwd()
+
+    loaded, failed = preload_modules(["pytest"] + list(preload))
+    warm_up_pytest()
+
+    def respond(message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        while data:
+            written = os.write(response_fd, data)
+            data = data[written:]
+
+    # Wake up select when a child exits
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+    os.set_blocking(wakeup_read, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    children = {}
+
+    def terminate(signum, frame):
+        # The children are in their own process groups, so they don't go with the server
+        for pid, child in children.items():
+            kill_group(pid)
+            for path in [child["stdout_path"], child["stderr_path"]]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        os._exit(1)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    respond({"ready": True, "pid": os.getpid(), "preloaded": loaded, "failed": failed})
+
+    buffer = b""
+    stdin_open = True
+    while stdin_open or children:
+        readable = [wakeup_read] + ([0] if stdin_open else [])
+        deadlines = [
+            child["deadline"]
+            for child in children.values()
+            if child["deadline"] is not None and not child["timed_out"]
+        ]
+        wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        try:
+            ready, _, _ = select.select(readable, [], [], wait)
+        except InterruptedError:
+            ready = []
+
+        if wakeup_read in ready:
+            try:
+                while os.read(wakeup_read, 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+        if 0 in ready:
+            chunk = os.read(0, 65536)
+            if not chunk:
+                stdin_open = False
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                if "cancel" in request:
+                    for pid, child in children.items():
+                        if child["request"].get("id") == request["cancel"] and not child["cancelled"]:
+                            child["cancelled"] = True
+                            kill_group(pid)
+                    continue
+                fd, stdout_path = tempfile.mkstemp(prefix="autocoder_out_")
+                os.close(fd)
+                fd, stderr_path = tempfile.mkstemp(prefix="autocoder_err_")
+                os.close(fd)
+                pid = os.fork()
+                if pid == 0:
+                    os.close(response_fd)
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    run_child(request, stdout_path, stderr_path)
+                try:
+                    os.setpgid(pid, pid)
+                except OSError:
+                    pass
+                timeout = request.get("limits", {}).get("timeout")
+                children[pid] = {
+                    "request": request,
+                    "stdout_path": stdout_path,
+                    "stderr_path": stderr_path,
+                    "deadline": time.monotonic() + timeout if timeout else None,
+                    "timed_out": False,
+                    "cancelled": False,
+                }
+
+        # Kill every child that ran past its timeout, it's reaped below
+        now = time.monotonic()
+        for pid, child in children.items():
+            if child["deadline"] is not None and now >= child["deadline"] and not child["timed_out"]:
+                child["timed_out"] = True
+                kill_group(pid)
+
+        # Reap every finished child
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            child = children.pop(pid)
+            # Anything the child left running in the background goes with it
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            limits = child["request"].get("limits", {})
+            returncode = os.waitstatus_to_exitcode(status)
+            # Killed by the CPU rlimit
+            cpu_exceeded = returncode == -signal.SIGXCPU and not child["timed_out"] and not child["cancelled"]
+            respond(
+                {
+                    "id": child["request"].get("id"),
+                    "returncode": returncode,
+                    "stdout": read_output(child["stdout_path"], limits.get("max_output")),
+                    "stderr": read_output(child["stderr_path"], limits.get("max_output")),
+                    "timed_out": child["timed_out"] or cpu_exceeded,
+                    "time_limit": (limits.get("cpu_limit") or limits.get("timeout")) if cpu_exceeded else limits.get("timeout"),
+                    "cancelled": child["cancelled"],
+                }
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == "run":
+        # Cold path: run a single request in this process
+        sys.path[0] = os.getcwd()
+        sys.exit(run_request(json.loads(sys.argv[2])))
+    else:
+        print("Usage: python runner.py serve [preload modules...] | run <request json>", file=sys.stderr)
+        sys.exit(2)
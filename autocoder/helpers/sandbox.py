@@ -0,0 +1,221 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Defaults for running generated code, each can be overridden in the context
+default_limits = {
+    # Seconds a single run of main.py or a pytest session may take
+    "timeout": 120,
+    # Seconds a single test may take
+    "test_timeout": 30,
+    # CPU seconds, defaults to the timeout
+    "cpu_limit": None,
+    # Megabytes of address space, no limit by default since some libraries reserve a lot of it
+    "memory_limit": None,
+    # Megabytes any one file written by the code may grow to, so a runaway loop can't fill the disk
+    "file_limit": 64,
+    # Bytes of stdout and stderr kept from each run, half from the start and half from the end
+    "max_output": 64 * 1024,
+}
+
+# The cancel event for runs started from the current thread, see set_cancel_event
+cancel_state = threading.local()
+
+
+def get_sandbox_limits(context):
+    """Returns the sandbox limits for a context, taking any of the default_limits keys from it."""
+    limits = dict(default_limits)
+    for key in default_limits:
+        if context.get(key) is not None:
+            limits[key] = context[key]
+    return limits
+
+
+def set_cancel_event(event):
+    """
+    Sets the event that cancels every sandboxed run started from this thread, so callers deep in
+    the pipeline don't have to pass it along. Pass None to clear it.
+    """
+    cancel_state.event = event
+
+
+def current_cancel_event():
+    return getattr(cancel_state, "event", None)
+
+
+# Run by a fresh interpreter, which sets the rlimits and then replaces itself with the command.
+# Setting them in preexec_fn isn't safe, since run_sandboxed is called from worker threads
+# and preexec_fn can deadlock a child forked from a threaded process.
+limits_wrapper = """
+import os, resource, sys
+cpu_limit, memory_limit, file_limit = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+if cpu_limit:
+    # The soft limit sends SIGXCPU, the hard limit a second later kills it
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+if memory_limit:
+    memory = memory_limit * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+if file_limit:
+    size = file_limit * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_FSIZE, (size, size))
+os.execvp(sys.argv[4], sys.argv[4:])
+"""
+
+
+def limited_args(args, cpu_limit=None, memory_limit=None, file_limit=None):
+    """Returns the command that runs args with CPU, memory and file size rlimits."""
+    if resource is None:
+        return list(args)
+    return [
+        sys.executable,
+        "-c",
+        limits_wrapper,
+        str(int(cpu_limit or 0)),
+        str(int(memory_limit or 0)),
+        str(int(file_limit or 0)),
+    ] + list(args)
+
+
+def capture_output(stream, max_output, captured):
+    """Reads a stream until it closes, keeping only the first and last max_output / 2 bytes."""
+    half = max(1, max_output // 2)
+    head = bytearray()
+    tail = bytearray()
+    total = 0
+    fd = stream.fileno()
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError:
+            break
+        if not chunk:
+            break
+        total += len(chunk)
+        room = half - len(head)
+        if room > 0:
+            head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk:
+            tail += chunk
+            if len(tail) > half:
+                del tail[: len(tail) - half]
+    stream.close()
+    captured["text"] = bounded_text(bytes(head), bytes(tail), total - len(head) - len(tail))
+    captured["truncated"] = total > len(head) + len(tail)
+
+
+def bounded_text(head, tail, omitted):
+    text = head.decode("utf-8", errors="replace")
+    if omitted > 0:
+        text += f"\n... [{omitted} bytes of output omitted] ...\n"
+    return text + tail.decode("utf-8", errors="replace")
+
+
+def kill_process_group(process):
+    """Kills a process started with start_new_session, and everything it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, AttributeError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+def run_sandboxed(args, limits=None, cwd=None, cancel_event=None):
+    """
+    Runs a command with a wall-clock timeout, CPU, memory and file size rlimits and bounded output capture.
+    The command gets its own process group, which is killed when it times out, is cancelled or
+    exits, so nothing it started outlives the run. cancel_event defaults to the one set for
+    this thread with set_cancel_event.
+
+    Returns a dict with returncode, stdout, stderr, timed_out, cancelled, truncated and duration.
+    A run killed by the CPU limit counts as timed out too, time_limit has the limit it hit.
+    """
+    limits = {**default_limits, **(limits or {})}
+    if cancel_event is None:
+        cancel_event = current_cancel_event()
+    cpu_limit = limits["cpu_limit"] or limits["timeout"]
+    posix = os.name == "posix"
+
+    start = time.monotonic()
+    if cancel_event is not None and cancel_event.is_set():
+        return {
+            "returncode": None,
+            "stdout": "",
+            "stderr": "",
+            "timed_out": False,
+            "cancelled": True,
+            "time_limit": None,
+            "truncated": False,
+            "duration": 0.0,
+        }
+    process = subprocess.Popen(
+        limited_args(args, cpu_limit, limits["memory_limit"], limits["file_limit"]) if posix else args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=posix,
+    )
+
+    stdout = {"text": "", "truncated": False}
+    stderr = {"text": "", "truncated": False}
+    readers = [
+        threading.Thread(target=capture_output, args=(process.stdout, limits["max_output"], stdout), daemon=True),
+        threading.Thread(target=capture_output, args=(process.stderr, limits["max_output"], stderr), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    timed_out = False
+    cancelled = False
+    deadline = start + limits["timeout"] if limits["timeout"] else None
+    while True:
+        try:
+            process.wait(timeout=0.05)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        if deadline is not None and time.monotonic() > deadline:
+            timed_out = True
+            break
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled = True
+            break
+
+    # Also reaps anything the command left running in the background
+    kill_process_group(process)
+    process.wait()
+    for reader in readers:
+        reader.join()
+
+    # Killed by the CPU rlimit
+    cpu_exceeded = posix and not timed_out and not cancelled and process.returncode == -signal.SIGXCPU
+
+    return {
+        "returncode": process.returncode,
+        "stdout": stdout["text"],
+        "stderr": stderr["text"],
+        "timed_out": timed_out or cpu_exceeded,
+        "cancelled": cancelled,
+        "time_limit": cpu_limit if cpu_exceeded else limits["timeout"],
+        "truncated": stdout["truncated"] or stderr["truncated"],
+        "duration": time.monotonic() - start,
+    }
+
+
+def timeout_error(name, timeout):
+    """The error reported when a run is stopped by its time limit, written so the model knows what to fix."""
+    return (
+        f"TimeoutError: {name} did not finish within {timeout} seconds and was stopped. "
+        "It probably has an infinite loop, waits for input or blocks on something that never happens."
+    )
@@ -0,0 +1,191 @@
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from agentlogger import log
+
+from autocoder.helpers.fingerprint import environment_stamp
+
+runner_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.py")
+
+# Warm runner servers by project directory
+servers = {}
+servers_lock = threading.Lock()
+
+
+def can_fork():
+    return hasattr(os, "fork")
+
+
+def start_server(cwd=None, preload=()):
+    """
+    Starts a warm runner (see runner.py) that has imported pytest and the preload modules.
+    Returns a server dict, or None if the server couldn't be started.
+    """
+    if not can_fork():
+        return None
+    try:
+        process = subprocess.Popen(
+            [sys.executable, runner_path, "serve", *sorted(set(preload))],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=cwd,
+            start_new_session=True,
+        )
+        ready = json.loads(process.stdout.readline())
+    except Exception as e:
+        log(f"Could not start runner: {e}", title="server", type="warning")
+        return None
+
+    server = {
+        "process": process,
+        "preload": set(preload),
+        "environment": environment_stamp(),
+        "preloaded": ready.get("preloaded", []),
+        "pending": {},
+        "next_id": 0,
+        "lock": threading.Lock(),
+    }
+    reader = threading.Thread(target=read_responses, args=(server,), daemon=True)
+    server["reader"] = reader
+    reader.start()
+    return server
+
+
+def read_responses(server):
+    for line in server["process"].stdout:
+        try:
+            response = json.loads(line)
+        except ValueError:
+            continue
+        with server["lock"]:
+            waiter = server["pending"].pop(response.get("id"), None)
+        if waiter is not None:
+            waiter["response"] = response
+            waiter["event"].set()
+
+    # The server exited, release anyone still waiting
+    with server["lock"]:
+        waiters = list(server["pending"].values())
+        server["pending"].clear()
+    for waiter in waiters:
+        waiter["event"].set()
+
+
+def is_alive(server):
+    return server is not None and server["process"].poll() is None
+
+
+def server_request(server, request, timeout=None, cancel_event=None):
+    """
+    Sends a request to a running server and waits for the response.
+    Returns a dict with returncode, stdout and stderr, or None if the server is gone or timed out.
+    Safe to call from several threads at once, each request runs in its own child.
+
+    If cancel_event is set while waiting, the server kills the child and the response has cancelled set.
+    """
+    if not is_alive(server):
+        return None
+    if cancel_event is not None and cancel_event.is_set():
+        return {"returncode": None, "stdout": "", "stderr": "", "timed_out": False, "cancelled": True}
+    waiter = {"event": threading.Event(), "response": None}
+    with server["lock"]:
+        request_id = server["next_id"]
+        server["next_id"] += 1
+        server["pending"][request_id] = waiter
+        if not send_message(server, {**request, "id": request_id}):
+            server["pending"].pop(request_id, None)
+            return None
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while not waiter["event"].is_set():
+        if cancel_event is not None and cancel_event.is_set():
+            with server["lock"]:
+                send_message(server, {"cancel": request_id})
+            # The server answers once the child is gone
+            waiter["event"].wait(5)
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        waiter["event"].wait(0.05 if cancel_event is not None else timeout)
+
+    if waiter["response"] is None:
+        with server["lock"]:
+            server["pending"].pop(request_id, None)
+        if cancel_event is not None and cancel_event.is_set():
+            return {"returncode": None, "stdout": "", "stderr": "", "timed_out": False, "cancelled": True}
+        return None
+    return waiter["response"]
+
+
+def send_message(server, message):
+    """Writes one JSON line to the server. Call with the server lock held."""
+    try:
+        server["process"].stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+        server["process"].stdin.flush()
+    except (BrokenPipeError, OSError, ValueError):
+        return False
+    return True
+
+
+def stop_server(server, timeout=5):
+    """
+    Closes the server's stdin, which lets it finish the running requests, and waits up to timeout
+    seconds for it to exit. After that it is terminated, which also kills its children.
+    """
+    if server is None:
+        return
+    process = server["process"]
+    try:
+        process.stdin.close()
+    except OSError:
+        pass
+    try:
+        process.wait(timeout=timeout)
+        return
+    except subprocess.TimeoutExpired:
+        process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        # Only the server, the children may be left running
+        process.kill()
+        process.wait()
+
+
+def get_server(project_dir, preload=()):
+    """
+    Returns the warm server for a project, starting it if it isn't running.
+    A server is replaced when the project imports a module it didn't preload, or when packages
+    were installed or removed since it started, so it never runs code against stale imports.
+    """
+    key = os.path.abspath(project_dir)
+    stale = None
+    with servers_lock:
+        server = servers.get(key)
+        if is_alive(server) and set(preload) <= server["preload"] and server["environment"] == environment_stamp():
+            return server
+        if is_alive(server):
+            log("Dependencies changed, restarting the warm runner", title="server", type="info")
+            stale = servers.pop(key)
+        server = start_server(preload=preload)
+        if server is not None:
+            servers[key] = server
+    # Stopping can take seconds, other projects shouldn't wait on the lock for it
+    stop_server(stale)
+    return server
+
+
+def stop_servers():
+    with servers_lock:
+        for server in servers.values():
+            stop_server(server)
+        servers.clear()
+
+
+atexit.register(stop_servers)
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import re
+
+from agentlogger import log
+
+# An error set seen this many times before means the loop is stuck on it
+default_stall_threshold = 2
+
+# What to do when the loop is stuck:
+# history: show the model the attempts that already failed on these errors
+# rewrite: only offer write_code, so the file is written again instead of patched
+# escalate: switch to escalation_model until the errors change
+# stop: stop the loop
+stall_strategies = ["history", "rewrite", "escalate", "stop"]
+
+default_escalation_model = "gpt-4-0613"
+
+
+def normalize_error(error):
+    """Removes the parts of an error that change between runs of the same failure."""
+    error = re.sub(r"0x[0-9a-fA-F]+", "0x", str(error))
+    error = re.sub(r"\b[Ll]ine \d+", "line N", error)
+    error = re.sub(r"\.py:\d+", ".py:N", error)
+    error = re.sub(r"\d+(\.\d+)? ?(s|seconds)\b", "Ns", error)
+    return error.strip()
+
+
+def fingerprint(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def error_fingerprint(errors):
+    """Fingerprints a set of errors, ignoring their order. None if there are no errors."""
+    if len(errors) == 0:
+        return None
+    return fingerprint(sorted(normalize_error(error) for error in errors))
+
+
+def action_fingerprint(function_name, arguments):
+    """Fingerprints an action by what it does, ignoring the reasoning that came with it."""
+    return fingerprint([function_name, {key: value for key, value in arguments.items() if key != "reasoning"}])
+
+
+def get_stall_stats(context):
+    return context.setdefault(
+        "stall_stats", {"stalls": 0, "longest": 0, "repeated_actions": 0, "strategies": {}}
+    )
+
+
+def record_epoch(context):
+    """Adds the errors of this epoch to context["epoch_history"] and returns the new entry."""
+    history = context.setdefault("epoch_history", [])
+    errors = context.get("errors", [])
+    entry = {
+        "epoch": len(history) + 1,
+        "errors": error_fingerprint(errors),
+        "error_summary": str(errors[0]).strip().split("\n")[-1][:200] if len(errors) > 0 else None,
+        "action": None,
+        "action_summary": None,
+    }
+    history.append(entry)
+    return entry
+
+
+def record_action(context, function_name, arguments):
+    """Adds the action chosen this epoch to its entry and counts it if it was tried on the same errors before."""
+    history = context.get("epoch_history", [])
+    if len(history) == 0:
+        return context
+    entry = history[-1]
+    entry["action"] = action_fingerprint(function_name, arguments)
+    summary = function_name
+    if "filepath" in arguments:
+        summary += f" on {arguments['filepath']}"
+    if "start_line" in arguments and "end_line" in arguments:
+        summary += f", lines {arguments['start_line']} to {arguments['end_line']}"
+    entry["action_summary"] = summary
+
+    if entry["errors"] is not None and any(
+        earlier["errors"] == entry["errors"] and earlier["action"] == entry["action"] for earlier in history[:-1]
+    ):
+        get_stall_stats(context)["repeated_actions"] += 1
+        log(
+            f"{summary} was already tried on the same errors",
+            title="stall",
+            type="warning",
+            log=context.get("log_level", "normal") != "quiet",
+        )
+    return context
+
+
+def earlier_attempts(context):
+    """Returns the earlier epochs that had the same errors as this one."""
+    history = context.get("epoch_history", [])
+    if len(history) == 0 or history[-1]["errors"] is None:
+        return []
+    return [entry for entry in history[:-1] if entry["errors"] == history[-1]["errors"]]
+
+
+def format_attempt_history(attempts):
+    text = "These errors have come up before and the earlier attempts didn't fix them:\n"
+    for entry in attempts:
+        text += f"- Epoch {entry['epoch']}: {entry['action_summary'] or 'no edit'}\n"
+    text += "Do not repeat these attempts, try a different approach.\n"
+    return text
+
+
+def clear_stall(context):
+    """Undoes what the stall strategy changed, once the errors are different."""
+    context["attempt_history"] = None
+    context["force_rewrite"] = False
+    if context.get("base_model") is not None:
+        context["model"] = context.pop("base_model")
+    return context
+
+
+def is_stalled(context):
+    """
+    Returns True while a stall strategy is in effect. Edit requests shouldn't be answered from the
+    response cache then, which would only give back the edit that already failed.
+    """
+    return bool(context.get("attempt_history") or context.get("force_rewrite") or context.get("base_model"))
+
+
+def detect_stall(context):
+    """
+    Records this epoch and checks if its errors came up stall_threshold times before.
+    If they did, applies the stall_strategy and returns its name, otherwise returns None.
+    The stop strategy is left to the caller, which owns the loop.
+    """
+    record_epoch(context)
+    attempts = earlier_attempts(context)
+    stats = get_stall_stats(context)
+    if len(attempts) < context.get("stall_threshold", default_stall_threshold):
+        clear_stall(context)
+        return None
+
+    strategy = context.get("stall_strategy", "history")
+    if strategy not in stall_strategies:
+        raise ValueError(f"Unknown stall_strategy {strategy}, expected one of {stall_strategies}")
+    stats["stalls"] += 1
+    stats["longest"] = max(stats["longest"], len(attempts))
+    stats["strategies"][strategy] = stats["strategies"].get(strategy, 0) + 1
+    log(
+        f"The same errors came up {len(attempts) + 1} times, using the {strategy} strategy",
+        title="stall",
+        type="warning",
+        log=context.get("log_level", "normal") != "quiet",
+    )
+
+    if strategy == "history":
+        context["attempt_history"] = format_attempt_history(attempts)
+    elif strategy == "rewrite":
+        context["force_rewrite"] = True
+    elif strategy == "escalate" and context.get("base_model") is None:
+        context["base_model"] = context.get("model", "gpt-3.5-turbo-0613")
+        context["model"] = context.get("escalation_model", default_escalation_model)
+    return strategy
@@ -0,0 +1,297 @@
+import json
+import sys
+import time
+
+import openai
+from easycompletion import count_tokens
+from easycompletion.constants import DEFAULT_CHUNK_LENGTH, LONG_TEXT_MODEL
+from easycompletion.model import parse_arguments
+
+# Times to send a streamed request again when it fails before any of the response arrived
+default_stream_retries = 3
+
+whitespace = " \t\r\n"
+
+
+def new_argument_parser():
+    """
+    Returns the state of an incremental parser for the JSON arguments of a function call.
+    Feed it the arguments as they stream in with feed_arguments.
+    """
+    return {"state": "start", "key": None, "raw": "", "depth": 0, "quoted": False, "escaped": False, "fields": {}}
+
+
+def decode_string(raw):
+    return json.loads('"' + raw + '"', strict=False)
+
+
+def complete_field(parser, value):
+    parser["fields"][parser["key"]] = value
+    parser["raw"] = ""
+    return (parser["key"], value)
+
+
+def feed_arguments(parser, chunk):
+    """
+    Parses the next chunk of a function call's JSON arguments.
+    Returns the (key, value) pairs of the fields that were completed by this chunk.
+    Once the arguments stop looking like a JSON object the parser's state is "invalid",
+    and the arguments should be parsed as a whole when the response is finished.
+    """
+    completed = []
+    for character in chunk:
+        state = parser["state"]
+        if state in ["done", "invalid"]:
+            break
+        try:
+            if state == "start":
+                if character == "{":
+                    parser["state"] = "before_key"
+                elif character not in whitespace:
+                    parser["state"] = "invalid"
+            elif state == "before_key":
+                if character == '"':
+                    parser["state"] = "key"
+                elif character == "}":
+                    parser["state"] = "done"
+                elif character not in whitespace + ",":
+                    parser["state"] = "invalid"
+            elif state == "key" or state == "string":
+                if parser["escaped"]:
+                    parser["escaped"] = False
+                elif character == "\\":
+                    parser["escaped"] = True
+                elif character == '"':
+                    if state == "key":
+                        parser["key"] = decode_string(parser["raw"])
+                        parser["raw"] = ""
+                        parser["state"] = "colon"
+                    else:
+                        completed.append(complete_field(parser, decode_string(parser["raw"])))
+                        parser["state"] = "after_value"
+                    continue
+                parser["raw"] += character
+            elif state == "colon":
+                if character == ":":
+                    parser["state"] = "before_value"
+                elif character not in whitespace:
+                    parser["state"] = "invalid"
+            elif state == "before_value":
+                if character == '"':
+                    parser["state"] = "string"
+                elif character in "{[":
+                    parser["state"] = "nested"
+                    parser["depth"] = 1
+                    parser["raw"] = character
+                elif character not in whitespace:
+                    parser["state"] = "scalar"
+                    parser["raw"] = character
+            elif state == "scalar":
+                if character in whitespace + ",}":
+                    completed.append(complete_field(parser, json.loads(parser["raw"])))
+                    parser["state"] = {",": "before_key", "}": "done"}.get(character, "after_value")
+                else:
+                    parser["raw"] += character
+            elif state == "nested":
+                parser["raw"] += character
+                if parser["quoted"]:
+                    if parser["escaped"]:
+                        parser["escaped"] = False
+                    elif character == "\\":
+                        parser["escaped"] = True
+                    elif character == '"':
+                        parser["quoted"] = False
+                elif character == '"':
+                    parser["quoted"] = True
+                elif character in "{[":
+                    parser["depth"] += 1
+                elif character in "}]":
+                    parser["depth"] -= 1
+                    if parser["depth"] == 0:
+                        completed.append(complete_field(parser, json.loads(parser["raw"], strict=False)))
+                        parser["state"] = "after_value"
+            elif state == "after_value":
+                if character == ",":
+                    parser["state"] = "before_key"
+                elif character == "}":
+                    parser["state"] = "done"
+                elif character not in whitespace:
+                    parser["state"] = "invalid"
+        except ValueError:
+            parser["state"] = "invalid"
+    return completed
+
+
+def partial_field(parser):
+    """Returns the key and the text so far of the string field being streamed, or None."""
+    if parser["state"] != "string":
+        return None
+    raw = parser["raw"]
+    try:
+        return parser["key"], decode_string(raw)
+    except ValueError:
+        # The chunk ended inside an escape sequence
+        return parser["key"], decode_string(raw[: raw.rfind("\\")])
+
+
+def read_function_stream(chunks, on_field=None, on_progress=None, cancel=None):
+    """
+    Reads the chunks of a streamed chat completion with a function call.
+    on_field(function_name, key, value, fields) is called as soon as each argument is complete,
+    and on_progress(function_name, parser) after every chunk.
+    Returns the function name, the arguments text and parser, the text and the finish reason.
+    Once the cancel event is set the response is closed and cancelled is set in the result.
+    """
+    result = {"function_name": None, "arguments_text": "", "text": None, "finish_reason": None, "cancelled": False}
+    parser = new_argument_parser()
+    result["parser"] = parser
+    for chunk in chunks:
+        if cancel is not None and cancel.is_set():
+            result["cancelled"] = True
+            if hasattr(chunks, "close"):
+                # Closes the connection, so the server stops generating
+                chunks.close()
+            break
+        choices = chunk.get("choices") or []
+        if len(choices) == 0:
+            continue
+        choice = choices[0]
+        delta = choice.get("delta") or {}
+        if delta.get("content"):
+            result["text"] = (result["text"] or "") + delta["content"]
+        function_call = delta.get("function_call") or {}
+        if delta.get("tool_calls"):
+            # Servers that only speak the newer tools API, see helpers/backends.py
+            function_call = delta["tool_calls"][0].get("function") or {}
+        if function_call.get("name"):
+            result["function_name"] = (result["function_name"] or "") + function_call["name"]
+        arguments = function_call.get("arguments")
+        if arguments:
+            result["arguments_text"] += arguments
+            for key, value in feed_arguments(parser, arguments):
+                if on_field is not None:
+                    on_field(result["function_name"], key, value, parser["fields"])
+        if choice.get("finish_reason") is not None:
+            result["finish_reason"] = choice["finish_reason"]
+        if on_progress is not None:
+            on_progress(result["function_name"], parser)
+    return result
+
+
+def estimate_tokens(value, model):
+    try:
+        return count_tokens(value, model=model)
+    except Exception:
+        # No tokenizer for this model, about four characters per token
+        return len(str(value)) // 4
+
+
+def create_completion(model, messages, functions, function_call, temperature):
+    return openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        functions=functions,
+        function_call=function_call,
+        temperature=temperature,
+        stream=True,
+    )
+
+
+def stream_function_call(
+    text,
+    functions,
+    model,
+    temperature=0.0,
+    on_field=None,
+    on_progress=None,
+    retries=default_stream_retries,
+    create=create_completion,
+    long_model=LONG_TEXT_MODEL,
+    cancel=None,
+    should_retry=None,
+):
+    """
+    Like easycompletion's openai_function_call, but streams the response, so on_field and
+    on_progress see the arguments while they arrive, see read_function_stream.
+    Streamed responses don't report their usage, so the tokens are counted here.
+    create(model, messages, functions, function_call, temperature) sends the request and
+    returns the chunks, through the openai package unless a backend passes its own.
+    Prompts too long for the model's context go to long_model, unless it is None.
+    Setting the cancel event stops reading the response, see helpers/hedging.py.
+    A failed request is sent again up to retries times, unless should_retry(error) returns False.
+    """
+    function_call = functions[0]["name"] if len(functions) == 1 else "auto"
+    if function_call != "auto":
+        function_call = {"name": function_call}
+
+    input_tokens = estimate_tokens(text, model) + estimate_tokens(functions, model) + 3
+    # Same as openai_function_call, long prompts go to the long context model
+    if long_model is not None and input_tokens > DEFAULT_CHUNK_LENGTH and "16k" not in model:
+        model = long_model
+
+    streamed = []
+
+    def field(function_name, key, value, fields):
+        streamed.append(key)
+        if on_field is not None:
+            on_field(function_name, key, value, fields)
+
+    result = None
+    error = None
+    for _ in range(retries):
+        try:
+            chunks = create(model, [{"role": "user", "content": text}], functions, function_call, temperature)
+            result = read_function_stream(chunks, field, on_progress, cancel)
+            error = None
+            break
+        except Exception as e:
+            error = f"Model Error: {e}"
+            if len(streamed) > 0 or (cancel is not None and cancel.is_set()):
+                # on_field already saw part of this response, so don't start another
+                break
+            if should_retry is not None and not should_retry(e):
+                break
+            time.sleep(1)
+
+    if result is None or error is not None:
+        return {"error": error or "Could not get a successful response from the model."}
+    if result["cancelled"]:
+        return {"error": "Cancelled"}
+    if result["function_name"] is None:
+        return {"error": "No function call in response"}
+
+    parser = result["parser"]
+    arguments = parser["fields"] if parser["state"] == "done" else parse_arguments(result["arguments_text"])
+    return {
+        "text": result["text"],
+        "function_name": result["function_name"],
+        "arguments": arguments,
+        "usage": {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": estimate_tokens(result["arguments_text"], model),
+        },
+        "finish_reason": result["finish_reason"],
+        "error": None,
+    }
+
+
+def progress_printer(stream=None):
+    """Returns an on_progress callback that shows which field is streaming and how far along it is, on one line."""
+    stream = stream or sys.stdout
+    last = {"line": ""}
+
+    def show(function_name, parser):
+        partial = partial_field(parser)
+        if parser["state"] == "done":
+            line = f"{function_name}: done"
+        elif partial is not None:
+            key, value = partial
+            line = f"{function_name}: {key} {value.count(chr(10)) + 1} lines, {len(value)} characters"
+        else:
+            line = f"{function_name}: {', '.join(parser['fields']) or 'starting'}"
+        if line != last["line"]:
+            stream.write("\r" + line.ljust(len(last["line"])) + ("\n" if parser["state"] == "done" else ""))
+            stream.flush()
+            last["line"] = line
+
+    return show
@@ -0,0 +1,223 @@
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Bump whenever the validation rules change, so cached results from older rules are ignored
+validator_version = 2
+
+# Maximum number of parsed files kept in memory
+parse_cache_size = 256
+
+parse_cache = OrderedDict()
+parse_cache_lock = threading.Lock()
+
+# Validation results by (validator_version, content hash), kept across epochs
+validation_cache_size = 1024
+
+validation_cache = OrderedDict()
+validation_cache_lock = threading.Lock()
+
+
+def hash_code(code):
+    """Returns the sha256 hex digest of a string of code."""
+    if isinstance(code, str):
+        code = code.encode("utf-8", "surrogatepass")
+    return hashlib.sha256(code).hexdigest()
+
+
+def count_lines(code, exclude_comments=True, exclude_empty_lines=True):
+    lines = code.split("\n")
+    if exclude_comments:
+        lines = [line for line in lines if not line.startswith("#")]
+    if exclude_empty_lines:
+        lines = [line for line in lines if line.strip() != ""]
+    return len(lines)
+
+
+def collect_facts(tree):
+    """
+    Walks the AST once and collects everything the validation rules need to know:
+    whether there are function definitions, whether a function is called outside of
+    a function definition, and every import in the file.
+    """
+    facts = {
+        "has_function_definition": False,
+        "has_root_call": False,
+        "imports": [],
+    }
+    if tree is None:
+        return facts
+
+    # (node, inside_function_def)
+    stack = [(tree, False)]
+    while stack:
+        node, inside_function_def = stack.pop()
+        if isinstance(node, ast.FunctionDef):
+            facts["has_function_definition"] = True
+            inside_function_def = True
+        elif isinstance(node, ast.Call) and not inside_function_def:
+            facts["has_root_call"] = True
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                facts["imports"].append(
+                    {
+                        "module": alias.name,
+                        "names": [],
+                        "asname": alias.asname,
+                        "level": 0,
+                        "lineno": node.lineno,
+                    }
+                )
+        elif isinstance(node, ast.ImportFrom):
+            facts["imports"].append(
+                {
+                    "module": node.module,
+                    "names": [alias.name for alias in node.names],
+                    "asname": None,
+                    "level": node.level,
+                    "lineno": node.lineno,
+                }
+            )
+        # reversed so nodes are visited in source order
+        for child in reversed(list(ast.iter_child_nodes(node))):
+            stack.append((child, inside_function_def))
+
+    return facts
+
+
+def build_parsed(code):
+    tree = None
+    error = None
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:
+        error = e
+
+    return {
+        "hash": hash_code(code),
+        "source": code,
+        "line_count": count_lines(code),
+        "tree": tree,
+        "error": error,
+        "facts": collect_facts(tree),
+    }
+
+
+def parse_code(code):
+    """
+    Parses a string of Python code into a shared representation with the source, the AST
+    and the facts the validation rules use. Results are cached by content hash, so every
+    step that looks at the same file content shares one parse.
+
+    The returned dict and its tree are shared, so they must not be modified.
+    """
+    key = hash_code(code)
+    with parse_cache_lock:
+        parsed = parse_cache.get(key)
+        if parsed is not None:
+            parse_cache.move_to_end(key)
+            return parsed
+
+    parsed = build_parsed(code)
+
+    with parse_cache_lock:
+        parse_cache[key] = parsed
+        while len(parse_cache) > parse_cache_size:
+            parse_cache.popitem(last=False)
+    return parsed
+
+
+def clear_parse_cache():
+    with parse_cache_lock:
+        parse_cache.clear()
+
+
+def get_cached_validation(code):
+    """Returns the cached validation result for a string of code, or None."""
+    key = (validator_version, hash_code(code))
+    with validation_cache_lock:
+        result = validation_cache.get(key)
+        if result is None:
+            return None
+        validation_cache.move_to_end(key)
+        return dict(result)
+
+
+def set_cached_validation(code, result):
+    key = (validator_version, hash_code(code))
+    with validation_cache_lock:
+        validation_cache[key] = dict(result)
+        while len(validation_cache) > validation_cache_size:
+            validation_cache.popitem(last=False)
+
+
+def cached_validation(code, validate):
+    """
+    Returns the validation result for a string of code, calling validate(code) only if
+    this content hasn't been validated by the current validator version before.
+    """
+    result = get_cached_validation(code)
+    if result is None:
+        result = validate(code)
+        set_cached_validation(code, result)
+    return result
+
+
+def clear_validation_cache():
+    with validation_cache_lock:
+        validation_cache.clear()
+
+
+def empty_rule(parsed):
+    if parsed["line_count"] == 0:
+        return "The file doesn't have any code in it."
+
+
+def no_functions_rule(parsed):
+    facts = parsed["facts"]
+    if (
+        parsed["tree"] is not None
+        and not facts["has_root_call"]
+        and not facts["has_function_definition"]
+    ):
+        return "The file doesn't call any functions or have any functions. Please make sure the code meets the specifications and goals."
+
+
+def one_line_rule(parsed):
+    if parsed["line_count"] == 1 and len(parsed["source"]) > 50:
+        return "The file has more than 50 characters but only one line, probably one massive comment or something."
+
+
+def def_rule(parsed):
+    if "def" not in parsed["source"]:
+        return "The file doesn't have any functions. Please encapsulate all code inside functions."
+
+
+def todo_rule(parsed):
+    if "TODO" in parsed["source"]:
+        return "The file has a TODO in it. Please replace the TODO with real code or remove it."
+
+
+def ellipsis_rule(parsed):
+    if "..." in parsed["source"]:
+        return "The file has a '...' in it. This indicates that it is not a complete file. Please respond with the complete script and do not omit any functions, code, tests or sections. Your response should include all code, including imports, and tests, not just changes to code."
+
+
+# Rules are checked in order, the first one that returns an error wins
+validation_rules = [
+    empty_rule,
+    no_functions_rule,
+    one_line_rule,
+    def_rule,
+    todo_rule,
+    ellipsis_rule,
+]
+
+
+def validate_parsed(parsed, rules=None):
+    for rule in rules or validation_rules:
+        error = rule(parsed)
+        if error is not None:
+            return {"success": False, "error": error}
+    return {"success": True, "error": None}
@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 
 from dotenv import load_dotenv
 
@@ -36,6 +37,8 @@ def autocoder(project_data):
             # Should only run on the first run
             context = project_data
             context["running"] = True
+            # Wall clock budget, see helpers/budget.py
+            context["started_at"] = time.time()
         return context
 
     loop_dict = start([initialize, reason, act], paused=project_data["step"])
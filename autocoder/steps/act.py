@@ -1,10 +1,16 @@
 import os
 import re
-from easycompletion import compose_function, compose_prompt, openai_function_call
-from autocoder.helpers.code import save_code
+from concurrent.futures import ThreadPoolExecutor
+from easycompletion import compose_function, compose_prompt
+from autocoder.helpers.autofix import get_indent
+from autocoder.helpers.code import compile_code, extract_imports, prepare_code, save_code, save_files
 from autocoder.helpers.context import handle_packages
 
 from autocoder.helpers.files import get_full_path
+from autocoder.helpers.installs import partial_imports, start_installs
+from autocoder.helpers.llm import function_call
+from autocoder.helpers.stall import fingerprint, is_stalled, record_action
+from autocoder.helpers.stream import partial_field
 from agentlogger import log
 
 create_prompt = """Task: Create a Python module that meets the stated goals, along with a set of tests for that module.
@@ -41,6 +47,7 @@ This is my project goal:
 {{reasoning}}
 {{project_code_formatted}}
 {{errors_formatted}}
+{{attempt_history}}
 {{available_action_names}}
 
 Task:
@@ -52,6 +59,12 @@ Task:
 
 """
 
+repair_prompt = """
+
+Your last response would leave code that doesn't compile:
+{{compile_errors}}
+Respond again with the same function and fix these errors. Include the correct indentation."""
+
 create_function = compose_function(
     name="create",
     description="Create a new script called main.py, as well as a test for main.py named main_test.py.",
@@ -92,12 +105,18 @@ def create_handler(arguments, context):
         log=should_log,
     )
 
-    save_code(code, f"{project_dir}/main.py")
-    save_code(test, f"{project_dir}/main_test.py")
+    # Only the file and its test, formatting two files isn't worth a trip through the worker pool
+    save_files(create_preview(arguments, context))
 
     return context
 
 
+def create_preview(arguments, context):
+    """Returns the (code, path) pairs create_handler would write."""
+    project_dir = context["project_dir"]
+    return [(arguments["code"], f"{project_dir}/main.py"), (arguments["test"], f"{project_dir}/main_test.py")]
+
+
 def remove_line_numbers(text):
     # Regular expression pattern to match '[n]' at the beginning of a line
     pattern = r"^\s*\[\d+\]\s*"
@@ -135,6 +154,11 @@ def write_complete_script_handler(arguments, context):
     return context
 
 
+def write_complete_script_preview(arguments, context):
+    code = remove_line_numbers(arguments["code"])
+    return [(code, get_full_path(arguments["filepath"], context["project_dir"]))]
+
+
 def insert_code_handler(arguments, context):
     should_log = context.get("log_level", "normal") != "quiet"
     reasoning = arguments["reasoning"]
@@ -152,11 +176,7 @@ def insert_code_handler(arguments, context):
         log=should_log,
     )
 
-    with open(write_path, "r") as f:
-        text = f.read()
-    lines = text.split("\n")
-    lines.insert(start_line, code)
-    text = "\n".join(lines)
+    [(text, write_path)] = insert_code_preview(arguments, context)
 
     log(f"New code:\n{text}", title="action", type="insert", log=should_log)
 
@@ -164,6 +184,15 @@ def insert_code_handler(arguments, context):
     return context
 
 
+def insert_code_preview(arguments, context):
+    write_path = get_full_path(arguments["filepath"], context["project_dir"])
+    with open(write_path, "r") as f:
+        text = f.read()
+    lines = text.split("\n")
+    lines.insert(arguments["start_line"], arguments["code"])
+    return [("\n".join(lines), write_path)]
+
+
 def edit_code_handler(arguments, context):
     edit_type = arguments["edit_type"]
     if edit_type == "insert":
@@ -174,6 +203,17 @@ def edit_code_handler(arguments, context):
         return remove_code_handler(arguments, context)
 
 
+def edit_code_preview(arguments, context):
+    edit_type = arguments["edit_type"]
+    if edit_type == "insert":
+        return insert_code_preview(arguments, context)
+    elif edit_type == "replace":
+        return replace_code_preview(arguments, context)
+    elif edit_type == "remove":
+        return remove_code_preview(arguments, context)
+    return []
+
+
 def replace_code_handler(arguments, context):
     should_log = context.get("log_level", "normal") != "quiet"
     reasoning = arguments["reasoning"]
@@ -192,6 +232,34 @@ def replace_code_handler(arguments, context):
         log=should_log,
     )
 
+    [(text, write_path)] = replace_code_preview(arguments, context)
+
+    log(f"New code:\n{text}", title="action", type="replace", log=should_log)
+
+    # The lines that were replaced and how they were indented, for the indentation fixer in helpers/autofix.py
+    with open(write_path, "r") as f:
+        replaced = f.read().split("\n")[max(start_line, 1) - 1 : end_line]
+    save_code(text, write_path)
+
+    # The fixer checks the file is still as this edit left it
+    with open(write_path, "r") as f:
+        saved = f.read()
+    context["last_edit"] = {
+        "path": write_path,
+        "start_line": max(start_line, 1),
+        "line_count": len(code.split("\n")),
+        "indent": get_indent(next((line for line in replaced if line.strip() != ""), "")),
+        "fingerprint": fingerprint(saved),
+    }
+
+    return context
+
+
+def replace_code_preview(arguments, context):
+    start_line = int(arguments["start_line"])
+    end_line = int(arguments["end_line"])
+    write_path = get_full_path(arguments["filepath"], context["project_dir"])
+
     # floor start_line to 1
     if start_line < 1:
         start_line = 1
@@ -200,14 +268,8 @@ def replace_code_handler(arguments, context):
     with open(write_path, "r") as f:
         text = f.read()
     lines = text.split("\n")
-    lines[start_line - 1 : end_line] = [code]  # python's list indices start at 0
-    text = "\n".join(lines)
-
-    log(f"New code:\n{lines}", title="action", type="replace", log=should_log)
-
-    save_code(text, write_path)
-
-    return context
+    lines[start_line - 1 : end_line] = [arguments["code"]]  # python's list indices start at 0
+    return [("\n".join(lines), write_path)]
 
 
 def remove_code_handler(arguments, context):
@@ -226,13 +288,7 @@ def remove_code_handler(arguments, context):
         log=should_log,
     )
 
-    # Remove the code between start_lines and end_lines
-    with open(write_path, "r") as f:
-        text = f.read()
-    lines = text.split("\n")
-    del lines[start_line - 1 : end_line]  # python's list indices start at 0
-
-    lines = "\n".join(lines)
+    [(lines, write_path)] = remove_code_preview(arguments, context)
 
     log(f"New code:\n{lines}", title="action", type="remove", log=should_log)
 
@@ -241,6 +297,16 @@ def remove_code_handler(arguments, context):
     return context
 
 
+def remove_code_preview(arguments, context):
+    write_path = get_full_path(arguments["filepath"], context["project_dir"])
+    # Remove the code between start_lines and end_lines
+    with open(write_path, "r") as f:
+        text = f.read()
+    lines = text.split("\n")
+    del lines[int(arguments["start_line"]) - 1 : int(arguments["end_line"])]  # python's list indices start at 0
+    return [("\n".join(lines), write_path)]
+
+
 def create_new_file_handler(arguments, context):
     should_log = context.get("log_level", "normal") != "quiet"
     reasoning = arguments["reasoning"]
@@ -258,17 +324,20 @@ def create_new_file_handler(arguments, context):
         log=should_log,
     )
 
-    # Create a new file at filepath with code
-    write_path = get_full_path(filepath, context["project_dir"])
-    save_code(code, write_path)
+    # Only the file and its test, formatting two files isn't worth a trip through the worker pool
+    save_files(create_new_file_preview(arguments, context))
 
-    # Create a new file at filepath_test.py with test
+    return context
+
+
+def create_new_file_preview(arguments, context):
+    # Create a new file at filepath with code, and a new file at filepath_test.py with test
+    filepath = arguments["filepath"]
+    write_path = get_full_path(filepath, context["project_dir"])
     test_path = get_full_path(
         f"{os.path.splitext(filepath)[0]}_test.py", context["project_dir"]
     )
-    save_code(test, test_path)
-
-    return context
+    return [(arguments["code"], write_path), (arguments["test"], test_path)]
 
 
 def delete_file_handler(arguments, context):
@@ -347,6 +416,7 @@ def get_actions():
         #         ],
         #     ),
         #     "handler": create_new_file_handler,
+        #     "preview": create_new_file_preview,
         # },
         # {
         #     "function": compose_function(
@@ -365,6 +435,7 @@ def get_actions():
         #         required_properties=["reasoning", "filepath"],
         #     ),
         #     "handler": delete_file_handler,
+        #     "preview": lambda arguments, context: [],
         # },
         # {
         #     "function": compose_function(
@@ -407,6 +478,7 @@ def get_actions():
         #         ],
         #     ),
         #     "handler": edit_code_handler,
+        #     "preview": edit_code_preview,
         # },
         {
             "function": compose_function(
@@ -443,6 +515,7 @@ def get_actions():
                 ],
             ),
             "handler": replace_code_handler,
+            "preview": replace_code_preview,
         },
         {
             "function": compose_function(
@@ -465,34 +538,144 @@ def get_actions():
                 required_properties=["reasoning", "filepath", "code"],
             ),
             "handler": write_complete_script_handler,
+            "preview": write_complete_script_preview,
         },
     ]
 
 
-def step(context):
-    """
-    This function serves as the 'Act' stage in the OODA loop. It executes the selected action from the 'Decide' stage.
+# Arguments that hold a whole file, by function name
+streamed_files = {"create": ["code", "test"], "write_code": ["code"]}
 
-    Args:
-        context (dict): The dictionary containing data about the current state of the system, including the selected action to be taken.
 
-    Returns:
-        dict: The updated context dictionary after the 'Act' stage, which will be used in the next iteration of the OODA loop.
+def start_streamed_work(context):
     """
+    Returns the on_field and on_progress callbacks for function_call, and the work they start.
+    Files are compiled, formatted and scanned for imports as soon as their argument is complete,
+    while the rest of the response is still arriving. The results are cached by content in
+    helpers/code.py, so checking and saving the response reuses them.
 
-    if context["running"] == False:
-        return context
+    With speculative_installs set, missing packages start installing in the background as soon
+    as their import line has streamed in, see helpers/installs.py.
+    """
+    speculative = context.get("speculative_installs", False)
+    work = {"executor": ThreadPoolExecutor(max_workers=2), "futures": [], "scanned": {}}
+
+    def on_field(function_name, key, value, fields):
+        if key not in streamed_files.get(function_name, []) or not isinstance(value, str):
+            return
+        code = remove_line_numbers(value) if function_name == "write_code" else value
+        work["futures"].append(work["executor"].submit(prepare_streamed_code, code, context))
+
+    def on_progress(function_name, parser):
+        partial = partial_field(parser)
+        if not speculative or partial is None or partial[0] not in streamed_files.get(function_name, []):
+            return
+        key, code = partial
+        # Only read the lines that were completed since the last chunk
+        scanned = work["scanned"].get(key, 0)
+        end = code.rfind("\n") + 1
+        if end > scanned:
+            work["scanned"][key] = end
+            start_installs(context, partial_imports(code[scanned:end], context["project_dir"]))
+
+    work["on_field"] = on_field
+    work["on_progress"] = on_progress
+    return work
+
+
+def prepare_streamed_code(code, context):
+    imports = extract_imports(code, context["project_dir"])
+    if context.get("speculative_installs", False):
+        start_installs(context, imports)
+    compile_code(code)
+    prepare_code(code)
+    return imports
+
+
+def finish_streamed_work(context, work):
+    """Waits for the work start_streamed_work started, and keeps the packages it found in streamed_imports."""
+    imports = set()
+    for future in work["futures"]:
+        imports |= future.result()
+    work["executor"].shutdown()
+    context["streamed_imports"] = sorted(imports)
+    return context
 
+
+def compile_errors(files, project_dir):
+    """Compiles previewed (code, path) pairs in memory. Returns an error with the failing lines for each one that doesn't compile."""
+    errors = []
+    for code, path in files:
+        if not path.endswith(".py"):
+            continue
+        compiled = compile_code(code, path)
+        if compiled["success"]:
+            continue
+        error = f"{os.path.relpath(path, project_dir)}: {compiled['error']}"
+        if compiled["line"] is not None:
+            lines = code.split("\n")
+            first = max(1, compiled["line"] - 2)
+            last = min(len(lines), compiled["line"] + 2)
+            error += "\n" + "\n".join(f"[{i}] {lines[i - 1]}" for i in range(first, last + 1))
+        errors.append(error)
+    return errors
+
+
+def preview_errors(response, previews, context):
+    """Returns the compile errors the files would have after the response's function runs."""
+    preview = previews.get(response.get("function_name"))
+    if preview is None:
+        return []
+    try:
+        files = preview(response["arguments"], context)
+    except (OSError, KeyError, TypeError, ValueError):
+        # The handler will run into the same problem, nothing to compile
+        return []
+    return compile_errors(files, context["project_dir"])
+
+
+def repair_response(response, ask, previews, context):
+    """
+    Checks that the code a response would write compiles before anything is written.
+    If it doesn't, ask is called with the compile errors to get a new response, up to
+    "max_repair_attempts" times (2 by default). Returns the last response either way.
+    """
     should_log = context.get("log_level", "normal") != "quiet"
-    debug = context.get("log_level", "normal") == "debug"
+    max_attempts = context.get("max_repair_attempts", 2)
+    attempts = 0
+    while True:
+        errors = preview_errors(response, previews, context)
+        if len(errors) == 0:
+            return response
+        if attempts >= max_attempts:
+            log(
+                "The code still doesn't compile, writing it anyway:\n" + "\n".join(errors),
+                title="repair",
+                type="warning",
+                log=should_log,
+            )
+            return response
 
-    log(
-        "Act Step Started",
-        title="step",
-        type="info",
-        log=should_log,
-    )
+        attempts += 1
+        context["repair_attempts"] = context.get("repair_attempts", 0) + 1
+        log(
+            f"The code doesn't compile, asking for a fix (attempt {attempts} of {max_attempts}):\n" + "\n".join(errors),
+            title="repair",
+            type="warning",
+            log=should_log,
+        )
+        repaired = ask("\n".join(errors))
+        if repaired is None or repaired.get("function_name") not in previews:
+            return response
+        response = repaired
 
+
+def compose_action_request(context):
+    """
+    Builds the prompt for choosing the next action. Describes the available actions in the context
+    and returns the prompt text, the functions to offer and the actions they belong to.
+    """
+    should_log = context.get("log_level", "normal") != "quiet"
     prompt = edit_prompt
     actions = get_actions()
 
@@ -503,6 +686,10 @@ def step(context):
     if context["file_count"] == 0:
         prompt = create_prompt
         functions = [create_function]
+    elif context.get("force_rewrite", False):
+        # Stuck on the same errors, see helpers/stall.py, so write the file again instead of patching it
+        actions = [f for f in actions if f["function"]["name"] == "write_code"]
+        functions = [f["function"] for f in actions]
 
     context["available_actions"] = "Available functions:\n"
     for fn in actions:
@@ -518,6 +705,9 @@ def step(context):
         [fn["function"]["name"] for fn in actions]
     )
 
+    if context.get("attempt_history") is None:
+        prompt = prompt.replace("{{attempt_history}}", "")
+
     if context.get("reasoning") is None:
         # find {{reasoning}} in prompt and replace with empty string
         prompt = prompt.replace("{{reasoning}}", "")
@@ -529,18 +719,87 @@ def step(context):
             log=should_log,
         )
 
-    text = compose_prompt(prompt, context)
+    return compose_prompt(prompt, context), functions, actions
 
-    response = openai_function_call(
-        text=text,
-        functions=functions,
-        debug=debug,
-        model=context.get("model", "gpt-3.5-turbo-0613"),
+
+def step(context):
+    """
+    This function serves as the 'Act' stage in the OODA loop. It executes the selected action from the 'Decide' stage.
+
+    Args:
+        context (dict): The dictionary containing data about the current state of the system, including the selected action to be taken.
+
+    Returns:
+        dict: The updated context dictionary after the 'Act' stage, which will be used in the next iteration of the OODA loop.
+    """
+
+    if context["running"] == False:
+        return context
+
+    should_log = context.get("log_level", "normal") != "quiet"
+    debug = context.get("log_level", "normal") == "debug"
+
+    log(
+        "Act Step Started",
+        title="step",
+        type="info",
+        log=should_log,
     )
 
+    # Only replace_code sets this, an edit from an earlier step says nothing about this one
+    context["last_edit"] = None
+
+    # Start on the files while the response streams in, see helpers/stream.py
+    work = {"on_field": None, "on_progress": None}
+    if context.get("stream_responses", False) or context.get("speculative_installs", False):
+        work = start_streamed_work(context)
+
+    # The reason step may already have chosen the action, see handle_fused_response in reason.py
+    pending = context.pop("pending_action", None)
+    if pending is not None:
+        text = pending["text"]
+        functions = pending["functions"]
+        actions = pending["actions"]
+        response = pending["response"]
+        if work["on_field"] is not None and response.get("error") is None:
+            for key, value in response["arguments"].items():
+                work["on_field"](response["function_name"], key, value, response["arguments"])
+    else:
+        text, functions, actions = compose_action_request(context)
+        response = function_call(
+            context,
+            text,
+            functions,
+            cache=not is_stalled(context),
+            on_field=work["on_field"],
+            on_progress=work["on_progress"],
+        )
+
+    # Compile the result of the function in memory, and ask again with the errors if it doesn't compile
+    previews = {f["function"]["name"]: f["preview"] for f in actions}
+    if context["file_count"] == 0:
+        previews = {"create": create_preview}
+    response = repair_response(
+        response,
+        lambda errors: function_call(
+            context,
+            text + repair_prompt.replace("{{compile_errors}}", errors),
+            functions,
+            cache=not is_stalled(context),
+            on_field=work["on_field"],
+            on_progress=work["on_progress"],
+        ),
+        previews,
+        context,
+    )
+
+    if "executor" in work:
+        context = finish_streamed_work(context, work)
+
     # find the function in functions with the name that matches response["function_name"]
     # then call the handler with the arguments and context
     function_name = response["function_name"]
+    context = record_action(context, function_name, response["arguments"])
 
     # if function_name is create, then we need to create a new file
     if function_name == "create":
@@ -572,7 +831,8 @@ def step(context):
     # call the handler with the arguments and context
     context = action["handler"](arguments, context)
 
-    # install any new imports if there are any
-    context = handle_packages(context)
+    # install any new imports if there are any, or let the reason step wait for the ones installing in the background
+    if not context.get("speculative_installs", False):
+        context = handle_packages(context)
 
     return context
@@ -1,12 +1,18 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from easycompletion import (
-    openai_function_call,
     compose_prompt,
     compose_function,
 )
-from autocoder.helpers.code import validate_file
-
+from autocoder.helpers.autofix import autofix_project, get_autofix_stats
+from autocoder.helpers.budget import get_budget_usage, record_snapshot, restore_best_snapshot, start_epoch
 from autocoder.helpers.context import (
+    analyze_files,
+    assume_execution_passed,
     backup_project,
+    clear_main_result,
+    clear_test_results,
     collect_errors,
     collect_files,
     get_file_count,
@@ -15,6 +21,12 @@ from autocoder.helpers.context import (
     run_tests,
     validate_files,
 )
+from autocoder.helpers.gate import completion_gate, default_gate_model
+from autocoder.helpers.installs import wait_for_installs
+from autocoder.helpers.llm import function_call
+from autocoder.helpers.pipeline import run_stages, stage
+from autocoder.helpers.stall import detect_stall, is_stalled
+from autocoder.steps.act import compose_action_request
 
 from agentlogger import log
 
@@ -31,6 +43,25 @@ Your task: Evaluate the code and determine if it meets the goal, or what could b
 - If there is way to improve the code, respond with is_valid_and_complete=False.
 """
 
+fused_prompt = """
+If the code already meets every goal and there is nothing left to improve, call project_complete instead of editing anything.
+"""
+
+
+def compose_project_complete_function():
+    """The function the model calls in fused mode when there is nothing left to do."""
+    return compose_function(
+        name="project_complete",
+        description="The code fills the specification and completes all of my goals, there is nothing left to improve.",
+        properties={
+            "reasoning": {
+                "type": "string",
+                "description": "Explain why the code is valid and complete.",
+            },
+        },
+        required_properties=["reasoning"],
+    )
+
 
 def compose_project_validation_function():
     """
@@ -56,6 +87,189 @@ def compose_project_validation_function():
     )
 
 
+def compose_completion_check(context):
+    """
+    Builds the request that asks if the project is complete: the prompt text, the functions
+    to offer and, in fused mode, the edit actions offered alongside project_complete.
+    """
+    if context.get("fused_steps", False):
+        # Nothing failed, so there is no reasoning to pass on from an earlier epoch
+        context["reasoning"] = None
+        text, functions, actions = compose_action_request(context)
+        return {
+            "text": text + fused_prompt,
+            "functions": functions + [compose_project_complete_function()],
+            "actions": actions,
+        }
+    return {
+        "text": compose_prompt(reasoning_prompt, context),
+        "functions": compose_project_validation_function(),
+        "actions": None,
+    }
+
+
+def request_completion_check(context, check, model=None, cancel=None):
+    # A fused check also asks for the next edit, see is_stalled
+    cache = check["actions"] is None or not is_stalled(context)
+    return function_call(context, check["text"], check["functions"], model, cache=cache, cancel=cancel)
+
+
+def stop_for_budget(context, loop_dict, exceeded):
+    """Stops the loop because a budget was used up, and puts back the code that had the fewest errors."""
+    should_log = context.get("log_level", "normal") != "quiet"
+    used = get_budget_usage(context)
+    message = f"Stopping, the {exceeded} budget of {context[exceeded]} was reached ({used[exceeded]:.4g} used)."
+    best = restore_best_snapshot(context)
+    if best is not None:
+        message += f" Restored the code from epoch {best['epoch']}, which had {best['errors']} errors."
+    log(message, title="budget", type="warning", log=should_log)
+    stop(loop_dict)
+    context["running"] = False
+    context["stop_reason"] = "budget"
+    context["budget_exceeded"] = exceeded
+    context["budget_usage"] = used
+    return context
+
+
+def start_speculative_check(context):
+    """
+    With speculative_reasoning, sends the completion check while the tests and main.py run,
+    written as if they will pass. Only done when the last epoch passed every check, since
+    that is when the check is usually needed. The request is left in context["speculative_check"].
+    """
+    context["speculative_check"] = None
+    if not context.get("speculative_reasoning", False) or not context.get("last_checks_passed", False):
+        return context
+    if context["project_validated"] is False:
+        return context
+
+    check = compose_completion_check(assume_execution_passed(context))
+    # Set when the check is discarded, which stops a streamed response
+    check["cancel"] = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    check["future"] = executor.submit(request_completion_check, context, check, None, check["cancel"])
+    executor.shutdown(wait=False)
+    context["speculative_check"] = check
+    stats = context.setdefault("speculation_stats", {"sent": 0, "used": 0, "discarded": 0})
+    stats["sent"] += 1
+    return context
+
+
+def take_speculative_response(context, speculative, check):
+    """
+    Returns the response to the speculative check if it asked exactly what check asks now,
+    otherwise None. The check is discarded when the results differ from what it assumed.
+    """
+    if speculative is None:
+        return None
+    if speculative["text"] != check["text"] or speculative["functions"] != check["functions"]:
+        discard_speculative_check(context, speculative, "the project changed while it ran")
+        return None
+    try:
+        response = speculative["future"].result()
+    except Exception as e:
+        discard_speculative_check(context, speculative, f"the request failed: {e}")
+        return None
+    context["speculation_stats"]["used"] += 1
+    return response
+
+
+def discard_speculative_check(context, speculative, reason):
+    """Counts the speculative check as discarded and cancels its request if it is still running."""
+    if speculative.get("cancel") is not None:
+        speculative["cancel"].set()
+    context["speculation_stats"]["discarded"] += 1
+    log(
+        f"Discarding the speculative completion check, {reason}",
+        title="speculation",
+        type="info",
+        log=context.get("log_level", "normal") == "debug",
+    )
+
+
+# Checks run on the project before reasoning. Backup, tests and main.py are independent,
+# and any failed check is enough to go fix it, so the slower checks can be cancelled.
+# Tests and main.py wait for the static checks, which take milliseconds, and are skipped if they fail.
+# They also wait for the packages still installing from the last act step, see helpers/installs.py.
+reason_stages = [
+    stage("backup_project", backup_project),
+    stage("collect_files", collect_files),
+    stage("wait_for_installs", wait_for_installs, after=["collect_files"]),
+    stage(
+        "validate_files",
+        validate_files,
+        after=["collect_files"],
+        decides=lambda context: context["project_validated"] is False,
+    ),
+    stage(
+        "analyze_files",
+        analyze_files,
+        after=["validate_files"],
+        decides=lambda context: context["project_validated"] is False,
+    ),
+    stage("start_speculative_check", start_speculative_check, after=["analyze_files"]),
+    stage(
+        "run_tests",
+        run_tests,
+        after=["analyze_files", "wait_for_installs"],
+        cancellable=True,
+        decides=lambda context: context["project_tested"] is False,
+        on_cancel=clear_test_results,
+    ),
+    stage(
+        "run_main",
+        run_main,
+        after=["analyze_files", "wait_for_installs"],
+        cancellable=True,
+        decides=lambda context: context.get("main_success") is False,
+        on_cancel=clear_main_result,
+    ),
+    stage("collect_errors", collect_errors, after=["run_tests", "run_main"]),
+    stage("read_and_format_code", read_and_format_code, after=["collect_errors"]),
+]
+
+
+def run_checks(context):
+    """
+    Runs the reason stages. Returns the speculative completion check, or None if there isn't
+    one or the checks found errors it didn't expect.
+    """
+    context = run_stages(
+        context,
+        reason_stages,
+        parallel=context.get("parallel_stages", True),
+        fail_fast=context.get("fail_fast", True),
+    )
+
+    # The speculative check assumed everything would pass
+    speculative = context.pop("speculative_check", None)
+    context["last_checks_passed"] = len(context["errors"]) == 0
+    if speculative is not None and not context["last_checks_passed"]:
+        discard_speculative_check(context, speculative, "the checks found errors")
+        speculative = None
+    return speculative
+
+
+def autofix_checks(context, speculative):
+    """
+    Fixes mechanical errors without the model and runs the checks again, up to max_autofix_rounds
+    times, see helpers/autofix.py. Returns the speculative check of the last run, like run_checks.
+    """
+    rounds = 0
+    while (
+        not context["last_checks_passed"]
+        and context.get("autofix", True)
+        and rounds < context.get("max_autofix_rounds", 3)
+        and len(autofix_project(context)) > 0
+    ):
+        rounds += 1
+        speculative = run_checks(context)
+    if rounds > 0 and context["last_checks_passed"]:
+        # The fixes left nothing for the model to edit
+        get_autofix_stats(context)["model_calls_saved"] += 1
+    return speculative
+
+
 def step(context, loop_dict):
     """
     This function serves as the 'Decide' stage in the OODA loop. It uses the current context data to assess which action should be taken next.
@@ -77,6 +291,11 @@ def step(context, loop_dict):
         log=should_log,
     )
 
+    # Stop once a budget is used up, see helpers/budget.py
+    exceeded = start_epoch(context)
+    if exceeded is not None:
+        return stop_for_budget(context, loop_dict, exceeded)
+
     context = get_file_count(context)
 
     debug = context.get("log_level", "normal") == "debug"
@@ -92,13 +311,24 @@ def step(context, loop_dict):
         )
         return context
 
-    context = backup_project(context)
-    context = collect_files(context)
-    context = validate_files(context)
-    context = run_tests(context)
-    context = run_main(context)
-    context = collect_errors(context)
-    context = read_and_format_code(context)
+    speculative = autofix_checks(context, run_checks(context))
+    # The indentation fixer only gets one pass at the last edit
+    context["last_edit"] = None
+
+    context = record_snapshot(context)
+
+    # Errors that keep coming back are handled by the stall_strategy, see helpers/stall.py
+    if detect_stall(context) == "stop":
+        log(
+            "Stopping, the same errors keep coming back",
+            title="stall",
+            type="error",
+            log=should_log,
+        )
+        stop(loop_dict)
+        context["running"] = False
+        context["stop_reason"] = "stalled"
+        return context
 
     # format context into a string of key:value
     context_str = ""
@@ -121,19 +351,22 @@ def step(context, loop_dict):
             type="error",
             log=should_log,
         )
-        context[
-            "reasoning"
-        ] = "main.py failed to run - I probably need to fix that before I can do anything else."
+        if context.get("main_timed_out"):
+            context[
+                "reasoning"
+            ] = "main.py ran until it was stopped by the timeout - it probably loops forever or waits for input. I need to make it finish on its own."
+        else:
+            context[
+                "reasoning"
+            ] = "main.py failed to run - I probably need to fix that before I can do anything else."
         return context
 
     # If any of the files failed to validate for any reason, go immediately to the edit step
     if context["project_validated"] is False:
         validation_errors = ""
         for file_dict in context["project_code"]:
-            file_path = file_dict["absolute_path"]
-            validation = validate_file(file_path)
-            if validation["success"] is False:
-                validation_errors += f"\n{file_path}:\n{validation['error']}\n"
+            if file_dict.get("validation_success") is False:
+                validation_errors += f"\n{file_dict['absolute_path']}:\n{file_dict['validation_error']}\n"
         if validation_errors != "":
             log(
                 "Project failed to validate. Errors:\n" + validation_errors,
@@ -168,13 +401,32 @@ def step(context, loop_dict):
             ] = "The project failed in testing. I need to fix the test errors."
             return context
 
-    text = compose_prompt(reasoning_prompt, context)
-    functions = compose_project_validation_function()
+    # Enough test coverage and no errors can settle the check without the usual model, see helpers/gate.py
+    gate = completion_gate(context)
+    if gate == "complete":
+        if speculative is not None:
+            discard_speculative_check(context, speculative, "the completion gate decided")
+        coverage = context["project_coverage"]
+        log(
+            f"Project is valid and complete, the tests cover {coverage['line_rate']:.0%} of the lines "
+            f"and {coverage['branch_rate']:.0%} of the branches. Good luck!",
+            title="validation",
+            type="success",
+            log=should_log,
+        )
+        stop(loop_dict)
+        context["running"] = False
+        context["stop_reason"] = "completion_gate"
+        return context
 
-    # Handle the auto case
-    response = openai_function_call(
-        text=text, functions=functions, debug=debug, model=context.get("model", "gpt-3.5-turbo-0613")
-    )
+    check = compose_completion_check(context)
+    response = take_speculative_response(context, speculative, check)
+    if response is None:
+        model = context.get("gate_model", default_gate_model) if gate == "cheap_model" else None
+        response = request_completion_check(context, check, model)
+
+    if check["actions"] is not None:
+        return handle_fused_response(context, loop_dict, check, response)
 
     # Add the action reasoning to the context object
     is_valid_and_complete = response["arguments"]["is_valid_and_complete"]
@@ -199,3 +451,40 @@ def step(context, loop_dict):
 
     context["reasoning"] = response["arguments"]["reasoning"]
     return context
+
+
+def handle_fused_response(context, loop_dict, check, response):
+    """
+    Handles the answer to a fused check, which asked once whether the project is complete and,
+    if it isn't, for the next edit: the edit functions are offered together with project_complete.
+    The chosen edit is left in context["pending_action"] for the act step, which runs it without asking again.
+    """
+    should_log = context.get("log_level", "normal") != "quiet"
+
+    if response.get("function_name") == "project_complete":
+        log(
+            "Project is valid and complete. Good luck!",
+            title="validation",
+            type="success",
+            log=should_log,
+        )
+        stop(loop_dict)
+        context["running"] = False
+        context["reasoning"] = response["arguments"].get("reasoning")
+        return context
+
+    if response.get("function_name") in [f["function"]["name"] for f in check["actions"]]:
+        context["reasoning"] = response["arguments"].get("reasoning")
+        log(
+            context["reasoning"],
+            title="validation",
+            type="reasoning",
+            log=should_log,
+        )
+        context["pending_action"] = {
+            "response": response,
+            "text": check["text"],
+            "functions": check["functions"],
+            "actions": check["actions"],
+        }
+    return context
@@ -1,3 +1,21 @@
+from .analysis import *
+from .autofix import *
+from .backends import *
+from .budget import *
 from .code import *
 from .context import *
-from .files import *
\ No newline at end of file
+from .files import *
+from .fingerprint import *
+from .gate import *
+from .hedging import *
+from .impact import *
+from .installs import *
+from .llm import *
+from .parallel import *
+from .pipeline import *
+from .response_cache import *
+from .sandbox import *
+from .server import *
+from .stall import *
+from .stream import *
+from .validation import *
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import tempfile
+
+from autocoder.helpers.analysis import local_import_errors, main_guard_errors, undefined_name_errors
+from autocoder.helpers.code import validate_code
+from autocoder.helpers.context import analyze_files, collect_files, validate_files
+from autocoder.helpers.validation import parse_code
+
+
+def write_file(directory, name, content):
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_undefined_names():
+    code = """
+import random
+
+counter = 0
+
+def roll(sides):
+    global total
+    total = random.randint(1, sides)
+    return total + counter + __file__.count("/")
+
+class Dice:
+    sides = 6
+
+    def roll(self):
+        return roll(sides)
+
+def main():
+    print(os.getcwd(), [value for value in range(3)], missing_function(), total)
+
+main()
+"""
+    errors = undefined_name_errors(parse_code(code))
+    assert errors == [
+        "Line 15: name 'sides' is not defined.",
+        "Line 18: name 'missing_function' is not defined.",
+        "Line 18: os is used but never imported. Add import os at the top of the file.",
+    ]
+
+
+def test_undefined_names_star_import():
+    assert undefined_name_errors(parse_code("from math import *\n\nprint(pi)\n")) == []
+
+
+def test_validate_code_reports_undefined_names():
+    result = validate_code("def main():\n    print(sys.argv)\n\nmain()\n")
+    assert result["success"] is False
+    assert result["error"].startswith("Static analysis found names that are used but never defined:")
+    assert "Line 2: sys is used but never imported" in result["error"]
+
+
+def test_local_import_errors():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_file(tmpdirname, "helper.py", "import os\n\ndef greet(name):\n    return 'hi ' + name\n")
+        write_file(tmpdirname, "package/__init__.py", "VERSION = 1\n")
+        write_file(tmpdirname, "package/tools.py", "def tool():\n    return 1\n")
+        code = """
+import json
+import helper
+import helper as h
+from helper import greet, wave
+from package import VERSION, tools, missing
+from package.gone import thing
+from .sibling import value
+
+def main(h):
+    print(helper.greet("a"), helper.shout("b"), helper.os.sep, h.anything, json.dumps(VERSION))
+"""
+        path = write_file(tmpdirname, "main.py", code)
+        assert local_import_errors(path, code, tmpdirname) == [
+            "Line 5: cannot import wave from helper, helper.py has no function, class or variable called wave.",
+            "Line 6: cannot import missing from package, __init__.py has no function, class or variable called missing.",
+            "Line 7: cannot import package.gone, there is no such file in the project.",
+            "Line 8: cannot import .sibling, there is no such file in the project.",
+            "Line 11: helper.shout does not exist, helper.py has no function, class or variable called shout.",
+        ]
+
+
+def test_analyze_files():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_file(tmpdirname, "helper.py", "def greet(name):\n    return 'hi ' + name\n")
+        write_file(tmpdirname, "main.py", "from helper import greet, wave\n\ndef main():\n    print(greet('a'))\n\nmain()\n")
+        context = {"project_dir": tmpdirname}
+        context = collect_files(context)
+        context = validate_files(context)
+        assert context["project_validated"] is True
+        context = analyze_files(context)
+        assert context["project_validated"] is False
+        main = [file_dict for file_dict in context["project_code"] if file_dict["relative_path"] == "main.py"][0]
+        assert main["validation_success"] is False
+        assert "cannot import wave from helper" in main["validation_error"]
+
+
+def test_analyze_files_main_guard_is_only_a_hint():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_file(tmpdirname, "main.py", "def main():\n    print(1)\n")
+        context = analyze_files(validate_files(collect_files({"project_dir": tmpdirname})))
+        assert context["project_validated"] is True
+        main = context["project_code"][0]
+        assert main["validation_success"] is True
+        assert "never calls it" in main["autofix_hints"][0]
+
+
+def test_main_guard_errors():
+    guarded = 'def main():\n    print(1)\n\n\nif __name__ == "__main__":\n    main()\n'
+    assert main_guard_errors(guarded, imported_by_tests=True) == []
+    assert main_guard_errors("def main():\n    print(1)\n\n\nmain()\n") == []
+    assert main_guard_errors("def main():\n    print(1)\n\n\nmain()\n", imported_by_tests=True) == [
+        'Line 5: main.py runs code when it is imported, and the tests import it. '
+        'Put the code that runs the program under if __name__ == "__main__": at the bottom of the file.'
+    ]
+    assert main_guard_errors("def main():\n    print(1)\n") == [
+        'main.py defines main() but never calls it. Call it under if __name__ == "__main__": at the bottom of the file.'
+    ]
@@ -0,0 +1,84 @@
+import os
+import tempfile
+
+from autocoder.helpers.autofix import autofix_project, fix_indentation, fixers, insert_import
+from autocoder.helpers.context import analyze_files, collect_files, run_main, validate_files
+from autocoder.helpers.stall import fingerprint
+
+
+def write_file(directory, name, content):
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def checked_context(directory):
+    context = {"project_dir": directory, "log_level": "quiet"}
+    for check in [collect_files, validate_files, analyze_files, run_main]:
+        context = check(context)
+    return context
+
+
+def test_insert_import():
+    code = '"""Docs."""\nimport sys\n\nprint(sys.argv)\n'
+    assert insert_import(code, "import os") == '"""Docs."""\nimport sys\nimport os\n\nprint(sys.argv)\n'
+    assert insert_import("#!/usr/bin/env python\nprint(1)\n", "import os") == "#!/usr/bin/env python\nimport os\nprint(1)\n"
+
+
+def test_autofix_stdlib_import_and_main_guard():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_file(tmpdirname, "main.py", "def main():\n    print(os.getcwd(), json.dumps(1))\n")
+        context = checked_context(tmpdirname)
+        assert context["project_validated"] is False
+
+        applied = autofix_project(context)
+        assert [fix["fixer"] for fix in applied] == ["stdlib_import", "stdlib_import", "main_guard"]
+        assert context["autofix_stats"]["by_fixer"] == {"stdlib_import": 2, "main_guard": 1}
+        # Only counted once the checks pass, see autofix_checks in steps/reason.py
+        assert context["autofix_stats"]["model_calls_saved"] == 0
+
+        context = checked_context(tmpdirname)
+        assert context["project_validated"] is True
+        assert context["main_success"] is True
+
+
+def test_autofix_local_import():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_file(tmpdirname, "utils/__init__.py", "")
+        write_file(tmpdirname, "utils/helper.py", "def greet():\n    return 'hi'\n")
+        write_file(
+            tmpdirname,
+            "main.py",
+            "import helper\n\n\ndef main():\n    print(helper.greet())\n\n\nif __name__ == \"__main__\":\n    main()\n",
+        )
+        context = checked_context(tmpdirname)
+        assert "No module named 'helper'" in context["main_error"]
+
+        assert [fix["fixer"] for fix in autofix_project(context)] == ["local_import"]
+        context = checked_context(tmpdirname)
+        assert context["main_success"] is True
+        assert context["main_output"].strip() == "hi"
+
+
+def test_fix_indentation():
+    code = "def main():\n    for i in range(3):\n    print(i)\n"
+    edit = {"path": "main.py", "start_line": 3, "line_count": 1, "indent": "    ", "fingerprint": fingerprint(code)}
+    context = {"last_edit": edit}
+    indentation = [current for current in fixers if current["name"] == "indentation"][0]
+    match = indentation["pattern"].search("IndentationError: expected an indented block")
+    fixed = fix_indentation(code, match, {"absolute_path": "main.py"}, context)
+    assert fixed == "def main():\n    for i in range(3):\n        print(i)\n"
+    assert fix_indentation(code, match, {"absolute_path": "other.py"}, context) is None
+
+
+def test_fix_indentation_ignores_older_edit():
+    indentation = [current for current in fixers if current["name"] == "indentation"][0]
+    match = indentation["pattern"].search("IndentationError: expected an indented block")
+    edited = "def main():\n    for i in range(3):\n        print(i)\n"
+    edit = {"path": "main.py", "start_line": 3, "line_count": 1, "indent": "    ", "fingerprint": fingerprint(edited)}
+
+    # A later action rewrote the file, and left an indentation error where the old edit was
+    code = "def main():\n    while True:\n    break\n"
+    assert fix_indentation(code, match, {"absolute_path": "main.py"}, {"last_edit": edit}) is None
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from autocoder.helpers.backends import get_backend, needs_openai_key
+from autocoder.helpers.llm import function_call
+
+functions = [
+    {
+        "name": "write_code",
+        "description": "Write the code",
+        "parameters": {"type": "object", "properties": {"code": {"type": "string"}}, "required": ["code"]},
+    }
+]
+
+arguments = json.dumps({"code": "print('hello')\n"})
+
+# Models the server answers with an error status
+statuses = {"missing": 404, "busy": 503}
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """An OpenAI compatible server, like llama.cpp's, that always calls write_code."""
+
+    protocol_version = "HTTP/1.1"
+    connections = []
+    requests = []
+
+    def setup(self):
+        super().setup()
+        CompletionHandler.connections.append(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        CompletionHandler.requests.append({"path": self.path, "body": body, "auth": self.headers.get("Authorization")})
+        if body["model"] == "slow":
+            time.sleep(1)
+        if body["model"] in statuses:
+            data = b'{"error": {"message": "no"}}'
+            self.send_response(statuses[body["model"]])
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        call = {"name": "write_code", "arguments": arguments}
+        if body["stream"]:
+            events = [{"choices": [{"delta": {"tool_calls": [{"index": 0, "function": {"name": "write_code"}}]}}]}]
+            for i in range(0, len(arguments), 5):
+                delta = {"tool_calls": [{"index": 0, "function": {"arguments": arguments[i : i + 5]}}]}
+                events.append({"choices": [{"delta": delta, "finish_reason": None}]})
+            events.append({"choices": [{"delta": {}, "finish_reason": "tool_calls"}]})
+            data = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        else:
+            message = {"role": "assistant", "content": None}
+            if "tools" in body:
+                message["tool_calls"] = [{"type": "function", "function": call}]
+            else:
+                message["function_call"] = call
+            data = json.dumps(
+                {
+                    "choices": [{"message": message, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 20, "completion_tokens": 10},
+                }
+            )
+        data = data.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if body["stream"] else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class CompletionServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before the response is written
+        pass
+
+
+def start_server():
+    CompletionHandler.connections = []
+    CompletionHandler.requests = []
+    server = CompletionServer(("127.0.0.1", 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_get_backend():
+    assert get_backend({}) is None
+    backend = get_backend({"llm_backend": "openai", "api_key": "sk-project", "llm_timeout": 30})
+    assert backend["api_key"] == "sk-project"
+    assert backend["timeout"] == (10, 30)
+    backend = get_backend({"llm_backend": "local", "api_key": "sk-project", "llm_api_base": "http://gpu:8000/v1/"})
+    assert backend["api_key"] is None
+    assert backend["api_base"] == "http://gpu:8000/v1"
+    assert needs_openai_key({}) is True
+    assert needs_openai_key({"llm_backend": "openai"}) is True
+    assert needs_openai_key({"llm_backend": "openai", "llm_api_base": "https://proxy.example/v1"}) is False
+    assert needs_openai_key({"llm_backend": "local"}) is False
+    try:
+        get_backend({"llm_backend": "other"})
+        assert False
+    except ValueError:
+        pass
+
+
+def test_local_backend():
+    server = start_server()
+    try:
+        context = {
+            "llm_backend": "local",
+            "llm_api_base": f"http://127.0.0.1:{server.server_port}/v1",
+            "llm_cache": False,
+            "log_level": "quiet",
+            "model": "local-model",
+        }
+        response = function_call(context, "Write hello", functions)
+        assert response["error"] is None
+        assert response["function_name"] == "write_code"
+        assert response["arguments"] == {"code": "print('hello')\n"}
+        request = CompletionHandler.requests[0]
+        assert request["path"] == "/v1/chat/completions"
+        assert request["body"]["tool_choice"] == {"type": "function", "function": {"name": "write_code"}}
+        assert request["auth"] is None
+
+        # Streamed, over the same connection
+        context["stream_responses"] = True
+        seen = []
+        response = function_call(
+            context, "Write hello", functions, on_field=lambda name, key, value, fields: seen.append(key)
+        )
+        assert response["arguments"] == {"code": "print('hello')\n"}
+        assert seen == ["code"]
+        assert len(CompletionHandler.connections) == 1
+        assert context["usage"]["requests"] == 2
+
+        # The OpenAI form of function calling, with the project's key
+        context.update({"llm_backend": "openai", "api_key": "sk-project", "stream_responses": False})
+        input_tokens = context["usage"]["input_tokens"]
+        response = function_call(context, "Write hello", functions)
+        assert response["arguments"] == {"code": "print('hello')\n"}
+        assert CompletionHandler.requests[-1]["body"]["function_call"] == {"name": "write_code"}
+        assert CompletionHandler.requests[-1]["auth"] == "Bearer sk-project"
+        assert context["usage"]["input_tokens"] == input_tokens + 20
+
+        context.update({"model": "slow", "llm_timeout": 0.2})
+        assert function_call(context, "Write hello", functions)["error"].startswith("Model Error")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_backend_retries():
+    server = start_server()
+    try:
+        context = {
+            "llm_backend": "local",
+            "llm_api_base": f"http://127.0.0.1:{server.server_port}/v1",
+            "llm_cache": False,
+            "log_level": "quiet",
+        }
+        for stream in [False, True]:
+            context["stream_responses"] = stream
+            CompletionHandler.requests = []
+            # Client errors are returned at once, server errors are sent again
+            assert "404" in function_call(context, "Write hello", functions, model="missing")["error"]
+            assert len(CompletionHandler.requests) == 1
+            assert "503" in function_call(context, "Write hello", functions, model="busy")["error"]
+            assert len(CompletionHandler.requests) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+
+from autocoder.helpers.budget import exceeded_budget, record_snapshot, restore_best_snapshot, start_epoch
+from autocoder.helpers.context import backup_project
+
+
+def write_file(directory, name, content):
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(content)
+
+
+def read_file(directory, name):
+    with open(os.path.join(directory, name), "r") as f:
+        return f.read()
+
+
+def test_exceeded_budget():
+    context = {"max_epochs": 2, "max_cost": 0.5}
+    assert start_epoch(context) is None
+    assert start_epoch(context) is None
+    assert start_epoch(context) == "max_epochs"
+    assert context["epoch"] == 2
+
+    context = {"max_epochs": 10, "max_tokens": 1000, "max_cost": 0.5}
+    context["usage"] = {"requests": 2, "input_tokens": 600, "output_tokens": 400, "cost": 0.1}
+    assert exceeded_budget(context) == "max_tokens"
+    context["max_tokens"] = None
+    assert exceeded_budget(context) is None
+    context["usage"]["cost"] = 0.5
+    assert exceeded_budget(context) == "max_cost"
+
+    context = {"max_seconds": 1, "started_at": time.time() - 2}
+    assert exceeded_budget(context) == "max_seconds"
+
+
+def test_restore_best_snapshot():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        context = {"project_dir": tmpdirname, "project_name": "budget_test", "epoch": 1}
+        assert restore_best_snapshot(context) is None
+
+        write_file(tmpdirname, "main.py", "print('good')\n")
+        context["errors"] = ["one error"]
+        record_snapshot(backup_project(context))
+
+        write_file(tmpdirname, "main.py", "print('worse')\n")
+        write_file(tmpdirname, "extra.py", "print('extra')\n")
+        context["epoch"] = 2
+        context["errors"] = ["one error", "two errors"]
+        record_snapshot(backup_project(context))
+        assert context["best_snapshot"]["epoch"] == 1
+
+        best = restore_best_snapshot(context)
+        assert best["errors"] == 1
+        assert read_file(tmpdirname, "main.py") == "print('good')\n"
+        assert not os.path.exists(os.path.join(tmpdirname, "extra.py"))
+
+
+def test_snapshot_progress():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        context = {"project_dir": tmpdirname, "project_name": "budget_test", "epoch": 1}
+
+        # Compiles, but a test and main.py fail
+        write_file(tmpdirname, "main.py", "print('compiles')\n")
+        context.update({"project_validated": True, "project_tested": False, "main_success": False})
+        context["errors"] = ["test failed", "main failed"]
+        record_snapshot(backup_project(context))
+
+        # A syntax error, so fail_fast cancelled the tests and main.py and only one error was counted
+        write_file(tmpdirname, "main.py", "print('broken'\n")
+        context.update({"epoch": 2, "project_validated": False, "project_tested": None, "main_success": None})
+        context["errors"] = ["syntax error"]
+        record_snapshot(backup_project(context))
+        assert context["best_snapshot"]["epoch"] == 1
+
+        best = restore_best_snapshot(context)
+        assert best["progress"] == 3
+        assert read_file(tmpdirname, "main.py") == "print('compiles')\n"
@@ -1,6 +1,7 @@
 import tempfile
 import os
 from autocoder.helpers.code import (
+    compile_code,
     contains_function_definition,
     file_exists,
     has_functions_called,
@@ -12,6 +13,10 @@ from autocoder.helpers.code import (
     save_code,
     run_code,
     run_code_tests,
+    run_pytest,
+    run_pytest_sharded,
+    group_test_report,
+    shard_tests,
 )
 
 
@@ -32,6 +37,41 @@ def test_is_runnable_failure():
     os.remove(tmp.name)
 
 
+def test_is_runnable_subprocess():
+    with tempfile.NamedTemporaryFile(suffix=".py", delete=False) as tmp:
+        tmp.write(b"print('Hello, world!')")
+    assert is_runnable(tmp.name, use_subprocess=True) == True
+    os.remove(tmp.name)
+
+
+def test_is_runnable_no_pycache():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "main.py")
+        with open(path, "w") as f:
+            f.write("print('Hello, world!')")
+        assert is_runnable(path) == True
+        assert not os.path.exists(os.path.join(tmpdirname, "__pycache__"))
+
+
+def test_compile_code_syntax_error():
+    result = compile_code("def hello():\n    print('Hello'\n")
+    assert result["success"] == False
+    assert result["line"] == 2
+    assert result["column"] is not None
+    assert "was never closed" in result["message"]
+    assert result["error"].startswith("SyntaxError: ")
+
+
+def test_compile_code_success():
+    assert compile_code("print('Hello, world!')") == {
+        "success": True,
+        "error": None,
+        "line": None,
+        "column": None,
+        "message": None,
+    }
+
+
 def test_contains_function_definition_true():
     code = """
 def hello():
@@ -161,10 +201,10 @@ def test_validate_file_success():
 def test_validate_file_failure():
     with tempfile.NamedTemporaryFile(suffix=".py", delete=False) as tmp:
         tmp.write(b"print('Hello, world!")
-    assert validate_file(tmp.name) == {
-        "success": False,
-        "error": "The file is not runnable, or didn't compile.",
-    }
+    result = validate_file(tmp.name)
+    assert result["success"] == False
+    assert result["error"].startswith("The file is not runnable, or didn't compile.")
+    assert "(line 1, column 7)" in result["error"]
     os.remove(tmp.name)
 
 
@@ -206,3 +246,83 @@ print(foo())
     to_test += expected_output
     actual_output = organize_imports(to_test)
     assert expected_output.strip() == actual_output.strip()
+
+
+def test_run_pytest_report():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        passing = os.path.join(tmpdirname, "passing_test.py")
+        failing = os.path.join(tmpdirname, "failing_test.py")
+        broken = os.path.join(tmpdirname, "broken_test.py")
+        empty = os.path.join(tmpdirname, "empty_test.py")
+        with open(passing, "w") as f:
+            f.write("def test_one():\n    assert True\n\ndef test_two():\n    assert True\n")
+        with open(failing, "w") as f:
+            f.write("def test_one():\n    assert True\n\ndef test_two():\n    assert 1 == 2\n")
+        with open(broken, "w") as f:
+            f.write("import not_a_real_module\n\ndef test_one():\n    assert True\n")
+        with open(empty, "w") as f:
+            f.write("x = 1\n")
+
+        paths = [passing, failing, broken, empty]
+        result = run_pytest(paths)
+        assert result["success"] == False
+        report = result["report"]
+        outcomes = {test["nodeid"].split("/")[-1]: test["outcome"] for test in report["tests"]}
+        assert outcomes == {
+            "passing_test.py::test_one": "passed",
+            "passing_test.py::test_two": "passed",
+            "failing_test.py::test_one": "passed",
+            "failing_test.py::test_two": "failed",
+        }
+        failed = [test for test in report["tests"] if test["outcome"] == "failed"][0]
+        assert failed["crash"]["line"] == 5
+        assert failed["crash"]["file"] == failing
+        assert failed["duration"] >= 0
+
+        grouped = group_test_report(report, paths)
+        assert [grouped[path]["success"] for path in paths] == [True, False, False, False]
+        assert "not_a_real_module" in grouped[broken]["error"]
+        assert "No tests were collected" in grouped[empty]["error"]
+        assert len(grouped[passing]["tests"]) == 2
+
+        # One file at a time gives the same verdicts
+        for path in paths:
+            assert run_code_tests(path)["success"] == grouped[path]["success"]
+
+
+def test_shard_tests_balances_durations():
+    nodeids = ["a", "b", "c", "d", "e"]
+    durations = {"a": 4.0, "b": 1.0, "c": 1.0, "d": 1.0, "e": 1.0}
+    shards = shard_tests(nodeids, 2, durations)
+    assert shards == [["a"], ["b", "c", "d", "e"]]
+    assert sorted(sum(shards, [])) == nodeids
+    assert shard_tests(nodeids, 10) == [["a"], ["b"], ["c"], ["d"], ["e"]]
+
+
+def test_run_pytest_sharded_matches_serial():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = []
+        for i in range(3):
+            path = os.path.join(tmpdirname, f"file{i}_test.py")
+            with open(path, "w") as f:
+                for j in range(3):
+                    f.write(f"def test_{j}():\n    assert {j} != {i}\n\n")
+            paths.append(path)
+        broken = os.path.join(tmpdirname, "broken_test.py")
+        with open(broken, "w") as f:
+            f.write("import not_a_real_module\n")
+        paths.append(broken)
+
+        serial = run_pytest(paths)
+        sharded = run_pytest_sharded(paths, 3)
+        assert sharded["success"] == serial["success"] == False
+
+        def outcomes(report):
+            return sorted((test["nodeid"], test["outcome"]) for test in report["tests"])
+
+        assert outcomes(sharded["report"]) == outcomes(serial["report"])
+        serial_grouped = group_test_report(serial["report"], paths)
+        sharded_grouped = group_test_report(sharded["report"], paths)
+        assert [serial_grouped[path]["success"] for path in paths] == [
+            sharded_grouped[path]["success"] for path in paths
+        ]
@@ -0,0 +1,91 @@
+import os
+import tempfile
+
+from autocoder.helpers.context import collect_files, run_main, run_tests
+from autocoder.helpers.fingerprint import (
+    clear_execution_cache,
+    environment_fingerprint,
+    execution_key,
+    source_closure,
+)
+
+
+def write(directory, name, content):
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_source_closure():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        main = write(tmpdirname, "main.py", "import os\nfrom utils import helper\n")
+        utils = write(tmpdirname, "utils.py", "from lib import strings\n")
+        strings = write(tmpdirname, "lib/strings.py", "from . import numbers\n")
+        numbers = write(tmpdirname, "lib/numbers.py", "x = 1\n")
+        write(tmpdirname, "unrelated.py", "y = 2\n")
+        assert source_closure(main, tmpdirname) == sorted(
+            os.path.abspath(path) for path in [main, utils, strings, numbers]
+        )
+
+
+def test_execution_key_follows_imports():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        main = write(tmpdirname, "main.py", "from utils import helper\n")
+        write(tmpdirname, "utils.py", "def helper():\n    return 1\n")
+        key = execution_key("run", main, tmpdirname)
+        assert execution_key("run", main, tmpdirname) == key
+
+        write(tmpdirname, "unrelated.py", "y = 2\n")
+        assert execution_key("run", main, tmpdirname) == key
+
+        write(tmpdirname, "utils.py", "def helper():\n    return 2\n")
+        assert execution_key("run", main, tmpdirname) != key
+        assert execution_key("pytest", main, tmpdirname) != execution_key("run", main, tmpdirname)
+
+
+def test_environment_fingerprint_is_stable():
+    assert environment_fingerprint() == environment_fingerprint()
+
+
+def test_run_main_reuses_cached_result():
+    clear_execution_cache()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        counter = os.path.join(tmpdirname, "runs.txt")
+        write(tmpdirname, "main.py", f"with open({counter!r}, 'a') as f:\n    f.write('x')\nprint('hello')\n")
+
+        context = collect_files({"project_dir": tmpdirname})
+        run_main(context)
+        run_main(context)
+        assert open(counter).read() == "x"
+        assert context["main_success"] is True
+        assert context["main_output"].strip() == "hello"
+
+        context["cache_execution"] = False
+        run_main(context)
+        assert open(counter).read() == "xx"
+
+
+def test_run_tests_reuses_unchanged_test_files():
+    clear_execution_cache()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        counter = os.path.join(tmpdirname, "runs.txt")
+        write(tmpdirname, "main.py", "def add(a, b):\n    return a + b\n")
+        write(
+            tmpdirname,
+            "main_test.py",
+            f"from main import add\n\ndef test_add():\n    open({counter!r}, 'a').write('x')\n    assert add(1, 2) == 3\n",
+        )
+
+        context = run_tests(collect_files({"project_dir": tmpdirname}))
+        assert context["project_tested"] is True
+        context = run_tests(collect_files(context))
+        assert context["project_tested"] is True
+        assert open(counter).read() == "x"
+
+        # Changing an imported file runs the test again
+        write(tmpdirname, "main.py", "def add(a, b):\n    return a - b\n")
+        context = run_tests(collect_files(context))
+        assert context["project_tested"] is False
+        assert open(counter).read() == "xx"
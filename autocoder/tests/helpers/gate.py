@@ -0,0 +1,105 @@
+import os
+import tempfile
+
+from autocoder.helpers.context import collect_errors, collect_files, run_main, run_tests
+from autocoder.helpers.gate import completion_gate, coverage_points
+
+main_code = '''import sys
+
+
+def sign(number):
+    """Returns the sign of a number as a word."""
+    if number < 0:
+        return "negative"
+    return "positive"
+
+
+def total(numbers):
+    result = 0
+    for number in numbers:
+        result += number
+    return result
+
+
+def main():
+    print(sign(total([int(arg) for arg in sys.argv[1:]])))
+
+
+if __name__ == "__main__":
+    main()
+'''
+
+full_tests = """from main import sign, total
+
+
+def test_sign():
+    assert sign(-1) == "negative"
+    assert sign(1) == "positive"
+
+
+def test_total():
+    assert total([1, 2]) == 3
+    assert total([]) == 0
+"""
+
+partial_tests = """from main import sign, total
+
+
+def test_sign():
+    assert sign(1) == "positive"
+
+
+def test_total():
+    assert total([1, 2]) == 3
+"""
+
+
+def write_project(directory, tests):
+    with open(os.path.join(directory, "main.py"), "w") as f:
+        f.write(main_code)
+    with open(os.path.join(directory, "numbers_test.py"), "w") as f:
+        f.write(tests)
+
+
+def checked_context(directory, mode):
+    context = {"project_dir": directory, "completion_gate": mode, "cache_execution": False}
+    for check in [collect_files, run_tests, run_main, collect_errors]:
+        context = check(context)
+    return context
+
+
+def test_coverage_points():
+    lines, branches = coverage_points(main_code, skip_main=True)
+    assert lines == {6, 7, 8, 12, 13, 14, 15}
+    assert branches == {6: 7, 13: 14}
+    lines, branches = coverage_points(main_code)
+    assert 19 in lines
+
+
+def test_completion_gate():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_project(tmpdirname, full_tests)
+        context = checked_context(tmpdirname, "complete")
+        assert context["errors"] == []
+        assert context["project_coverage"]["line_rate"] == 1.0
+        assert context["project_coverage"]["branch_rate"] == 1.0
+        assert completion_gate(context) == "complete"
+        context["completion_gate"] = "cheap_model"
+        assert completion_gate(context) == "cheap_model"
+
+        write_project(tmpdirname, partial_tests)
+        context = checked_context(tmpdirname, "complete")
+        coverage = context["project_coverage"]
+        assert coverage["files"]["main.py"]["missing_lines"] == [7]
+        assert coverage["branches_covered"] == 3
+        assert completion_gate(context) is None
+        context["gate_line_coverage"] = 0.8
+        context["gate_branch_coverage"] = 0.5
+        assert completion_gate(context) == "complete"
+
+        context["project_coverage"] = dict(coverage, lines=0, lines_covered=0, line_rate=1.0)
+        assert completion_gate(context) is None
+
+        context = checked_context(tmpdirname, None)
+        assert context["project_coverage"] is None
+        assert completion_gate(context) is None
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from autocoder.helpers.hedging import hedge_delay, hedged_call, latencies, record_latency
+
+
+def warm_up(model, seconds=0.05):
+    latencies.pop(model, None)
+    for _ in range(10):
+        record_latency(model, seconds)
+
+
+def test_hedge_delay():
+    latencies.pop("delay-model", None)
+    for seconds in range(1, 11):
+        record_latency("delay-model", seconds / 10)
+    assert hedge_delay("delay-model", 90) == 0.9
+    assert hedge_delay("delay-model", 50) == 0.5
+    assert hedge_delay("delay-model", 100) == 1.0
+    assert hedge_delay("delay-model", 90, min_samples=20) is None
+    assert hedge_delay("unknown-model") is None
+
+
+def test_hedged_call():
+    warm_up("hedge-model")
+    context = {"hedge_requests": True}
+    cancelled = threading.Event()
+
+    def send(cancel, hedge):
+        if hedge:
+            return {"text": "duplicate", "error": None}
+        # A stuck stream, until it is cancelled
+        if cancel.wait(5):
+            cancelled.set()
+            return {"error": "Cancelled"}
+        return {"text": "first", "error": None}
+
+    start = time.monotonic()
+    response, hedge_won = hedged_call(context, "hedge-model", send)
+    assert response["text"] == "duplicate" and hedge_won
+    assert time.monotonic() - start < 2
+    assert cancelled.wait(2)
+    assert context["hedge_stats"] == {
+        "requests": 1,
+        "hedged": 1,
+        "hedge_wins": 1,
+        "cancelled": 1,
+        "abandoned": 0,
+        "extra_cost": 0.0,
+    }
+
+    # Fast enough, so no duplicate is sent
+    response, hedge_won = hedged_call(context, "hedge-model", lambda cancel, hedge: {"text": "first", "error": None})
+    assert response["text"] == "first" and not hedge_won
+    assert context["hedge_stats"]["requests"] == 2
+    assert context["hedge_stats"]["hedged"] == 1
+
+    # A loser that can't be stopped still has its response counted
+    warm_up("hedge-model")
+    losers = []
+    finished = threading.Event()
+
+    def slow_first(cancel, hedge):
+        if hedge:
+            return {"text": "duplicate", "error": None}
+        time.sleep(0.3)
+        return {"text": "first", "error": None}
+
+    def on_loser(response):
+        losers.append(response)
+        finished.set()
+
+    response, hedge_won = hedged_call(context, "hedge-model", slow_first, on_loser, cancellable=False)
+    assert hedge_won
+    assert finished.wait(2)
+    assert losers == [{"text": "first", "error": None}]
+    assert context["hedge_stats"]["cancelled"] == 1
+    assert context["hedge_stats"]["abandoned"] == 1
+
+    # Off by default
+    response, hedge_won = hedged_call({}, "hedge-model", slow_first)
+    assert response["text"] == "first" and not hedge_won
+
+
+def test_hedged_call_cancel():
+    warm_up("cancel-model")
+    cancel = threading.Event()
+    stopped = []
+
+    def stuck(request_cancel, hedge):
+        # Both requests hang until they are cancelled
+        request_cancel.wait(5)
+        stopped.append(hedge)
+        return {"error": "Cancelled"}
+
+    threading.Timer(0.2, cancel.set).start()
+    start = time.monotonic()
+    response, _ = hedged_call({"hedge_requests": True}, "cancel-model", stuck, cancel=cancel)
+    assert response["error"] == "Cancelled"
+    assert time.monotonic() - start < 2
+    assert sorted(stopped) == [False, True]
@@ -0,0 +1,119 @@
+import os
+import tempfile
+
+from autocoder.helpers.context import collect_files, run_tests
+from autocoder.helpers.fingerprint import clear_execution_cache
+from autocoder.helpers.impact import diff_lines, plan_test_run, remap_coverage
+
+old_code = """import os
+
+
+def add(a, b):
+    return a + b
+
+
+def subtract(a, b):
+    return a - b
+"""
+
+
+def test_diff_lines_inside_function():
+    new_code = old_code.replace("return a - b", "return b - a")
+    changed, module_level, mapping = diff_lines(old_code, new_code)
+    assert changed == {9}
+    assert module_level is False
+    assert mapping[5] == 5
+
+
+def test_diff_lines_module_level():
+    new_code = "import sys\n" + old_code
+    changed, module_level, mapping = diff_lines(old_code, new_code)
+    assert module_level is True
+    assert mapping[5] == 6
+
+
+def test_remap_coverage():
+    new_code = old_code.replace("import os\n", "import os\nimport sys\n")
+    coverage = {"test_add": {"/main.py": [5]}, "test_subtract": {"/main.py": [9]}}
+    remapped = remap_coverage(coverage, {"/main.py": old_code}, {"/main.py": new_code})
+    assert remapped == {"test_add": {"/main.py": [6]}, "test_subtract": {"/main.py": [10]}}
+
+
+def test_plan_test_run_picks_covering_tests():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        main = os.path.realpath(os.path.join(tmpdirname, "main.py"))
+        test = os.path.realpath(os.path.join(tmpdirname, "main_test.py"))
+        test_code = "from main import add, subtract\n"
+        for path, code in [(main, old_code), (test, test_code)]:
+            with open(path, "w") as f:
+                f.write(code)
+        tests = [
+            {"nodeid": "main_test.py::test_add", "file": test},
+            {"nodeid": "main_test.py::test_subtract", "file": test},
+        ]
+        coverage = {
+            "main_test.py::test_add": {main: [5]},
+            "main_test.py::test_subtract": {main: [9]},
+        }
+        new_code = old_code.replace("return a - b", "return b - a")
+        plan = plan_test_run(
+            [test], tests, coverage, {main: old_code, test: test_code}, {main: new_code, test: test_code}, tmpdirname
+        )
+        assert plan == {
+            "full_files": [],
+            "nodeids": ["main_test.py::test_subtract"],
+            "unchanged": ["main_test.py::test_add"],
+        }
+
+        # A change outside a function runs the whole file
+        plan = plan_test_run(
+            [test], tests, coverage, {main: old_code, test: test_code}, {main: "X = 1\n" + old_code, test: test_code}, tmpdirname
+        )
+        assert plan["full_files"] == [test]
+
+
+def test_run_tests_runs_affected_tests_first():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        check_affected_tests_run_first(tmpdirname)
+
+
+def test_run_tests_impact_under_symlinked_project_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        os.makedirs(os.path.join(tmpdirname, "real"))
+        os.symlink(os.path.join(tmpdirname, "real"), os.path.join(tmpdirname, "link"))
+        check_affected_tests_run_first(os.path.join(tmpdirname, "link"))
+
+
+def check_affected_tests_run_first(tmpdirname):
+    clear_execution_cache()
+    log_path = os.path.join(tmpdirname, "runs.txt")
+    with open(os.path.join(tmpdirname, "main.py"), "w") as f:
+        f.write(old_code)
+    with open(os.path.join(tmpdirname, "main_test.py"), "w") as f:
+        f.write(
+            "from main import add, subtract\n\n"
+            f"def test_add():\n    open({log_path!r}, 'a').write('add ')\n    assert add(1, 2) == 3\n\n"
+            f"def test_subtract():\n    open({log_path!r}, 'a').write('subtract ')\n    assert subtract(3, 2) == 1\n"
+        )
+
+    context = run_tests(collect_files({"project_dir": tmpdirname, "test_impact": True, "cache_execution": False}))
+    assert context["project_tested"] is True
+    assert len(context["test_coverage"]) == 2
+
+    # Break subtract, only its test runs and add keeps its last result
+    with open(os.path.join(tmpdirname, "main.py"), "w") as f:
+        f.write(old_code.replace("return a - b", "return b - a"))
+    os.remove(log_path)
+    context = run_tests(collect_files(context))
+    assert context["project_tested"] is False
+    assert open(log_path).read() == "subtract "
+    outcomes = {test["name"]: test["outcome"] for test in context["test_report"]["tests"]}
+    assert outcomes == {"test_subtract": "failed", "test_add": "passed"}
+
+    # Fix it, the affected test passes so the rest run before the project counts as tested
+    with open(os.path.join(tmpdirname, "main.py"), "w") as f:
+        f.write(old_code)
+    os.remove(log_path)
+    context = run_tests(collect_files(context))
+    assert context["project_tested"] is True
+    assert sorted(open(log_path).read().split()) == ["add", "subtract"]
@@ -0,0 +1,50 @@
+import sys
+import tempfile
+
+from autocoder.helpers.installs import installs, partial_imports, start_installs, wait_for_installs
+
+# Stands in for pip: "slow" packages take a long time to install, and "broken" ones fail
+install_command = [
+    sys.executable,
+    "-c",
+    "import sys, time; name = sys.argv[1]; time.sleep(30 if name.startswith('slow') else 0.1); "
+    "sys.exit(name.startswith('broken'))",
+]
+
+
+def test_partial_imports():
+    code = "import os\nimport numpy as np\nfrom flask import Flask\n    import inner\nimport requ"
+    assert partial_imports(code, ".") == {"numpy", "flask"}
+
+
+def test_wait_for_installs():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        context = {
+            "project_dir": tmpdirname,
+            "log_level": "quiet",
+            "speculative_installs": True,
+            "install_command": install_command,
+        }
+        # Guessed from streamed code that was then changed
+        start_installs(context, {"slowguesspkg", "fastpkg"})
+        assert "slowguesspkg" in installs
+        slow = installs["slowguesspkg"]["process"]
+
+        context["project_code"] = [
+            {"content": "import fastpkg\nimport brokenpkg\nimport os\n", "absolute_path": f"{tmpdirname}/main.py"}
+        ]
+        context = wait_for_installs(context)
+        stats = context["install_stats"]
+        assert stats["started"] == 3
+        assert stats["installed"] == 1
+        assert stats["failed"] == 1
+        assert stats["cancelled"] == 1
+        # The wrong guess was stopped and reaped instead of waited for
+        assert slow.returncode is not None
+        assert stats["wait_seconds"] < 10
+        assert len(installs) == 0
+
+        context["speculative_installs"] = False
+        context["project_code"] = [{"content": "import slowpkg\n", "absolute_path": f"{tmpdirname}/main.py"}]
+        context = wait_for_installs(context)
+        assert len(installs) == 0
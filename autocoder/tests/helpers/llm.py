@@ -0,0 +1,18 @@
+from autocoder.helpers.llm import get_price, record_usage
+
+
+def test_get_price():
+    assert get_price("gpt-3.5-turbo-0613") == (0.0015, 0.002)
+    assert get_price("gpt-3.5-turbo-16k-0613") == (0.003, 0.004)
+    assert get_price("gpt-4-0613") == (0.03, 0.06)
+    assert get_price("local-model") == (0.0, 0.0)
+
+
+def test_record_usage():
+    context = {}
+    record_usage(context, "gpt-4-0613", {"usage": {"prompt_tokens": 1000, "completion_tokens": 500}})
+    record_usage(context, "gpt-4-0613", {"error": "No function call in response"})
+    assert context["usage"]["requests"] == 2
+    assert context["usage"]["input_tokens"] == 1000
+    assert context["usage"]["output_tokens"] == 500
+    assert abs(context["usage"]["cost"] - 0.06) < 1e-9
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+from autocoder.helpers.code import save_code, save_files, validate_sources
+from autocoder.helpers.parallel import get_worker_count, parallel_map
+from autocoder.helpers.validation import clear_validation_cache, count_lines
+
+codes = [
+    "import os\n\ndef hello():\n    print('Hello, world!')\n\nhello()\n",
+    "print('Hello, world!",
+    "x = 1\n",
+    "def hello():\n    # TODO\n    pass\n",
+    "def goodbye():\n    print('Goodbye, world!')\n\ngoodbye()\n",
+]
+
+
+def test_get_worker_count():
+    assert get_worker_count({}) == 1
+    assert get_worker_count({"workers": 3}) == 3
+    assert get_worker_count({"workers": "auto"}) >= 1
+    assert get_worker_count({"workers": "nonsense"}) == 1
+
+
+def test_parallel_map_matches_serial():
+    serial = parallel_map(count_lines, codes)
+    parallel = parallel_map(count_lines, codes, workers=2, threshold=1)
+    assert serial == parallel
+
+
+def test_validate_sources_matches_serial():
+    clear_validation_cache()
+    serial = validate_sources(codes)
+    clear_validation_cache()
+    parallel = validate_sources(codes, workers=2, threshold=1)
+    assert serial == parallel
+    assert [result["success"] for result in parallel] == [True, False, False, False, True]
+
+
+def test_save_files_matches_save_code():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        files = [(code, os.path.join(tmpdirname, f"file{i}.py")) for i, code in enumerate(codes)]
+        save_files(files)
+        saved = [open(filename).read() for _, filename in files]
+        for code, filename in files:
+            save_code(code, filename)
+        expected = [open(filename).read() for _, filename in files]
+    assert saved == expected
+    assert saved[1] == codes[1]
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import time
+
+from autocoder.helpers.code import run_code, run_pytest
+from autocoder.helpers.pipeline import run_stages, stage
+from autocoder.helpers.server import start_server, stop_server
+
+sleeping_test = b"""
+import time
+
+def test_slow():
+    time.sleep(30)
+"""
+
+
+def write_file(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def record(name, seconds=0.0):
+    def run(context):
+        context["started"].append(name)
+        time.sleep(seconds)
+        context["finished"].append(name)
+        return context
+
+    return run
+
+
+def test_run_stages_in_parallel():
+    context = {"started": [], "finished": []}
+    stages = [
+        stage("first", record("first")),
+        stage("slow_a", record("slow_a", 0.5), after=["first"]),
+        stage("slow_b", record("slow_b", 0.5), after=["first"]),
+        stage("last", record("last"), after=["slow_a", "slow_b"]),
+    ]
+    start = time.monotonic()
+    run_stages(context, stages)
+    assert time.monotonic() - start < 0.9
+    assert context["started"][0] == "first"
+    assert context["finished"][-1] == "last"
+    assert set(context["stage_durations"]) == {"first", "slow_a", "slow_b", "last"}
+    assert context["cancelled_stages"] == []
+
+
+def test_run_stages_serial():
+    context = {"started": [], "finished": []}
+    stages = [stage("a", record("a", 0.2)), stage("b", record("b", 0.2)), stage("c", record("c"), after=["a"])]
+    start = time.monotonic()
+    run_stages(context, stages, parallel=False)
+    assert time.monotonic() - start >= 0.4
+    assert context["finished"] == ["a", "b", "c"]
+
+
+def test_run_stages_cheapest_first():
+    context = {"started": [], "finished": [], "stage_durations": {"slow": 5.0, "fast": 0.1}}
+    stages = [stage("slow", record("slow")), stage("fast", record("fast"))]
+    run_stages(context, stages)
+    assert context["started"][0] == "fast"
+
+
+def test_fail_fast_cancels_sandboxed_run():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        main = write_file(tmpdirname, "main.py", b"while True:\n    pass\n")
+        test = write_file(tmpdirname, "sleeping_test.py", sleeping_test)
+
+        def fail(context):
+            time.sleep(0.5)
+            context["failed"] = True
+            return context
+
+        def cancelled(name):
+            def on_cancel(context):
+                context["cleared"].append(name)
+                return context
+
+            return on_cancel
+
+        context = {"cleared": []}
+        stages = [
+            stage("check", fail, decides=lambda context: context["failed"]),
+            stage(
+                "main",
+                lambda context: run_code(main, {"timeout": 30}),
+                cancellable=True,
+                on_cancel=cancelled("main"),
+            ),
+            stage(
+                "tests",
+                lambda context: run_pytest([test], server=server, limits={"timeout": 30, "test_timeout": None}),
+                cancellable=True,
+                on_cancel=cancelled("tests"),
+            ),
+            stage("after", lambda context: context, after=["main", "tests"], cancellable=True),
+        ]
+        start = time.monotonic()
+        run_stages(context, stages)
+        assert time.monotonic() - start < 10
+        assert sorted(context["cancelled_stages"]) == ["after", "main", "tests"]
+        assert sorted(context["cleared"]) == ["main", "tests"]
+    stop_server(server)
+
+
+def test_fail_fast_skips_stages_that_have_not_started():
+    context = {"started": [], "finished": [], "failed": True}
+    stages = [
+        stage("check", record("check"), decides=lambda context: context["failed"]),
+        stage("slow", record("slow"), after=["check"], cancellable=True),
+        stage("report", record("report"), after=["slow"]),
+    ]
+    run_stages(context, stages)
+    assert context["cancelled_stages"] == ["slow"]
+    assert context["finished"] == ["check", "report"]
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import threading
+import time
+
+from autocoder.helpers.response_cache import (
+    cached_request,
+    get_cached_response,
+    request_key,
+    set_cached_response,
+)
+
+
+def test_request_key():
+    functions = [{"name": "write_code"}]
+    key = request_key("gpt-4", "Write the code", functions, 0.0)
+    assert key == request_key("gpt-4", "Write the code", functions, 0.0)
+    assert key != request_key("gpt-3.5-turbo", "Write the code", functions, 0.0)
+    assert key != request_key("gpt-4", "Write the code", functions, 0.7)
+    assert key != request_key("gpt-4", "Write the code", [{"name": "edit_code"}], 0.0)
+
+
+def test_cached_request():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "responses.sqlite")
+        calls = []
+
+        def send():
+            calls.append(1)
+            return {"text": "done", "error": None}
+
+        assert cached_request("a", "gpt-4", send, path) == ({"text": "done", "error": None}, True)
+        assert cached_request("a", "gpt-4", send, path) == ({"text": "done", "error": None}, False)
+        assert len(calls) == 1
+
+        # Failed requests are not stored
+        response, sent = cached_request("b", "gpt-4", lambda: {"error": "rate limited"}, path)
+        assert sent and get_cached_response(path, "b") is None
+
+
+def test_cached_request_without_cache():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "responses.sqlite")
+        with open(path, "w") as f:
+            f.write("not a database" * 100)
+        response, sent = cached_request("a", "gpt-4", lambda: {"text": "done", "error": None}, path)
+        assert response == {"text": "done", "error": None}
+        assert sent is True
+
+
+def test_cache_eviction():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "responses.sqlite")
+        set_cached_response(path, "old", "gpt-4", {"text": "old"})
+        time.sleep(0.05)
+        assert get_cached_response(path, "old", max_age=0.01) is None
+        assert get_cached_response(path, "old") is None
+
+        response = {"text": "x" * 100}
+        set_cached_response(path, "first", "gpt-4", response)
+        set_cached_response(path, "second", "gpt-4", response)
+        # Reading first makes second the least recently used
+        time.sleep(0.01)
+        assert get_cached_response(path, "first") == response
+        set_cached_response(path, "third", "gpt-4", response, max_size=250)
+        assert get_cached_response(path, "second") is None
+        assert get_cached_response(path, "first") == response
+        assert get_cached_response(path, "third") == response
+
+
+def test_coalesced_requests():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "responses.sqlite")
+        calls = []
+        started = threading.Event()
+
+        def send():
+            calls.append(1)
+            started.set()
+            time.sleep(0.3)
+            return {"text": "done", "error": None}
+
+        results = []
+
+        def request():
+            results.append(cached_request("a", "gpt-4", send, path))
+
+        first = threading.Thread(target=request)
+        first.start()
+        started.wait()
+        others = [threading.Thread(target=request) for _ in range(3)]
+        for thread in others:
+            thread.start()
+        for thread in [first] + others:
+            thread.join()
+        assert len(calls) == 1
+        assert sorted(sent for _, sent in results) == [False, False, False, True]
+        assert all(response["text"] == "done" for response, _ in results)
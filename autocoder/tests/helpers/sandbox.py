@@ -0,0 +1,126 @@
+import os
+import tempfile
+import time
+
+from autocoder.helpers.code import run_code, run_code_tests, run_pytest
+from autocoder.helpers.sandbox import get_sandbox_limits, run_sandboxed
+from autocoder.helpers.server import start_server, stop_server
+
+sleeping_test = b"""
+import time
+
+def test_slow():
+    time.sleep(30)
+
+def test_fast():
+    assert True
+"""
+
+
+def write_file(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_get_sandbox_limits():
+    limits = get_sandbox_limits({"timeout": 5, "test_timeout": None})
+    assert limits["timeout"] == 5
+    assert limits["test_timeout"] == 30
+
+
+def test_run_code_timeout():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = write_file(tmpdirname, "main.py", b"print('started', flush=True)\nwhile True:\n    pass\n")
+        start = time.monotonic()
+        result = run_code(path, {"timeout": 1})
+        assert time.monotonic() - start < 10
+        assert result["success"] is False
+        assert result["timed_out"] is True
+        assert result["error"].startswith("TimeoutError: main.py did not finish within 1 seconds")
+        assert "started" in result["output"]
+
+
+def test_run_code_cpu_limit():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = write_file(tmpdirname, "main.py", b"while True:\n    pass\n")
+        result = run_code(path, {"timeout": 30, "cpu_limit": 1})
+        assert result["timed_out"] is True
+        assert result["error"].startswith("TimeoutError: main.py did not finish within 1 seconds")
+
+
+def test_run_sandboxed_kills_process_group():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        marker = os.path.join(tmpdirname, "marker")
+        # The background child would write the marker after the parent has exited
+        child = write_file(
+            tmpdirname, "child.py", f"import time\ntime.sleep(1)\nopen({marker!r}, 'w').close()\n".encode()
+        )
+        script = write_file(
+            tmpdirname,
+            "main.py",
+            f"import subprocess, sys\nsubprocess.Popen([sys.executable, {child!r}])\n".encode(),
+        )
+        result = run_sandboxed(["python", script], {"timeout": 10})
+        assert result["returncode"] == 0
+        time.sleep(2)
+        assert not os.path.exists(marker)
+
+
+def test_run_sandboxed_bounded_output():
+    result = run_sandboxed(
+        ["python", "-c", "print('start' + 'x' * 100000 + 'end')"], {"max_output": 1000}
+    )
+    assert result["truncated"] is True
+    assert result["stdout"].startswith("start")
+    assert result["stdout"].rstrip().endswith("end")
+    assert "bytes of output omitted" in result["stdout"]
+    assert len(result["stdout"]) < 1200
+
+
+def test_run_sandboxed_memory_limit():
+    result = run_sandboxed(
+        ["python", "-c", "data = bytearray(512 * 1024 * 1024)"], {"memory_limit": 256}
+    )
+    assert result["returncode"] != 0
+    assert "MemoryError" in result["stderr"]
+
+
+def test_run_sandboxed_file_limit():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        result = run_sandboxed(
+            ["python", "-c", "open('big.txt', 'wb').write(b'x' * 2 * 1024 * 1024)"],
+            {"file_limit": 1},
+            cwd=tmpdirname,
+        )
+        assert result["returncode"] != 0
+        assert "File too large" in result["stderr"]
+        assert os.path.getsize(os.path.join(tmpdirname, "big.txt")) <= 1024 * 1024
+
+
+def test_per_test_timeout_cold_and_warm():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = write_file(tmpdirname, "sleeping_test.py", sleeping_test)
+        for runner in [None, server]:
+            result = run_pytest([path], server=runner, limits={"test_timeout": 1})
+            tests = {test["name"]: test for test in result["report"]["tests"]}
+            assert tests["test_slow"]["outcome"] == "failed"
+            assert "TimeoutError" in tests["test_slow"]["message"]
+            assert tests["test_fast"]["outcome"] == "passed"
+            assert result["timed_out"] is False
+    stop_server(server)
+
+
+def test_test_run_timeout_warm():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = write_file(tmpdirname, "sleeping_test.py", sleeping_test)
+        start = time.monotonic()
+        result = run_code_tests(path, server=server, limits={"timeout": 1, "test_timeout": None})
+        assert time.monotonic() - start < 10
+        assert result["success"] is False
+        assert result["timed_out"] is True
+        assert result["error"].startswith("TimeoutError: The test run did not finish")
+    stop_server(server)
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import threading
+import time
+
+from autocoder.helpers.code import run_code, run_code_tests
+from autocoder.helpers.server import (
+    get_server,
+    is_alive,
+    server_request,
+    start_server,
+    stop_server,
+    stop_servers,
+)
+
+passing_test = b"""
+def test_hello():
+    assert 'Hello, world!' == 'Hello, world!'
+"""
+
+failing_test = b"""
+import sys
+sys.modules["leaked_from_test"] = True
+
+def test_hello():
+    assert 'Hello, world!' == 'Goodbye, world!'
+"""
+
+isolated_test = b"""
+import sys
+
+def test_isolated():
+    assert "leaked_from_test" not in sys.modules
+"""
+
+main_script = b"""
+import sys
+from helper import greeting
+
+if __name__ == "__main__":
+    print(greeting(), sys.argv[0].endswith("main.py"))
+"""
+
+failing_script = b"""
+def fail():
+    raise ValueError("bad value")
+
+fail()
+"""
+
+
+def write_test(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_run_code_tests_warm_matches_cold():
+    server = start_server(preload=["json"])
+    assert is_alive(server)
+    assert "pytest" in server["preloaded"]
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        passing = write_test(tmpdirname, "passing_test.py", passing_test)
+        failing = write_test(tmpdirname, "failing_test.py", failing_test)
+        for path in [passing, failing]:
+            warm = run_code_tests(path, server=server)
+            cold = run_code_tests(path)
+            assert warm["success"] == cold["success"]
+            assert ("1 passed" in warm["output"]) == ("1 passed" in cold["output"])
+            assert ("1 failed" in warm["output"]) == ("1 failed" in cold["output"])
+    stop_server(server)
+    assert not is_alive(server)
+
+
+def test_server_runs_are_isolated():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        failing = write_test(tmpdirname, "failing_test.py", failing_test)
+        isolated = write_test(tmpdirname, "isolated_test.py", isolated_test)
+        assert run_code_tests(failing, server=server)["success"] is False
+        assert run_code_tests(isolated, server=server)["success"] is True
+    stop_server(server)
+
+
+def test_server_concurrent_requests():
+    server = start_server()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        passing = write_test(tmpdirname, "passing_test.py", passing_test)
+
+        def run(i):
+            results[i] = server_request(server, {"kind": "pytest", "args": [passing], "cwd": os.getcwd()})
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert sorted(results) == [0, 1, 2, 3]
+    assert all(result["returncode"] == 0 for result in results.values())
+    stop_server(server)
+
+
+def test_get_server_reuses_running_server():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = get_server(tmpdirname)
+        assert get_server(tmpdirname) is server
+        stop_server(server)
+        assert get_server(tmpdirname) is not server
+    stop_servers()
+
+
+def test_run_code_tests_falls_back_when_server_is_gone():
+    server = start_server()
+    stop_server(server)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        passing = write_test(tmpdirname, "passing_test.py", passing_test)
+        assert run_code_tests(passing, server=server)["success"] is True
+
+
+def test_run_code_warm_matches_cold():
+    server = start_server(preload=["json"])
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_test(tmpdirname, "helper.py", b"def greeting():\n    return 'hello'\n")
+        main = write_test(tmpdirname, "main.py", main_script)
+        failing = write_test(tmpdirname, "failing.py", failing_script)
+
+        warm = run_code(main, server=server)
+        cold = run_code(main)
+        assert warm["success"] is True
+        assert warm["output"] == cold["output"] == "hello True\n"
+
+        warm = run_code(failing, server=server)
+        cold = run_code(failing)
+        assert warm["success"] is cold["success"] is False
+        assert warm["error"].splitlines()[-1] == cold["error"].splitlines()[-1] == "ValueError: bad value"
+        assert "runner.py" not in warm["error"]
+    stop_server(server)
+
+
+def test_get_server_restarts_for_new_dependencies():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = get_server(tmpdirname, preload=["json"])
+        assert get_server(tmpdirname, preload=["json"]) is server
+        restarted = get_server(tmpdirname, preload=["json", "csv"])
+        assert restarted is not server
+        assert not is_alive(server)
+        assert "csv" in restarted["preloaded"]
+    stop_servers()
+
+
+def is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Killed children may linger as zombies until they are reaped
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_stop_server_kills_running_children():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        pid_path = os.path.join(tmpdirname, "pid")
+        script = f"import os, time\nopen({pid_path!r}, 'w').write(str(os.getpid()))\ntime.sleep(60)\n"
+        path = write_test(tmpdirname, "sleeping.py", script.encode("utf-8"))
+        threading.Thread(
+            target=server_request, args=(server, {"kind": "script", "path": path, "cwd": tmpdirname}), daemon=True
+        ).start()
+        while not os.path.exists(pid_path) or os.path.getsize(pid_path) == 0:
+            time.sleep(0.05)
+        with open(pid_path) as f:
+            pid = int(f.read())
+        assert is_running(pid)
+        stop_server(server, timeout=0.5)
+        time.sleep(0.5)
+        assert not is_running(pid)
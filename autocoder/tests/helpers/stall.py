@@ -0,0 +1,52 @@
+from autocoder.helpers.stall import detect_stall, error_fingerprint, is_stalled, record_action
+from autocoder.steps.act import compose_action_request
+
+name_error = 'main.py: File "main.py", line 4, in <module>\nNameError: name \'x\' is not defined'
+type_error = "main.py: TypeError: unsupported operand type(s) for +: 'int' and 'str'"
+edit = {"reasoning": "Define x", "filepath": "main.py", "start_line": 3, "end_line": 3, "code": "x = 1"}
+
+
+def run_epochs(context, epochs):
+    strategies = []
+    for errors in epochs:
+        context["errors"] = errors
+        strategies.append(detect_stall(context))
+        if len(errors) > 0:
+            record_action(context, "replace_code", dict(edit, reasoning=f"Attempt {len(strategies)}"))
+    return strategies
+
+
+def test_error_fingerprint():
+    assert error_fingerprint([]) is None
+    moved = name_error.replace("line 4", "line 9")
+    assert error_fingerprint([name_error, type_error]) == error_fingerprint([type_error, moved])
+    assert error_fingerprint([name_error]) != error_fingerprint([type_error])
+
+
+def test_detect_stall_history():
+    context = {"log_level": "quiet"}
+    strategies = run_epochs(context, [[name_error], [type_error], [name_error], [name_error], []])
+    assert strategies == [None, None, None, "history", None]
+    assert context["stall_stats"] == {"stalls": 1, "longest": 2, "repeated_actions": 2, "strategies": {"history": 1}}
+    assert context["attempt_history"] is None
+
+    run_epochs(context, [[name_error]])
+    assert "- Epoch 1: replace_code on main.py, lines 3 to 3" in context["attempt_history"]
+    assert "- Epoch 4: replace_code on main.py, lines 3 to 3" in context["attempt_history"]
+
+
+def test_detect_stall_escalate_and_rewrite():
+    context = {"log_level": "quiet", "model": "small", "escalation_model": "large", "stall_strategy": "escalate"}
+    assert run_epochs(context, [[name_error], [name_error], [name_error]]) == [None, None, "escalate"]
+    assert context["model"] == "large"
+    assert is_stalled(context) is True
+    run_epochs(context, [[type_error]])
+    assert context["model"] == "small"
+    assert is_stalled(context) is False
+
+    context = {"log_level": "quiet", "stall_strategy": "rewrite", "stall_threshold": 1, "file_count": 1}
+    assert run_epochs(context, [[name_error], [name_error]]) == [None, "rewrite"]
+    assert is_stalled(context) is True
+    _, functions, actions = compose_action_request(context)
+    assert [f["name"] for f in functions] == ["write_code"]
+    assert [f["function"]["name"] for f in actions] == ["write_code"]
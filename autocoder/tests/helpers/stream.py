@@ -0,0 +1,66 @@
+import io
+import json
+
+from autocoder.helpers.stream import (
+    feed_arguments,
+    new_argument_parser,
+    partial_field,
+    progress_printer,
+    read_function_stream,
+)
+
+arguments = {
+    "reasoning": 'Print "hello"\nthen exit',
+    "filepath": "main.py",
+    "code": "def main():\n\tprint('hello \\u00e9')\n",
+    "start_line": 3,
+    "end_line": -1,
+    "options": {"flags": ["a", "}"], "ok": True},
+}
+
+
+def test_feed_arguments():
+    text = json.dumps(arguments, indent=1)
+    parser = new_argument_parser()
+    completed = []
+    partials = []
+    # One character at a time, so every escape and number is split across chunks
+    for character in text:
+        completed += feed_arguments(parser, character)
+        partial = partial_field(parser)
+        if partial is not None and partial[0] == "code":
+            partials.append(partial[1])
+    assert parser["state"] == "done"
+    assert completed == list(arguments.items())
+    assert parser["fields"] == arguments
+    assert all(arguments["code"].startswith(partial) for partial in partials)
+
+    parser = new_argument_parser()
+    assert feed_arguments(parser, "not json") == []
+    assert parser["state"] == "invalid"
+
+
+def test_read_function_stream():
+    text = json.dumps({"reasoning": "Because", "filepath": "main.py", "code": "print(1)\nprint(2)\n"})
+    chunks = [{"choices": [{"delta": {"role": "assistant", "function_call": {"name": "write_code", "arguments": ""}}}]}]
+    chunks += [
+        {"choices": [{"delta": {"function_call": {"arguments": text[i : i + 7]}}, "finish_reason": None}]}
+        for i in range(0, len(text), 7)
+    ]
+    chunks.append({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+
+    seen = []
+    output = io.StringIO()
+    result = read_function_stream(
+        iter(chunks),
+        on_field=lambda name, key, value, fields: seen.append((name, key, dict(fields))),
+        on_progress=progress_printer(output),
+    )
+    assert result["function_name"] == "write_code"
+    assert result["arguments_text"] == text
+    assert result["finish_reason"] == "stop"
+    assert [key for _, key, _ in seen] == ["reasoning", "filepath", "code"]
+    # Each field is reported with the ones before it
+    assert seen[1] == ("write_code", "filepath", {"reasoning": "Because", "filepath": "main.py"})
+    assert "write_code: code 2 lines" in output.getvalue()
+    assert output.getvalue().endswith("\n") and output.getvalue().rstrip().endswith("write_code: done")
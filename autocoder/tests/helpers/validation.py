@@ -0,0 +1,77 @@
+from autocoder.helpers.validation import (
+    cached_validation,
+    clear_parse_cache,
+    clear_validation_cache,
+    parse_code,
+    validate_parsed,
+)
+from autocoder.helpers.code import extract_imports, organize_imports, validate_source
+
+
+def test_parse_code_is_cached():
+    clear_parse_cache()
+    code = "import os\n\ndef hello():\n    print('Hello, world!')\n\nhello()\n"
+    parsed = parse_code(code)
+    assert parse_code(code) is parsed
+    assert parse_code(code + "\n") is not parsed
+
+
+def test_parse_code_facts():
+    code = """
+import os
+from random import randint
+
+def hello():
+    print(randint(1, 10))
+
+hello()
+"""
+    facts = parse_code(code)["facts"]
+    assert facts["has_function_definition"] is True
+    assert facts["has_root_call"] is True
+    assert [entry["module"] for entry in facts["imports"]] == ["os", "random"]
+
+
+def test_parse_code_syntax_error():
+    parsed = parse_code("def hello(:\n")
+    assert parsed["tree"] is None
+    assert isinstance(parsed["error"], SyntaxError)
+    assert parsed["facts"]["has_function_definition"] is False
+
+
+def test_validate_parsed_no_functions():
+    result = validate_parsed(parse_code("x = 1\ny = 2\n"))
+    assert result["success"] is False
+    assert "doesn't call any functions" in result["error"]
+
+
+def test_organize_imports_does_not_modify_cached_tree():
+    code = "import sys\nimport os\nimport sys\n\nprint(os.getcwd())\n"
+    parsed = parse_code(code)
+    body_length = len(parsed["tree"].body)
+    organize_imports(code)
+    assert len(parsed["tree"].body) == body_length
+    assert extract_imports(code, ".") == set()
+
+
+def test_cached_validation_skips_unchanged_code():
+    clear_validation_cache()
+    calls = []
+
+    def validate(code):
+        calls.append(code)
+        return {"success": True, "error": None}
+
+    cached_validation("print('a')", validate)
+    cached_validation("print('a')", validate)
+    cached_validation("print('b')", validate)
+    assert calls == ["print('a')", "print('b')"]
+
+
+def test_validate_source_compile_error_is_cached():
+    clear_validation_cache()
+    first = validate_source("print('Hello, world!")
+    second = validate_source("print('Hello, world!")
+    assert first == second
+    assert first["success"] is False
+    assert "line 1" in first["error"]
@@ -3,13 +3,19 @@ import shutil
 from autocoder.helpers.files import get_full_path
 
 from autocoder.steps.act import (
+    compose_action_request,
     create_handler,
     create_new_file_handler,
     delete_file_handler,
+    finish_streamed_work,
     insert_code_handler,
     remove_code_handler,
+    repair_response,
     replace_code_handler,
+    replace_code_preview,
+    start_streamed_work,
     write_complete_script_handler,
+    write_complete_script_preview,
 )
 
 
@@ -194,3 +200,68 @@ def test_delete_file_handler():
     assert not os.path.exists(test_file_path), f"{test_file_path} was not deleted"
 
     teardown_function()
+
+
+def test_repair_response():
+    setup_function()
+    context = {"project_dir": "test_dir", "log_level": "quiet"}
+    with open("test_dir/main.py", "w") as f:
+        f.write("def main():\n    print('Old line')\n\nmain()")
+    previews = {"replace_code": replace_code_preview, "write_code": write_complete_script_preview}
+    broken = {
+        "function_name": "replace_code",
+        "arguments": {"reasoning": "", "filepath": "main.py", "code": "print('New line'", "start_line": 2, "end_line": 2},
+    }
+    fixed = {
+        "function_name": "replace_code",
+        "arguments": {"reasoning": "", "filepath": "main.py", "code": "    print('New line')", "start_line": 2, "end_line": 2},
+    }
+    asked = []
+
+    def ask(errors):
+        asked.append(errors)
+        return fixed
+
+    assert repair_response(broken, ask, previews, context) is fixed
+    assert len(asked) == 1
+    assert asked[0].startswith("main.py: ")
+    assert "[2] print('New line'" in asked[0]
+    assert context["repair_attempts"] == 1
+    # Nothing was written while repairing
+    with open("test_dir/main.py", "r") as f:
+        assert "Old line" in f.read()
+
+    # Gives up after max_repair_attempts and returns the last response
+    asked.clear()
+    context["max_repair_attempts"] = 2
+    assert repair_response(broken, lambda errors: asked.append(errors) or broken, previews, context) is broken
+    assert len(asked) == 2
+    teardown_function()
+
+
+def test_compose_action_request():
+    context = {"file_count": 1, "goal": "Say hello", "reasoning": None, "log_level": "quiet"}
+    text, functions, actions = compose_action_request(context)
+    names = [function["name"] for function in functions]
+    assert names == [action["function"]["name"] for action in actions]
+    assert "replace_code" in names and "write_code" in names
+    assert "Say hello" in text
+    assert "{{reasoning}}" not in text
+    assert context["available_action_names"] == "Available functions: " + ", ".join(names)
+
+    context["file_count"] = 0
+    text, functions, actions = compose_action_request(context)
+    assert [function["name"] for function in functions] == ["create"]
+
+
+def test_streamed_work():
+    setup_function()
+    context = {"project_dir": "test_dir", "log_level": "quiet"}
+    work = start_streamed_work(context)
+    work["on_field"]("write_code", "reasoning", "Print the time", {})
+    work["on_field"]("write_code", "code", "import requests\nimport os\nprint( os.getcwd() )", {})
+    work["on_field"]("replace_code", "code", "import numpy", {})
+    context = finish_streamed_work(context, work)
+    assert context["streamed_imports"] == ["requests"]
+    assert len(work["futures"]) == 1
+    teardown_function()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from autocoder.helpers.context import (
+    analyze_files,
+    assume_execution_passed,
+    collect_errors,
+    collect_files,
+    read_and_format_code,
+    run_main,
+    run_tests,
+    validate_files,
+)
+from autocoder.steps.reason import autofix_checks, compose_completion_check, take_speculative_response
+
+main_code = """def add(a, b):
+    return a + b
+
+
+if __name__ == "__main__":
+    print(add(1, 2))
+"""
+
+test_code = """from main import add
+
+
+def test_add():
+    assert add(1, 2) == 3
+"""
+
+
+def write_project(directory, main, test):
+    with open(os.path.join(directory, "main.py"), "w") as f:
+        f.write(main)
+    with open(os.path.join(directory, "test_add.py"), "w") as f:
+        f.write(test)
+
+
+def checked_context(directory, fused=False):
+    context = {"project_dir": directory, "goal": "Add numbers", "fused_steps": fused, "file_count": 2}
+    for check in [collect_files, validate_files, analyze_files]:
+        context = check(context)
+    return context
+
+
+def run_checks(context):
+    for check in [run_tests, run_main, collect_errors, read_and_format_code]:
+        context = check(context)
+    return context
+
+
+def speculate(context, response):
+    speculative = compose_completion_check(assume_execution_passed(context))
+    speculative["future"] = Future()
+    speculative["future"].set_result(response)
+    speculative["cancel"] = threading.Event()
+    context["speculation_stats"] = {"sent": 1, "used": 0, "discarded": 0}
+    return speculative
+
+
+def test_speculative_check_matches_passing_run():
+    response = {"arguments": {"is_valid_and_complete": True, "reasoning": "done"}}
+    for fused in [False, True]:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            write_project(tmpdirname, main_code, test_code)
+            context = checked_context(tmpdirname, fused)
+            speculative = speculate(context, response)
+            context = run_checks(context)
+            assert context["errors"] == []
+            check = compose_completion_check(context)
+            assert take_speculative_response(context, speculative, check) is response
+            assert context["speculation_stats"] == {"sent": 1, "used": 1, "discarded": 0}
+
+
+def test_speculative_check_discarded_when_results_differ():
+    response = {"arguments": {"is_valid_and_complete": True, "reasoning": "done"}}
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_project(tmpdirname, main_code, test_code.replace("== 3", "== 4"))
+        context = checked_context(tmpdirname)
+        speculative = speculate(context, response)
+        context = run_checks(context)
+        assert context["project_tested"] is False
+        check = compose_completion_check(context)
+        assert take_speculative_response(context, speculative, check) is None
+        assert context["speculation_stats"] == {"sent": 1, "used": 0, "discarded": 1}
+        # The request is stopped instead of left running
+        assert speculative["cancel"].is_set()
+
+
+def test_autofix_counts_saved_calls_only_when_checks_pass():
+    missing_import = main_code.replace("print(add(1, 2))", "print(os.getcwd())")
+    for test, saved in [(test_code, 1), (test_code.replace("== 3", "== 4"), 0)]:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            write_project(tmpdirname, missing_import, test)
+            context = checked_context(tmpdirname)
+            context.update({"project_name": "autofix", "log_level": "quiet", "last_checks_passed": False})
+            autofix_checks(context, None)
+            assert context["autofix_stats"]["fixes"] == 1
+            # When the test still fails the model is needed anyway
+            assert context["last_checks_passed"] is (saved == 1)
+            assert context["autofix_stats"]["model_calls_saved"] == saved
@@ -0,0 +1,6 @@
+def main():
+print("this is clearly not right")
+
+
+if __name__ == "__main__":
+main()
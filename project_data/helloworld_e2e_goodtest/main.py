@@ -0,0 +1,6 @@
+def main():
+    print("hello world")
+
+
+if __name__ == "__main__":
+main()
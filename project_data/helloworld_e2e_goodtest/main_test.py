@@ -0,0 +1,9 @@
+def test_main(capsys):
+    captured = capsys.readouterr()
+
+    from main import main
+    main()
+
+    captured = capsys.readouterr()
+    assert captured.out == "hello world2
+"
@@ -93,6 +93,14 @@ def run(project_data):
     if os.path.exists(options_path):
         with open(options_path, "r") as f:
             options = json.load(f)
+    # Budgets and model servers set for the project win over the ones in .preferences
+    from autocoder.helpers.backends import backend_keys, needs_openai_key
+    from autocoder.helpers.budget import budget_keys
+
+    for key in budget_keys + backend_keys:
+        if project_data.get(key) is None and options.get(key) is not None:
+            project_data[key] = options[key]
+
     api_key = (
         project_data.get("api_key")
         or options.get("api_key")
@@ -100,7 +108,8 @@ def run(project_data):
     )
     if api_key is not None:
         os.environ["OPENAI_API_KEY"] = api_key
-    while not api_key:
+    # Local servers and other API bases don't take an OpenAI key
+    while not api_key and needs_openai_key(project_data):
         api_key = input("Enter your API OpenAI key: ")
         if not api_key.startswith("sk-") or len(api_key) < 8:
             print("Invalid API key.")
@@ -118,7 +127,7 @@ def run(project_data):
 
     project_data["step"] = options.get("step", False)
     project_data["log_level"] = options.get("log_level", "normal")
-    project_data["model"] = options.get("model", "gpt-3.5-turbo-0613")
+    project_data["model"] = project_data.get("model") or options.get("model", "gpt-3.5-turbo-0613")
 
     autocoder(project_data)
     sys.exit(0)